@@ -0,0 +1,80 @@
+"""Compare the jsonb and binary COPY write paths used by Syncer.bulk_board_insert.
+
+Run against a local/scratch database only - rows are written under a throwaway season id and removed afterwards.
+
+    python -m benchmarks.board_insert [repeats]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import creds
+
+from cogs.utils.db import setup_db
+from cogs.utils.board_writes import copy_board_update, json_board_update
+
+SCRATCH_SEASON_ID = -1
+SIZES = (1_000, 10_000, 100_000)
+REPEATS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+
+def make_rows(number):
+    rows = []
+    for i in range(number):
+        old_dons = random.randint(0, 5000)
+        old_rec = random.randint(0, 5000)
+        rows.append((
+            f'#BENCH{i}',
+            old_dons,
+            old_dons + random.randint(0, 50),
+            old_rec,
+            old_rec + random.randint(0, 50),
+            random.randint(1000, 6000),
+            29000022,
+            f'#CLAN{i // 50}',
+            f'bench player {i}',
+        ))
+    return rows
+
+
+async def seed(pool, number):
+    await pool.execute("DELETE FROM players WHERE season_id = $1", SCRATCH_SEASON_ID)
+    await pool.execute(
+        """INSERT INTO players (player_tag, donations, received, trophies, best_trophies, season_id)
+           SELECT '#BENCH' || n, 0, 0, 0, 0, $1 FROM generate_series(0, $2 - 1) AS n
+        """,
+        SCRATCH_SEASON_ID,
+        number
+    )
+
+
+async def time_path(pool, func, rows):
+    timings = []
+    for _ in range(REPEATS):
+        async with pool.acquire() as conn:
+            s = time.perf_counter()
+            await func(conn, rows, SCRATCH_SEASON_ID)
+            timings.append((time.perf_counter() - s) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[0]
+
+
+async def main():
+    pool = await setup_db()
+    print(f"{'rows':>8} | {'jsonb median':>13} | {'jsonb best':>11} | {'copy median':>12} | {'copy best':>10}")
+    try:
+        for size in SIZES:
+            await seed(pool, size)
+            rows = make_rows(size)
+            json_median, json_best = await time_path(pool, json_board_update, rows)
+            copy_median, copy_best = await time_path(pool, copy_board_update, rows)
+            print(f"{size:>8} | {json_median:>11.1f}ms | {json_best:>9.1f}ms | {copy_median:>10.1f}ms | {copy_best:>8.1f}ms")
+    finally:
+        await pool.execute("DELETE FROM players WHERE season_id = $1", SCRATCH_SEASON_ID)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    print(f"benchmarking against {creds.postgres.rsplit('@', 1)[-1]}, {REPEATS} repeats per path")
+    asyncio.get_event_loop().run_until_complete(main())
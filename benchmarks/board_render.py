@@ -0,0 +1,92 @@
+"""Compare spawning wkhtmltoimage per board against the warm RendererPool used by SyncBoards, and the Pillow renderer.
+
+Needs wkhtmltoimage on the PATH for the cold path and libwkhtmltox for the pool; nothing touches the database.
+
+    python -m benchmarks.board_render [repeats]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from datetime import timedelta
+
+from cogs.utils.images import BoardImage
+from cogs.utils.render_pool import RendererPool, cold_render
+from syncboards import HTMLImages
+
+SIZES = (15, 25, 50)
+REPEATS = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+
+def make_players(number):
+    players = []
+    for i in range(number):
+        donations = random.randint(0, 5000)
+        players.append({
+            'emoji': '',
+            'player_name': f'bench player {i}',
+            'donations': donations,
+            'received': random.randint(0, 5000),
+            'last_online': timedelta(seconds=random.randint(0, 86400 * 3)),
+        })
+    players.sort(key=lambda p: p['donations'], reverse=True)
+    return players
+
+
+async def make_html(number):
+    table = HTMLImages(make_players(number), sort_by='donations', footer="Season: bench.", board_type='donation')
+    html = await table.build_html()
+    return html.encode('utf-8')
+
+
+async def make_pillow_board(number):
+    # no session, so it's drawn on the plain fallback background rather than downloading one.
+    table = BoardImage(make_players(number), "Donation Leaderboard", None, sort_by='donations', footer="Season: bench.")
+    await table.prepare()
+    return table
+
+
+async def time_path(render, html):
+    timings = []
+    for _ in range(REPEATS):
+        s = time.perf_counter()
+        await render(html)
+        timings.append((time.perf_counter() - s) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+async def main():
+    pool = RendererPool(size=1)
+    s = time.perf_counter()
+    await pool.start()
+    if not pool.available:
+        print("renderer workers failed to start (is libwkhtmltox installed?)")
+        return
+    print(f"pool started in {(time.perf_counter() - s) * 1000:.1f}ms")
+
+    print(f"{'rows':>5} | {'cold median':>12} | {'cold p95':>9} | {'warm median':>12} | {'warm p95':>9} | {'pillow median':>14} | {'pillow p95':>11}")
+    try:
+        for size in SIZES:
+            html = await make_html(size)
+            # one untimed render each, so neither path is measured loading fonts from a cold disk cache.
+            await cold_render(html)
+            await pool.render(html)
+            board = await make_pillow_board(size)
+            await board.render()
+
+            cold_median, cold_p95 = await time_path(cold_render, html)
+            warm_median, warm_p95 = await time_path(pool.render, html)
+            pillow_median, pillow_p95 = await time_path(lambda _: board.render(), None)
+            print(
+                f"{size:>5} | {cold_median:>10.1f}ms | {cold_p95:>7.1f}ms | {warm_median:>10.1f}ms | {warm_p95:>7.1f}ms"
+                f" | {pillow_median:>12.1f}ms | {pillow_p95:>9.1f}ms"
+            )
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    print(f"{REPEATS} repeats per path")
+    asyncio.get_event_loop().run_until_complete(main())
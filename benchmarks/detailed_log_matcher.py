@@ -0,0 +1,144 @@
+"""Compare the detailed donation log matcher with the nested-loop version it replaced.
+
+Every synthetic clan is run through both and the responses are checked to be identical before timings are reported.
+No database or API access is needed.
+
+    python -m benchmarks.detailed_log_matcher [repeats]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from datetime import timedelta
+
+from cogs.utils.db_objects import LogConfig
+from cogs.utils.donationtrophylogs import (
+    SlimDonationEvent2, format_donation_log_message_test, get_matches_for_detailed_log
+)
+
+CLAN_SIZES = (10, 20, 30, 40, 50)
+CLANS_PER_SIZE = 20
+REPEATS = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+# housing space of the troops people usually request, so amounts collide the way they do in a real clan.
+TROOP_SPACE = (1, 2, 5, 6, 8, 10, 12, 16, 20, 25, 30, 35, 40, 45)
+
+
+def legacy_received_combos(clan_events):
+    valid_events = [n for n in clan_events if n.received]
+    combos = {}
+    for n in valid_events:
+        for x in valid_events:
+            if n == x:
+                continue
+            combos[n.received + x.received] = (n, x)
+
+            for y in valid_events:
+                if y == x or y == n:
+                    continue
+
+                combos[x.received + n.received + y.received] = (n, x, y)
+
+    return combos
+
+
+def legacy_matches(clan_events):
+    responses = {
+        "exact": [],
+        "combo": [],
+        "unknown": []
+    }
+
+    donation_matches = [x for x in clan_events if
+                        x.donations and x.donations in set(n.received for n in clan_events if n.tag != x.tag)]
+
+    for match in donation_matches:
+        corresponding_received = [x for x in clan_events if x.received == match.donations and x.tag != match.tag]
+
+        if not corresponding_received:
+            continue
+        if len(corresponding_received) > 1:
+            continue
+        if match not in clan_events:
+            continue
+        if corresponding_received[0] not in clan_events:
+            continue
+
+        responses["exact"].append(format_donation_log_message_test(match))
+        clan_events.remove(match)
+
+        responses["exact"].append(format_donation_log_message_test(corresponding_received[0]))
+        clan_events.remove(corresponding_received[0])
+
+    possible_received_combos = legacy_received_combos(clan_events)
+
+    matches = [n for n in clan_events if n.donations in possible_received_combos.keys()]
+
+    for event in matches:
+        received_combos = possible_received_combos.get(event.donations)
+        if not all(x in clan_events for x in received_combos):
+            continue
+
+        if not received_combos:
+            continue
+
+        for x in (event, *received_combos):
+            responses["combo"].append(format_donation_log_message_test(x))
+            clan_events.remove(x)
+
+    for event in clan_events:
+        responses["unknown"].append(format_donation_log_message_test(event))
+        clan_events.remove(event)
+
+    return responses
+
+
+def make_clan(size, log_config):
+    events = []
+    for i in range(size):
+        tag, name = f'#BENCH{i}', f'bench player {i}'
+        # a war-prep wave: most members both fill and request several camps' worth between two syncs.
+        for _ in range(random.randint(1, 3)):
+            amount = sum(random.choice(TROOP_SPACE) for _ in range(random.randint(1, 3)))
+            if random.random() < 0.5:
+                events.append(SlimDonationEvent2(amount, 0, name, tag, '#CLAN', 'bench clan', log_config))
+            else:
+                events.append(SlimDonationEvent2(0, amount, name, tag, '#CLAN', 'bench clan', log_config))
+    random.shuffle(events)
+    return events
+
+
+def time_matcher(func, clans):
+    timings = []
+    for _ in range(REPEATS):
+        s = time.perf_counter()
+        for clan in clans:
+            func(list(clan))
+        timings.append((time.perf_counter() - s) * 1000 / len(clans))
+    timings.sort()
+    return timings[len(timings) // 2], timings[0]
+
+
+def main():
+    log_config = LogConfig(bot=None, record=dict(
+        guild_id=1, channel_id=1, interval=timedelta(), toggle=True, type='donation', detailed=True
+    ))
+
+    def matches(clan_events):
+        return asyncio.get_event_loop().run_until_complete(get_matches_for_detailed_log(clan_events))
+
+    print(f"{'members':>8} {'events':>8} {'legacy ms':>20} {'indexed ms':>20}")
+    for size in CLAN_SIZES:
+        clans = [make_clan(size, log_config) for _ in range(CLANS_PER_SIZE)]
+        for clan in clans:
+            assert matches(list(clan)) == legacy_matches(list(clan)), 'matcher output differs from the legacy version'
+
+        legacy = time_matcher(legacy_matches, clans)
+        indexed = time_matcher(matches, clans)
+        events = sum(len(n) for n in clans) // len(clans)
+        print(f"{size:>8} {events:>8} {legacy[0]:>10.2f} (best {legacy[1]:.2f}) {indexed[0]:>10.2f} (best {indexed[1]:.2f})")
+
+
+if __name__ == "__main__":
+    main()
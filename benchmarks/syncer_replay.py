@@ -0,0 +1,419 @@
+"""End-to-end syncer throughput: replay clan responses through Syncer and time the event handlers and flushes.
+
+Clan responses are either recorded from the API or generated with realistic donation, trophy, join and leave churn.
+Each replayed loop parses every clan's response, runs it through ``Syncer.on_clan_update`` as coc.py would,
+then runs ``Syncer.dispatch_callbacks`` (the flush pipeline) against a real database.
+Discord sends, Google logging and the coc API are stubbed; players fetched for member joins are built from the
+replayed member lists.
+
+Run against a local/scratch database only, with the full schema loaded (tables.sql plus the tables it's missing,
+eg. logs.detailed, legend_days and activity_query). Scratch rows go under a new season, a negative guild ID and
+negative channel IDs, and are removed afterwards. Set ``BENCH_POSTGRES`` to use a different DSN to creds.postgres.
+Each synthetic scenario runs in its own process.
+
+    python -m benchmarks.syncer_replay synthetic [loops] [clans]  # 100, 1,000 and 10,000 clans by default
+    python -m benchmarks.syncer_replay record <dir> <loops> [clans] [interval]   # real responses, needs an API key
+    python -m benchmarks.syncer_replay replay <dir>
+"""
+import asyncio
+import contextvars
+import datetime
+import gzip
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+from collections import Counter
+from pathlib import Path
+
+import coc
+import creds
+
+SCENARIOS = (100, 1_000, 10_000)
+DEFAULT_LOOPS = 10
+BENCH_GUILD_ID = -1
+# share of clans with donation and trophy logs set up, and of those, donation logs that are detailed.
+LOGGED_CLAN_SHARE = 0.5
+DETAILED_LOG_SHARE = 0.3
+
+# per member, per loop.
+DONATE_CHANCE = 0.03
+TROPHY_CHANCE = 0.01
+# per clan, per loop.
+JOIN_CHANCE = 0.02
+LEAVE_CHANCE = 0.02
+LEGEND_SHARE = 0.1
+TROOP_SPACE = (1, 2, 5, 6, 8, 10, 12, 16, 20, 25, 30, 35, 40, 45)
+
+STATEMENT_METHODS = ('execute', 'executemany', 'fetch', 'fetchrow', 'fetchval', 'copy_records_to_table')
+
+current_stage = contextvars.ContextVar('current_stage', default='events')
+statements = Counter()
+
+
+def make_member(tag, rng):
+    legend = rng.random() < LEGEND_SHARE
+    trophies = rng.randint(5000, 6000) if legend else rng.randint(1000, 4999)
+    return {
+        "tag": tag,
+        "name": f"bench {tag[-6:]}",
+        "role": "member",
+        "expLevel": rng.randint(50, 250),
+        "league": {"id": 29000022 if legend else 29000015, "name": "Legend League" if legend else "Master League",
+                   "iconUrls": {"small": "https://api-assets.clashofclans.com/leagues/72/R2zmhyqQ0_lKcDR5EyghXCxgyC9mm_mVMIjAbmGoZtw.png"}},
+        "trophies": trophies,
+        "versusTrophies": rng.randint(1000, 5000),
+        "clanRank": 0,
+        "previousClanRank": 0,
+        "donations": 0,
+        "donationsReceived": 0,
+    }
+
+
+class SyntheticClans:
+    """Generates one loop of raw clan responses at a time, changing members the way a busy clan does between polls."""
+    def __init__(self, number, seed=0):
+        self.rng = rng = random.Random(seed)
+        self.next_player = 0
+        self.clans = {}
+        for i in range(number):
+            tag = f"#BENCHC{i}"
+            self.clans[tag] = {
+                "tag": tag,
+                "name": f"bench clan {i}",
+                "type": "inviteOnly",
+                "description": "a clan for benchmarking the syncer",
+                "badgeUrls": {"small": "https://api-assets.clashofclans.com/badges/70/bench.png"},
+                "clanLevel": rng.randint(1, 20),
+                "clanPoints": rng.randint(10000, 50000),
+                "requiredTrophies": 4000,
+                "memberList": [make_member(self._player_tag(), rng) for _ in range(rng.randint(10, 50))],
+            }
+
+    def _player_tag(self):
+        self.next_player += 1
+        return f"#BENCHP{self.next_player}"
+
+    def step(self):
+        rng = self.rng
+        for clan in self.clans.values():
+            members = clan["memberList"]
+            for member in members:
+                if rng.random() < DONATE_CHANCE:
+                    amount = rng.choice(TROOP_SPACE)
+                    member["donations"] += amount
+                    rng.choice(members)["donationsReceived"] += amount
+                if rng.random() < TROPHY_CHANCE:
+                    member["trophies"] = max(0, member["trophies"] + rng.choice((1, -1)) * rng.randint(5, 40))
+
+            if len(members) > 1 and rng.random() < LEAVE_CHANCE:
+                members.pop(rng.randrange(len(members)))
+            if len(members) < 50 and rng.random() < JOIN_CHANCE:
+                members.append(make_member(self._player_tag(), rng))
+            clan["members"] = len(members)
+
+    def loop(self):
+        return [json.dumps(clan).encode() for clan in self.clans.values()]
+
+
+async def record(directory, loops, number, interval):
+    import asyncpg
+    # coc.login runs its own run_until_complete, which can't be done from inside this coroutine.
+    client = coc.Client(key_names="syncer replay", key_count=1, key_scopes=creds.scopes)
+    await client.login(creds.email, creds.password)
+    conn = await asyncpg.connect(os.environ.get('BENCH_POSTGRES', creds.postgres))
+    tags = [n[0] for n in await conn.fetch("SELECT DISTINCT clan_tag FROM clans LIMIT $1", number)]
+    await conn.close()
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(loops):
+        start = time.monotonic()
+        responses = await asyncio.gather(*(client.http.get_clan(tag) for tag in tags), return_exceptions=True)
+        with gzip.open(directory / f"loop-{i:04}.jsonl.gz", "wb") as fp:
+            for data in responses:
+                if isinstance(data, dict):
+                    data.pop("_response_retry", None)
+                    fp.write(json.dumps(data).encode() + b"\n")
+        print(f"recorded loop {i} of {len(tags)} clans")
+        await asyncio.sleep(max(0, interval - (time.monotonic() - start)))
+    await client.close()
+
+
+def recorded_loops(directory):
+    for path in sorted(directory.glob("loop-*.jsonl.gz")):
+        with gzip.open(path, "rb") as fp:
+            yield [line for line in fp.read().split(b"\n") if line]
+
+
+class ReplayHTTP:
+    """Stands in for coc.py's HTTPClient. Players are built from the member lists of the loop being replayed."""
+    def __init__(self):
+        self.stats = {}
+        self.clans = []
+        self._members = None
+
+    def set_loop(self, clans):
+        self.clans = clans
+        self._members = None
+
+    async def get_player(self, tag):
+        if self._members is None:
+            self._members = {m["tag"]: m for clan in self.clans for m in clan.get("memberList", [])}
+        member = self._members[tag]
+        data = {**member, "bestTrophies": member["trophies"], "attackWins": 0, "defenseWins": 0}
+        if member.get("league", {}).get("id") == 29000022:
+            data["legendStatistics"] = {"legendTrophies": max(0, member["trophies"] - 5000)}
+        return data
+
+
+def offline_login(email, password, client=coc.Client, **kwargs):
+    instance = client(**kwargs)
+    instance.http = ReplayHTTP()
+    return instance
+
+
+class NullLogger:
+    def log_struct(self, *args, **kwargs):
+        pass
+
+
+def quiet_logging(bot):
+    for name in ('message_log', 'command_log', 'guild_log', 'clan_log', 'google_logger', 'board_log'):
+        setattr(bot, name, NullLogger())
+    logging.basicConfig(level=logging.WARNING)
+
+
+class CountingConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in STATEMENT_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            statements[current_stage.get()] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingAcquire:
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    async def __aenter__(self):
+        return CountingConnection(await self._ctx.__aenter__())
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+    def __await__(self):
+        conn = yield from self._ctx.__await__()
+        return CountingConnection(conn)
+
+
+class CountingPool(CountingConnection):
+    """Counts the statements run through an asyncpg pool, by the flush stage (or 'events') that ran them."""
+    def acquire(self, *args, **kwargs):
+        return CountingAcquire(self._conn.acquire(*args, **kwargs))
+
+    async def release(self, conn, *args, **kwargs):
+        return await self._conn.release(getattr(conn, '_conn', conn), *args, **kwargs)
+
+
+def in_stage(name, func):
+    async def wrapped():
+        current_stage.set(name)
+        return await func()
+    return wrapped
+
+
+async def sent(*args, **kwargs):
+    statements['discord sends'] += 1
+    return {}
+
+
+async def seed(pool, first_loop):
+    season_id = await pool.fetchval(
+        "INSERT INTO seasons (start, finish) VALUES (now() - interval '1 second', now() + interval '30 days') RETURNING id"
+    )
+    await pool.execute("INSERT INTO guilds (guild_id) VALUES ($1) ON CONFLICT DO NOTHING", BENCH_GUILD_ID)
+
+    rng = random.Random(0)
+    clans, logs, players = [], [], []
+    for i, clan in enumerate(first_loop):
+        channel_id = -1000 - i
+        clans.append((clan["tag"], clan["name"], channel_id, BENCH_GUILD_ID))
+        if rng.random() < LOGGED_CLAN_SHARE:
+            logs.append((BENCH_GUILD_ID, channel_id, 'donation', rng.random() < DETAILED_LOG_SHARE))
+            logs.append((BENCH_GUILD_ID, channel_id, 'trophy', False))
+        for m in clan.get("memberList", []):
+            players.append((m["tag"], season_id, m["donations"], m["donationsReceived"], m["trophies"],
+                            m["trophies"], clan["tag"], m["name"], m.get("league", {}).get("id")))
+
+    await pool.executemany("INSERT INTO clans (clan_tag, clan_name, channel_id, guild_id) VALUES ($1, $2, $3, $4)", clans)
+    await pool.executemany(
+        "INSERT INTO logs (guild_id, channel_id, type, detailed, toggle, interval) "
+        "VALUES ($1, $2, $3, $4, TRUE, '0 minutes'::interval)",
+        logs
+    )
+    await pool.executemany(
+        "INSERT INTO players (player_tag, season_id, donations, received, trophies, start_trophies, clan_tag, "
+        "player_name, league_id) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9) ON CONFLICT DO NOTHING",
+        players
+    )
+    return season_id
+
+
+async def cleanup(pool, season_id, legend_day):
+    tags = [n[0] for n in await pool.fetch("SELECT player_tag FROM players WHERE season_id = $1", season_id)]
+    await pool.execute("DELETE FROM legend_days WHERE day >= $1 AND player_tag = ANY($2::TEXT[])", legend_day, tags)
+    await pool.execute("DELETE FROM legend_day_finalisations WHERE day >= $1", legend_day)
+    await pool.execute("DELETE FROM players WHERE season_id = $1", season_id)
+    await pool.execute("DELETE FROM logs WHERE guild_id = $1", BENCH_GUILD_ID)
+    await pool.execute("DELETE FROM clans WHERE guild_id = $1", BENCH_GUILD_ID)
+    await pool.execute("DELETE FROM guilds WHERE guild_id = $1", BENCH_GUILD_ID)
+    await pool.execute("DELETE FROM seasons WHERE id = $1", season_id)
+
+
+def import_syncer():
+    """Import the syncer module offline: no coc.py login, no Google logging, and every statement counted."""
+    if os.environ.get('BENCH_POSTGRES'):
+        creds.postgres = os.environ['BENCH_POSTGRES']
+    coc.login = offline_login
+    import botlog
+    botlog.setup_logging = quiet_logging
+
+    import syncer
+    syncer.pool = CountingPool(syncer.pool)
+    syncer.bot.http.send_message = sent
+    return syncer
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def replay(syncer, loops, label):
+    from cogs.utils.legend_days import legend_day_bounds
+
+    loops = iter(loops)
+    first = next(loops)
+    pool = syncer.pool._conn
+    season_id = await seed(pool, [json.loads(n) for n in first])
+    legend_day = legend_day_bounds(datetime.datetime.utcnow())[0]
+
+    s = syncer.Syncer()
+    s.loop = asyncio.get_event_loop()
+    await s.get_season_id()
+    if s.season_id != season_id:
+        print(f"warning: the syncer picked season {s.season_id}, not the scratch season {season_id}")
+    await s.log_routes.reload()
+    await s.legend.start_day(legend_day)
+    s.sender.start()
+    for stage in s.flush_pipeline.stages.values():
+        stage.func = in_stage(stage.name, stage.func)
+
+    coc_client = syncer.coc_client
+    clan_cls = coc_client.clan_cls
+    http = coc_client.http
+
+    async def poll(raw):
+        parsed = [json.loads(n) for n in raw]
+        http.set_loop(parsed)
+        for data in parsed:
+            clan = clan_cls(data=data, client=coc_client)
+            cached = coc_client._get_cached_clan(clan.tag)
+            coc_client._update_clan(clan)
+            if cached is not None:
+                await s.on_clan_update(cached, clan)
+
+    try:
+        # the first loop only fills the caches, like a fresh start.
+        await poll(first)
+        statements.clear()
+
+        poll_times, flush_times, stage_times = [], [], {}
+        events = loops_run = 0
+        for raw in loops:
+            start = time.perf_counter()
+            await poll(raw)
+            polled = time.perf_counter()
+            await s.dispatch_callbacks()
+            flushed = time.perf_counter()
+
+            poll_times.append(polled - start)
+            flush_times.append(flushed - polled)
+            for timing in s.flush_pipeline.last_timings:
+                stage_times.setdefault(timing.name, []).append(timing.elapsed)
+            events += len(s.drained_events.don_slot) + len(s.drained_events.trophy_slot)
+            loops_run += 1
+
+        while s.sender.pending:
+            await asyncio.sleep(0.1)
+    finally:
+        s.sender.stop()
+        await cleanup(pool, season_id, legend_day)
+
+    if not loops_run:
+        print(f"{label}: need at least two loops to replay")
+        return
+
+    busy = sum(poll_times) + sum(flush_times)
+    print(f"\n{label}: {loops_run} loops, {events} events, {events / busy:.0f} events/s of syncer time")
+    print(f"  poll + handlers per loop: median {percentile(poll_times, 0.5) * 1000:.1f}ms, "
+          f"p95 {percentile(poll_times, 0.95) * 1000:.1f}ms")
+    print(f"  flush per loop:           median {percentile(flush_times, 0.5) * 1000:.1f}ms, "
+          f"p95 {percentile(flush_times, 0.95) * 1000:.1f}ms")
+    print(f"  {'stage':<16} | {'median':>9} | {'p95':>9} | {'statements/loop':>15}")
+    for name, times in stage_times.items():
+        print(f"  {name:<16} | {percentile(times, 0.5):>7.1f}ms | {percentile(times, 0.95):>7.1f}ms | "
+              f"{statements[name] / loops_run:>15.1f}")
+    for name in ('events', 'discord sends'):
+        print(f"  {name:<16} | {'':>9} | {'':>9} | {statements[name] / loops_run:>15.1f}")
+
+
+def synthetic_loops(number, loops):
+    clans = SyntheticClans(number)
+    for _ in range(loops + 1):
+        yield clans.loop()
+        clans.step()
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+
+    if command == 'record':
+        directory, loops = Path(sys.argv[2]), int(sys.argv[3])
+        number = int(sys.argv[4]) if len(sys.argv) > 4 else 1_000
+        interval = float(sys.argv[5]) if len(sys.argv) > 5 else 60
+        loop.run_until_complete(record(directory, loops, number, interval))
+        return
+
+    if command == 'synthetic' and len(sys.argv) < 4:
+        # a fresh process per scenario, so caches and buffers from a smaller one don't skew the next.
+        loops = sys.argv[2] if len(sys.argv) > 2 else str(DEFAULT_LOOPS)
+        for number in SCENARIOS:
+            subprocess.run([sys.executable, '-m', 'benchmarks.syncer_replay', 'synthetic', loops, str(number)], check=True)
+        return
+
+    target = os.environ.get('BENCH_POSTGRES', creds.postgres).rsplit('@', 1)[-1]
+    print(f"benchmarking against {target}")
+    syncer = import_syncer()
+    if command == 'replay':
+        directory = Path(sys.argv[2])
+        loop.run_until_complete(replay(syncer, recorded_loops(directory), f"recorded ({directory})"))
+    else:
+        loops, number = int(sys.argv[2]), int(sys.argv[3])
+        loop.run_until_complete(replay(syncer, synthetic_loops(number, loops), f"{number} synthetic clans"))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,16 +9,16 @@ import sqlite3
 import sys
 import itertools
 import logging
-import json
+import time
 
-import asyncpg
 import sentry_sdk
 
 from coc.ext import discordlinks
 from discord.ext import commands
 
 from botlog import setup_logging, add_hooks
-from cogs.utils import context
+from cogs.utils import context, metrics
+from cogs.utils.db import setup_db
 from cogs.utils.error_handler import error_handler, discord_event_error
 
 sentry_sdk.init(creds.SENTRY_KEY)
@@ -80,6 +80,10 @@ intents.emojis = True
 
 log = logging.getLogger()
 
+# the metrics endpoint is served on localhost at this port.
+METRICS_PORT = 9103
+COMMAND_SECONDS = metrics.registry.histogram('bot_command_seconds', 'Time taken to run each command.', ('command', ))
+
 
 async def get_pref(bot, message):
     if command_prefix:
@@ -94,18 +98,6 @@ async def get_pref(bot, message):
     return commands.when_mentioned_or(prefix)(bot, message)
 
 
-async def setup_db():
-    def _encode_jsonb(value):
-        return json.dumps(value)
-
-    def _decode_jsonb(value):
-        return json.loads(value)
-
-    async def init(con):
-        await con.set_type_codec('jsonb', schema='pg_catalog', encoder=_encode_jsonb, decoder=_decode_jsonb, format='text')
-    return await asyncpg.create_pool(creds.postgres, init=init)
-
-
 class DonationBot(commands.AutoShardedBot):
     def __init__(self):
         super().__init__(command_prefix=get_pref, case_insensitive=True,
@@ -156,12 +148,14 @@ class DonationBot(commands.AutoShardedBot):
         return self.get_cog('BackgroundManagement')
 
     async def before_command_invoke(self, ctx):
+        ctx.invoked_at = time.perf_counter()
         if hasattr(ctx, 'before_invoke'):
             await ctx.before_invoke(ctx)
 
     async def after_command_invoke(self, ctx):
         if hasattr(ctx, 'after_invoke'):
             await ctx.after_invoke(ctx)
+        COMMAND_SECONDS.observe(time.perf_counter() - ctx.invoked_at, command=ctx.command.qualified_name)
 
     async def on_ready(self):
         self.error_webhooks = itertools.cycle(n for n in await self.get_channel(625160612791451661).webhooks())
@@ -227,6 +221,9 @@ if __name__ == '__main__':
         bot = DonationBot()
         bot.pool = loop.run_until_complete(setup_db())  # add db as attribute
         setup_logging(bot)
+        metrics.registry.gauge('discord_gateway_latency_seconds', 'Average heartbeat latency over all shards.',
+                               func=lambda: bot.latency)
+        loop.run_until_complete(metrics.start_metrics(METRICS_PORT, pool=bot.pool, coc_client=coc_client))
         bot.run(creds.bot_token)  # run bot
 
     except Exception:
@@ -4,13 +4,10 @@ import itertools
 import typing
 
 import discord
-import numpy as np
-import seaborn as sns
 
-from matplotlib import pyplot as plt
-from matplotlib import dates as mdates
 from discord.ext import commands, tasks
 
+from cogs.utils.charts import chart_worker, activity_bar_chart, activity_line_chart
 from cogs.utils.converters import ActivityBarConverter, ActivityLineConverter
 
 
@@ -124,10 +121,7 @@ class Activity(commands.Cog):
                           COALESCE((SELECT dark_mode FROM user_config WHERE user_id = $1), False) as dark_mode"""
         fetch = await ctx.db.fetchrow(query, ctx.author.id)
         timezone_offset = int(fetch['timezone_offset'])
-        if fetch['dark_mode']:
-            plt.style.use('dark_background')
-        else:
-            plt.style.use('default')
+        dark_mode = fetch['dark_mode']
 
         if not argument:
             return await ctx.send(f"Not enough history. Please try again later.")
@@ -153,34 +147,10 @@ class Activity(commands.Cog):
             }
 
         data_to_add = {**existing_graph_data, **data_to_add}
-
-        def get_width_offset(index):
-            width = 0.8 / len(data_to_add)
-            return width, width * index
-
-        y_pos = np.arange(24)
-        graphs = []
-
-        for i, (name, data) in enumerate(data_to_add.items()):
-            data = dict(sorted(data.items()))
-            width, offset = get_width_offset(i)
-            graphs.append((
-                plt.bar([n + offset for n in y_pos], list(data.values()), width, align='center'), name
-            ))
-
-        plt.xticks(y_pos, list(range(24)))
-        plt.xlabel(f"Time (hr) - UTC{'+' + str(timezone_offset) if timezone_offset > 0 else timezone_offset}")
-        plt.ylabel("Activity (average events)")
-        plt.title(f"Activity Graph - Time Period: {days + 1}d")
-        plt.legend(tuple(n[0] for n in graphs), tuple(n[1] for n in graphs))
-
         self.add_bar_graph(ctx.channel.id, ctx.author.id, **data_to_add)
 
-        b = io.BytesIO()
-        plt.savefig(b, format='png')
-        b.seek(0)
-        await ctx.send(file=discord.File(b, f'activitygraph.png'))
-        plt.close()
+        png = await chart_worker.render(activity_bar_chart, data_to_add, timezone_offset, days, dark_mode)
+        await ctx.send(file=discord.File(io.BytesIO(png), f'activitygraph.png'))
 
     @activity_bar.command(name='clear')
     async def activity_bar_clear(self, ctx):
@@ -225,10 +195,7 @@ class Activity(commands.Cog):
         """
         query = """SELECT COALESCE((SELECT dark_mode FROM user_config WHERE user_id = $1), False) as dark_mode"""
         fetch = await ctx.db.fetchrow(query, ctx.author.id)
-        if fetch['dark_mode']:
-            plt.style.use('dark_background')
-        else:
-            plt.style.use('default')
+        dark_mode = fetch['dark_mode']
 
         if not argument:
             return await ctx.send(f"Not enough history. Please try again later.")
@@ -240,54 +207,17 @@ class Activity(commands.Cog):
         if self.bot_wide_line:
             data.insert(0, self.bot_wide_line)
 
-        colours = sns.color_palette("hls", len(data))
-
-        fig, ax = plt.subplots()
-        min_date = None
-        max_date = None
-
-        for i, entry in enumerate(data):
-            name, record = entry
-            means = []
-            stdev = []
-            dates = []
-            for item in record:
-                means.append(item['counter'])
-                stdev.append(item['stdev'])
-                dates.append(item['date'])
-
-            meanst = np.array(means, dtype=np.float64)
-            sdt = np.array(stdev, dtype=np.float64)
-            ax.plot(dates, means, label=name, color=colours[i])
-
-            if name != "Bot Average":
-                ax.fill_between(dates, [max(0, n) for n in meanst - sdt], meanst + sdt, alpha=0.3, facecolor=colours[i])
-                if not min_date or dates[0] < min_date:
-                    min_date = dates[0]
-                if not max_date or dates[-1] > max_date:
-                    max_date = dates[-1]
-
-            locator = mdates.AutoDateLocator(minticks=3, maxticks=10)
-            formatter = mdates.ConciseDateFormatter(locator)
-            ax.xaxis.set_major_locator(locator)
-            ax.xaxis.set_major_formatter(formatter)
-
-            ax.legend()
-
-        ax.grid(True)
-        ax.set_ylabel("Activity")
-        ax.set_title("Activity Change Over Time")
-        ax.set_xlim(min_date, max_date)
+        # records can't be pickled, so the chart worker gets plain lists.
+        series = [
+            (name, [n['date'] for n in record], [n['counter'] for n in record], [n['stdev'] for n in record])
+            for name, record in data
+        ]
 
         data = [(n, v) for n, v in data if n != "Bot Average"]
-
         self.add_line_graph(ctx.channel.id, ctx.author.id, data)
 
-        b = io.BytesIO()
-        plt.savefig(b, format='png')
-        b.seek(0)
-        await ctx.send(file=discord.File(b, f'activitygraph.png'))
-        plt.close()
+        png = await chart_worker.render(activity_line_chart, series, dark_mode)
+        await ctx.send(file=discord.File(io.BytesIO(png), f'activitygraph.png'))
 
     @activity_line.command(name='clear')
     async def activity_line_clear(self, ctx):
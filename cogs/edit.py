@@ -12,6 +12,7 @@ from cogs.utils.checks import requires_config, manage_guild
 from cogs.utils.formatters import CLYTable
 from cogs.utils.converters import ClanConverter, DateConverter, TextChannel
 from cogs.utils import checks
+from syncboards import HTML_RENDERER, PILLOW_RENDERER
 
 log = logging.getLogger(__name__)
 
@@ -146,6 +147,21 @@ class Edit(commands.Cog):
         await self.bot.donationboard.update_board(message_id=result['message_id'])
         await ctx.send(f"👌 Per-page count updated.")
 
+    async def do_edit_board_renderer(self, ctx, channel, renderer, type_):
+        renderers = {'classic': HTML_RENDERER, 'fast': PILLOW_RENDERER}
+        if renderer.lower() not in renderers:
+            return await ctx.send("The renderer must be either `classic` or `fast`.")
+
+        query = "UPDATE boards SET render = $1 WHERE channel_id = $2 AND type = $3 RETURNING message_id"
+        result = await ctx.db.fetchrow(query, renderers[renderer.lower()], channel.id, type_)
+
+        if not result:
+            return await ctx.send(f"I couldn't find a {type_}board setup in {channel.mention}. "
+                                  f"Either #mention a valid board channel, or set one up with `+help add boards`.")
+
+        await self.bot.donationboard.update_board(message_id=result['message_id'])
+        await ctx.send(f"👌 Renderer updated.")
+
     @edit.group(name='donationboard')
     @checks.manage_guild()
     async def edit_donationboard(self, ctx):
@@ -225,6 +241,28 @@ class Edit(commands.Cog):
         """
         await self.do_edit_board_perpage(ctx, channel or ctx.channel, per_page, 'donation')
 
+    @edit_donationboard.command(name='renderer')
+    async def edit_donationboard_renderer(self, ctx, channel: typing.Optional[discord.TextChannel], renderer: str):
+        """Change how a donationboard image is drawn.
+
+        `classic` is the original look. `fast` draws a near-identical board in a fraction of the time,
+        so it updates sooner after changes.
+
+        **Parameters**
+        :key: A channel where the donationboard is located (#mention)
+        :key: The renderer: `classic` or `fast`.
+
+        **Format**
+        :information_source: `+edit donationboard renderer #CHANNEL RENDERER`
+
+        **Example**
+        :white_check_mark: `+edit donationboard renderer #dt-boards fast`
+
+        **Required Permissions**
+        :warning: Manage Server
+        """
+        await self.do_edit_board_renderer(ctx, channel or ctx.channel, renderer, 'donation')
+
     @edit.group(name='legendboard')
     @manage_guild()
     async def edit_legendboard(self, ctx):
@@ -294,6 +332,28 @@ class Edit(commands.Cog):
         :warning: Manage Server
         """
         await self.do_edit_board_perpage(ctx, channel or ctx.channel, per_page, 'legend')
+
+    @edit_legendboard.command(name='renderer')
+    async def edit_legendboard_renderer(self, ctx, channel: typing.Optional[discord.TextChannel], renderer: str):
+        """Change how a legendboard image is drawn.
+
+        `classic` is the original look. `fast` draws a near-identical board in a fraction of the time,
+        so it updates sooner after changes.
+
+        **Parameters**
+        :key: A channel where the legendboard is located (#mention)
+        :key: The renderer: `classic` or `fast`.
+
+        **Format**
+        :information_source: `+edit legendboard renderer #CHANNEL RENDERER`
+
+        **Example**
+        :white_check_mark: `+edit legendboard renderer #legend-boards fast`
+
+        **Required Permissions**
+        :warning: Manage Server
+        """
+        await self.do_edit_board_renderer(ctx, channel or ctx.channel, renderer, 'legend')
     #
     # @edit_legendboard.command(name='columns', aliases=['column'])
     # async def edit_legendboard_columns(self, ctx, channel: typing.Optional[discord.TextChannel], *, combination: str):
@@ -369,6 +429,28 @@ class Edit(commands.Cog):
         """
         await self.do_edit_board_perpage(ctx, channel or ctx.channel, per_page, 'trophy')
 
+    @edit_trophyboard.command(name='renderer')
+    async def edit_trophyboard_renderer(self, ctx, channel: typing.Optional[discord.TextChannel], renderer: str):
+        """Change how a trophyboard image is drawn.
+
+        `classic` is the original look. `fast` draws a near-identical board in a fraction of the time,
+        so it updates sooner after changes.
+
+        **Parameters**
+        :key: A channel where the trophyboard is located (#mention)
+        :key: The renderer: `classic` or `fast`.
+
+        **Format**
+        :information_source: `+edit trophyboard renderer #CHANNEL RENDERER`
+
+        **Example**
+        :white_check_mark: `+edit trophyboard renderer #trophy-boards fast`
+
+        **Required Permissions**
+        :warning: Manage Server
+        """
+        await self.do_edit_board_renderer(ctx, channel or ctx.channel, renderer, 'trophy')
+
     async def do_edit_log_interval(self, ctx, channel, interval, type_):
         query = """UPDATE logs
                    SET interval = ($1 ||' minutes')::interval
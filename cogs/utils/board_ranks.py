@@ -0,0 +1,172 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# boards in this channel rank every player in the season rather than the channel's clans.
+GLOBAL_BOARDS_CHANNEL_ID = 663683345108172830
+# the global board is only ranked this deep; nobody pages past it, and it keeps each rebuild's write small.
+GLOBAL_RANK_DEPTH = 1000
+
+# de-duplicated on player_tag before ranking, so a clan added to a channel twice can't leave gaps in the numbers.
+PLAYERS_SOURCE = """SELECT DISTINCT ON (players.player_tag)
+                           players.player_tag,
+                           player_name,
+                           donations,
+                           received,
+                           trophies,
+                           now() - last_updated AS "last_online",
+                           CASE WHEN received = 0 THEN cast(donations as decimal)
+                                ELSE cast(donations as decimal) / received
+                           END ratio,
+                           trophies - start_trophies AS "gain"
+                    FROM players
+                    INNER JOIN clans
+                    ON clans.clan_tag = players.clan_tag
+                    WHERE season_id = $2
+                    AND ($1 = {global_channel_id} OR clans.channel_id = $1)
+                 """
+LEGEND_SOURCE = """SELECT DISTINCT ON (players.player_tag)
+                          players.player_tag,
+                          players.player_name,
+                          starting,
+                          gain,
+                          loss,
+                          finishing
+                   FROM legend_days
+                   INNER JOIN players
+                   ON players.player_tag = legend_days.player_tag
+                   INNER JOIN clans
+                   ON clans.clan_tag = players.clan_tag
+                   WHERE day = $5
+                   AND season_id = $2
+                   AND clans.channel_id = $1
+                """
+# boards that aren't per legend day are stored under this day, since legend_day is part of the primary key.
+NO_LEGEND_DAY = "COALESCE($5::timestamp, '-infinity')"
+# the sort expression is the same one the boards always ordered by, with player_tag to make ties stable.
+# only ranks whose player moved are written. everything else the board has ranked, ie. other sorts, seasons and
+# legend days, is deleted: it may be out of date now, and is ranked again if it's asked for.
+REBUILD_QUERY = f"""WITH ranked AS (
+                        SELECT rank, player_tag
+                        FROM (
+                            SELECT row_number() OVER (ORDER BY {{order}} DESC NULLS LAST, player_tag) AS rank, player_tag
+                            FROM ({{source}}) board
+                        ) ordered
+                        WHERE $6::integer IS NULL OR rank <= $6
+                    ),
+                    upserted AS (
+                        INSERT INTO board_ranks (channel_id, season_id, board_type, sort_by, legend_day, rank, player_tag)
+                        SELECT $1, $2, $3, $4, {NO_LEGEND_DAY}, rank, player_tag
+                        FROM ranked
+                        ON CONFLICT (channel_id, season_id, board_type, sort_by, legend_day, rank)
+                        DO UPDATE SET player_tag = excluded.player_tag
+                        WHERE board_ranks.player_tag <> excluded.player_tag
+                        RETURNING 1
+                    )
+                    DELETE FROM board_ranks
+                    WHERE channel_id = $1
+                    AND board_type = $3
+                    AND NOT (
+                        season_id = $2
+                        AND sort_by = $4
+                        AND legend_day = {NO_LEGEND_DAY}
+                        AND rank <= (SELECT count(*) FROM ranked)
+                    )
+                 """
+PLAYERS_PAGE_QUERY = f"""SELECT DISTINCT ON (board_ranks.rank)
+                               board_ranks.rank,
+                               player_name,
+                               players.clan_tag,
+                               clans.emoji,
+                               donations,
+                               received,
+                               trophies,
+                               now() - last_updated AS "last_online",
+                               CASE WHEN received = 0 THEN cast(donations as decimal)
+                                    ELSE cast(donations as decimal) / received
+                               END ratio,
+                               trophies - start_trophies AS "gain"
+                        FROM board_ranks
+                        INNER JOIN players
+                        ON players.player_tag = board_ranks.player_tag
+                        AND players.season_id = board_ranks.season_id
+                        LEFT JOIN clans
+                        ON clans.clan_tag = players.clan_tag
+                        WHERE board_ranks.channel_id = $1
+                        AND board_ranks.season_id = $2
+                        AND board_type = $3
+                        AND sort_by = $4
+                        AND board_ranks.legend_day = {NO_LEGEND_DAY}
+                        AND board_ranks.rank BETWEEN $6 AND $7
+                        ORDER BY board_ranks.rank, clans.channel_id = board_ranks.channel_id DESC
+                     """
+LEGEND_PAGE_QUERY = f"""SELECT DISTINCT ON (board_ranks.rank)
+                              board_ranks.rank,
+                              players.player_name,
+                              players.clan_tag,
+                              clans.emoji,
+                              starting,
+                              gain,
+                              loss,
+                              finishing,
+                              best_trophies,
+                              legend_days.attacks,
+                              legend_days.defenses
+                       FROM board_ranks
+                       INNER JOIN legend_days
+                       ON legend_days.player_tag = board_ranks.player_tag
+                       AND legend_days.day = board_ranks.legend_day
+                       INNER JOIN players
+                       ON players.player_tag = board_ranks.player_tag
+                       AND players.season_id = board_ranks.season_id
+                       LEFT JOIN clans
+                       ON clans.clan_tag = players.clan_tag
+                       WHERE board_ranks.channel_id = $1
+                       AND board_ranks.season_id = $2
+                       AND board_type = $3
+                       AND sort_by = $4
+                       AND board_ranks.legend_day = {NO_LEGEND_DAY}
+                       AND board_ranks.rank BETWEEN $6 AND $7
+                       ORDER BY board_ranks.rank, clans.channel_id = board_ranks.channel_id DESC
+                    """
+
+
+class BoardRanks:
+    """A rank index per board: which player is at each rank, for a channel, season, board type and sort.
+
+    :meth:`rebuild` re-ranks one board; it's run when the syncer flags that board's players as changed, so only
+    channels with new data are re-sorted, and only the ranks whose player changed are written. Each board keeps one
+    ranking: rebuilding it drops the board's other sorts, seasons and legend days, so switching sort with a reaction
+    finds nothing (rather than a stale order) and ranks it again. Pages are read with :meth:`page`, a range lookup on
+    the index joined to the players' current stats, rather than sorting the channel again and discarding everything
+    before an offset. Legend boards are ranked per legend day; a page for a day the index wasn't built for comes back
+    empty.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.rebuilds = 0
+
+    async def rebuild(self, channel_id, season_id, board_type, sort_by, legend_day=None):
+        if board_type == 'legend':
+            source = LEGEND_SOURCE
+        else:
+            source = PLAYERS_SOURCE.format(global_channel_id=GLOBAL_BOARDS_CHANNEL_ID)
+            legend_day = None
+        query = REBUILD_QUERY.format(order='donations' if sort_by == 'donation' else sort_by, source=source)
+        depth = GLOBAL_RANK_DEPTH if channel_id == GLOBAL_BOARDS_CHANNEL_ID else None
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # two processes rebuilding the same board take turns instead of deleting each other's ranks.
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", f"board_ranks:{channel_id}:{board_type}")
+                await conn.execute(query, channel_id, season_id, board_type, sort_by, legend_day, depth)
+        self.rebuilds += 1
+
+    async def page(self, channel_id, season_id, board_type, sort_by, first_rank, number, legend_day=None):
+        """The players ranked ``first_rank`` to ``first_rank + number - 1``, with a ``rank`` column."""
+        query = LEGEND_PAGE_QUERY if board_type == 'legend' else PLAYERS_PAGE_QUERY
+        if board_type != 'legend':
+            legend_day = None
+        return await self.pool.fetch(
+            query, channel_id, season_id, board_type, sort_by, legend_day, first_rank, first_rank + number - 1
+        )
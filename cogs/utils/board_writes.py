@@ -0,0 +1,72 @@
+BOARD_COLUMNS = ('player_tag', 'old_dons', 'new_dons', 'old_rec', 'new_rec', 'trophies', 'league_id', 'clan_tag', 'player_name')
+
+JSON_UPDATE_QUERY = """UPDATE players SET donations = public.get_don_rec_max(x.old_dons, x.new_dons, COALESCE(players.donations, 0)),
+                                          received  = public.get_don_rec_max(x.old_rec, x.new_rec, COALESCE(players.received, 0)),
+                                          trophies  = x.trophies,
+                                          league_id = x.league_id,
+                                          clan_tag  = x.clan_tag,
+                                          player_name = x.player_name,
+                                          best_trophies = public.get_best_trophies(x.trophies, players.best_trophies)
+                            FROM(
+                                SELECT x.player_tag, x.old_dons, x.new_dons, x.old_rec, x.new_rec, x.trophies, x.league_id, x.clan_tag, x.player_name
+                                    FROM jsonb_to_recordset($1::jsonb)
+                                AS x(player_tag TEXT,
+                                     old_dons INTEGER,
+                                     new_dons INTEGER,
+                                     old_rec INTEGER,
+                                     new_rec INTEGER,
+                                     trophies INTEGER,
+                                     league_id INTEGER,
+                                     clan_tag TEXT,
+                                     player_name TEXT
+                                     )
+                                )
+                        AS x
+                        WHERE players.player_tag = x.player_tag
+                        AND players.season_id=$2
+                    """
+
+STAGING_TABLE_QUERY = """CREATE TEMPORARY TABLE IF NOT EXISTS board_staging (
+                             player_tag TEXT,
+                             old_dons INTEGER,
+                             new_dons INTEGER,
+                             old_rec INTEGER,
+                             new_rec INTEGER,
+                             trophies INTEGER,
+                             league_id INTEGER,
+                             clan_tag TEXT,
+                             player_name TEXT
+                         ) ON COMMIT DELETE ROWS
+                      """
+
+STAGING_UPDATE_QUERY = """UPDATE players SET donations = public.get_don_rec_max(x.old_dons, x.new_dons, COALESCE(players.donations, 0)),
+                                             received  = public.get_don_rec_max(x.old_rec, x.new_rec, COALESCE(players.received, 0)),
+                                             trophies  = x.trophies,
+                                             league_id = x.league_id,
+                                             clan_tag  = x.clan_tag,
+                                             player_name = x.player_name,
+                                             best_trophies = public.get_best_trophies(x.trophies, players.best_trophies)
+                          FROM board_staging AS x
+                          WHERE players.player_tag = x.player_tag
+                          AND players.season_id = $1
+                       """
+
+
+async def json_board_update(conn, records, season_id):
+    """Apply board records by serialising them to jsonb and unpacking with ``jsonb_to_recordset``.
+
+    Records are tuples in :data:`BOARD_COLUMNS` order.
+    """
+    return await conn.execute(JSON_UPDATE_QUERY, [dict(zip(BOARD_COLUMNS, r)) for r in records], season_id)
+
+
+async def copy_board_update(conn, records, season_id):
+    """Apply board rows by streaming them with binary COPY into a session temp table, then a single UPDATE ... FROM.
+
+    The staging table is created once per connection and emptied on commit,
+    so this must be given a connection (not the pool) and runs in its own transaction.
+    """
+    async with conn.transaction():
+        await conn.execute(STAGING_TABLE_QUERY)
+        await conn.copy_records_to_table('board_staging', records=records, columns=BOARD_COLUMNS)
+        return await conn.execute(STAGING_UPDATE_QUERY, season_id)
@@ -0,0 +1,126 @@
+import sys
+
+from collections import OrderedDict
+
+
+def approximate_size(obj):
+    """A rough size in bytes for a cached object: the object itself plus its immediate attributes.
+
+    This doesn't follow references any further, so it's an estimate to budget with rather than an exact figure.
+    """
+    size = sys.getsizeof(obj)
+    try:
+        values = vars(obj).values()
+    except TypeError:
+        values = ()
+    for value in values:
+        size += sys.getsizeof(value)
+
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            try:
+                size += sys.getsizeof(getattr(obj, name))
+            except AttributeError:
+                pass
+    return size
+
+
+class BoundedCache:
+    """A dict-like LRU cache with both an entry budget and an (approximate) byte budget.
+
+    It's a drop-in for the plain dicts coc.py keeps its clan and player objects in,
+    which otherwise keep everything ever fetched for the life of the process.
+    Hits, misses and evictions are counted, and the estimated resident size is kept up to date as entries come and go.
+    """
+    def __init__(self, max_entries, max_bytes, sizeof=approximate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.resident_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __getitem__(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            self._discard(key)
+
+        size = self.sizeof(value)
+        self._data[key] = value
+        self._sizes[key] = size
+        self.resident_bytes += size
+
+        while len(self._data) > 1 and (len(self._data) > self.max_entries or self.resident_bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def _discard(self, key):
+        del self._data[key]
+        self.resident_bytes -= self._sizes.pop(key)
+
+    def __delitem__(self, key):
+        self._discard(key)
+
+    def pop(self, key, *default):
+        try:
+            value = self._data[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self._discard(key)
+        return value
+
+    def keys(self):
+        return self._data.keys()
+
+    def values(self):
+        return self._data.values()
+
+    def items(self):
+        return self._data.items()
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.resident_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._data),
+            'resident_bytes': self.resident_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
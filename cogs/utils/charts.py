@@ -0,0 +1,140 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import seaborn as sns
+
+from matplotlib import pyplot as plt
+from matplotlib import dates as mdates
+
+log = logging.getLogger(__name__)
+
+# charts are rare and small; one worker keeps them off the event loop without holding much memory.
+CHART_WORKERS = 1
+
+
+def _to_png(fig):
+    b = io.BytesIO()
+    fig.savefig(b, format='png')
+    plt.close(fig)
+    return b.getvalue()
+
+
+def latency_chart(stats, title):
+    """Bar charts of recent request latencies, one per key of ``stats`` (a dict of key: list of numbers)."""
+    stats = list(stats.items())
+    if len(stats) > 2:
+        columns = 2
+        rows = (len(stats) + 1) // 2
+    else:
+        columns = 1
+        rows = len(stats)
+
+    fig, axs = plt.subplots(rows, columns, squeeze=False)
+    axs = axs.flatten()
+    for i, (key, values) in enumerate(stats):
+        axs[i].bar(range(len(values)), values, color="blue")
+        axs[i].set_ylabel(key)
+    fig.suptitle(title)
+    return _to_png(fig)
+
+
+def activity_bar_chart(series, timezone_offset, days, dark_mode):
+    """Grouped bar chart of activity per hour of day. ``series`` is a dict of name: {hour: events}."""
+    with plt.style.context('dark_background' if dark_mode else 'default'):
+        fig, ax = plt.subplots()
+        y_pos = np.arange(24)
+        width = 0.8 / len(series)
+
+        graphs = []
+        for i, (name, data) in enumerate(series.items()):
+            data = dict(sorted(data.items()))
+            graphs.append((ax.bar([n + width * i for n in y_pos], list(data.values()), width, align='center'), name))
+
+        ax.set_xticks(y_pos)
+        ax.set_xticklabels(list(range(24)))
+        ax.set_xlabel(f"Time (hr) - UTC{'+' + str(timezone_offset) if timezone_offset > 0 else timezone_offset}")
+        ax.set_ylabel("Activity (average events)")
+        ax.set_title(f"Activity Graph - Time Period: {days + 1}d")
+        ax.legend(tuple(n[0] for n in graphs), tuple(n[1] for n in graphs))
+        return _to_png(fig)
+
+
+def activity_line_chart(series, dark_mode):
+    """Activity over time with a one standard deviation band.
+
+    ``series`` is a list of ``(name, dates, means, stdevs)``; a series named "Bot Average" is drawn without a band
+    and doesn't count towards the x axis limits.
+    """
+    with plt.style.context('dark_background' if dark_mode else 'default'):
+        colours = sns.color_palette("hls", len(series))
+
+        fig, ax = plt.subplots()
+        min_date = None
+        max_date = None
+
+        for i, (name, dates, means, stdev) in enumerate(series):
+            meanst = np.array(means, dtype=np.float64)
+            sdt = np.array(stdev, dtype=np.float64)
+            ax.plot(dates, meanst, label=name, color=colours[i])
+
+            if name != "Bot Average":
+                ax.fill_between(dates, [max(0, n) for n in meanst - sdt], meanst + sdt, alpha=0.3, facecolor=colours[i])
+                if not min_date or dates[0] < min_date:
+                    min_date = dates[0]
+                if not max_date or dates[-1] > max_date:
+                    max_date = dates[-1]
+
+        locator = mdates.AutoDateLocator(minticks=3, maxticks=10)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        ax.legend()
+
+        ax.grid(True)
+        ax.set_ylabel("Activity")
+        ax.set_title("Activity Change Over Time")
+        ax.set_xlim(min_date, max_date)
+        return _to_png(fig)
+
+
+class ChartWorker:
+    """Renders charts in a separate process, so matplotlib never blocks an event loop.
+
+    Pass one of the chart functions in this module and plain (picklable) data; :meth:`render` returns the PNG bytes.
+    Workers are forked rather than spawned: a spawned worker would re-run the main script (eg. the syncer) on import.
+    """
+    def __init__(self, max_workers=CHART_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('fork'))
+        return self._executor
+
+    async def render(self, func, *args):
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except BrokenProcessPool:
+            # a worker died (eg. killed for memory); start a fresh pool for next time.
+            log.exception('chart worker died rendering %s', func.__name__)
+            self._executor = None
+            raise
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# shared by everything in a process that draws charts.
+chart_worker = ChartWorker()
@@ -0,0 +1,17 @@
+import json
+
+import asyncpg
+
+import creds
+
+
+async def setup_db():
+    def _encode_jsonb(value):
+        return json.dumps(value)
+
+    def _decode_jsonb(value):
+        return json.loads(value)
+
+    async def init(con):
+        await con.set_type_codec('jsonb', schema='pg_catalog', encoder=_encode_jsonb, decoder=_decode_jsonb, format='text')
+    return await asyncpg.create_pool(creds.postgres, init=init)
@@ -60,7 +60,7 @@ class LogConfig:
 
 class BoardConfig:
     __slots__ = ('bot', 'guild_id', 'channel_id', 'icon_url', 'title',
-                 'sort_by', 'toggle', 'type', 'in_event', 'message_id', 'per_page', 'page', 'season_id')
+                 'sort_by', 'toggle', 'type', 'in_event', 'message_id', 'per_page', 'page', 'season_id', 'render')
 
     def __init__(self, *, bot, record):
         self.bot = bot
@@ -77,6 +77,7 @@ class BoardConfig:
         self.per_page: int = record['per_page']
         self.page: int = record['page']
         self.season_id: int = record['season_id']
+        self.render: int = record['render']
 
     @property
     def guild(self) -> discord.Guild:
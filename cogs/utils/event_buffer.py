@@ -0,0 +1,173 @@
+import time
+
+from array import array
+from collections import Counter
+
+class EventBuffer:
+    """Holds one clan loop's worth of member events in flat, array-backed columns.
+
+    Each player seen in the loop is given a slot, and the per-player board aggregates live
+    at that slot in their columns. Donation and trophy log events are appended to their own columns,
+    referring back to the player by slot.
+
+    Every event handler runs on the same loop and none of them await while recording, so there is no need for locks:
+    the syncer swaps in a fresh buffer with :meth:`swap` at the start of a flush and drains the old one at its leisure.
+    """
+    __slots__ = (
+        'slots', 'player_tags', 'player_names', 'clan_tags', 'clan_names',
+        'old_dons', 'new_dons', 'old_rec', 'new_rec', 'trophies', 'league_ids',
+        'don_slot', 'don_donations', 'don_received', 'don_time',
+        'trophy_slot', 'trophy_change', 'trophy_league', 'trophy_time',
+    )
+
+    def __init__(self):
+        self.slots = {}
+        self.player_tags = []
+        self.player_names = []
+        self.clan_tags = []
+        self.clan_names = []
+
+        # board aggregates, one entry per slot
+        self.old_dons = array('l')
+        self.new_dons = array('l')
+        self.old_rec = array('l')
+        self.new_rec = array('l')
+        self.trophies = array('l')
+        self.league_ids = array('l')
+
+        # donation log events
+        self.don_slot = array('l')
+        self.don_donations = array('l')
+        self.don_received = array('l')
+        self.don_time = array('q')
+
+        # trophy log events
+        self.trophy_slot = array('l')
+        self.trophy_change = array('l')
+        self.trophy_league = array('l')
+        self.trophy_time = array('q')
+
+    def __len__(self):
+        return len(self.player_tags)
+
+    def __bool__(self):
+        return bool(self.player_tags)
+
+    def swap(self):
+        """Return a buffer holding everything recorded so far, and reset this one in place.
+
+        Because this never awaits, it's atomic with respect to the event handlers.
+        """
+        drained = EventBuffer()
+        for attr in self.__slots__:
+            value = getattr(self, attr)
+            setattr(self, attr, getattr(drained, attr))
+            setattr(drained, attr, value)
+        return drained
+
+    def _slot(self, player):
+        try:
+            return self.slots[player.tag]
+        except KeyError:
+            pass
+
+        slot = len(self.player_tags)
+        self.slots[player.tag] = slot
+        self.player_tags.append(player.tag)
+        self.player_names.append(player.name)
+        self.clan_tags.append(player.clan and player.clan.tag)
+        self.clan_names.append(player.clan and player.clan.name)
+
+        self.old_dons.append(player.donations or 0)
+        self.new_dons.append(player.donations or 0)
+        self.old_rec.append(player.received or 0)
+        self.new_rec.append(player.received or 0)
+        self.trophies.append(player.trophies or 0)
+        self.league_ids.append(player.league_id or 0)
+
+        return slot
+
+    def add_donation(self, old_player, player, donations):
+        slot = self._slot(player)
+        self.old_dons[slot] = old_player.donations
+        self.new_dons[slot] = player.donations
+
+        self.don_slot.append(slot)
+        self.don_donations.append(donations)
+        self.don_received.append(0)
+        self.don_time.append(int(time.time()))
+
+    def add_received(self, old_player, player, received):
+        slot = self._slot(player)
+        self.old_rec[slot] = old_player.received
+        self.new_rec[slot] = player.received
+
+        self.don_slot.append(slot)
+        self.don_donations.append(0)
+        self.don_received.append(received)
+        self.don_time.append(int(time.time()))
+
+    def add_trophies(self, old_player, player):
+        slot = self._slot(player)
+        change = player.trophies - old_player.trophies
+        self.trophies[slot] = player.trophies
+
+        self.trophy_slot.append(slot)
+        self.trophy_change.append(change)
+        self.trophy_league.append(player.league_id or 0)
+        self.trophy_time.append(int(time.time()))
+
+        return change
+
+    def restore(self, drained):
+        """Fold the board aggregates of a buffer that failed to flush back into this one.
+
+        Where a player is in both, the drained buffer holds the older ``old_*`` values and this one the newer counts.
+        """
+        for slot, tag in enumerate(drained.player_tags):
+            new_slot = self.slots.get(tag)
+            if new_slot is None:
+                new_slot = len(self.player_tags)
+                self.slots[tag] = new_slot
+                self.player_tags.append(tag)
+                self.player_names.append(drained.player_names[slot])
+                self.clan_tags.append(drained.clan_tags[slot])
+                self.clan_names.append(drained.clan_names[slot])
+                self.new_dons.append(drained.new_dons[slot])
+                self.new_rec.append(drained.new_rec[slot])
+                self.trophies.append(drained.trophies[slot])
+                self.league_ids.append(drained.league_ids[slot])
+                self.old_dons.append(0)
+                self.old_rec.append(0)
+
+            self.old_dons[new_slot] = drained.old_dons[slot]
+            self.old_rec[new_slot] = drained.old_rec[slot]
+
+    def donation_events(self):
+        """Yield ``(player_tag, player_name, clan_tag, clan_name, donations, received, timestamp)`` per donation log event."""
+        for slot, donations, received, timestamp in zip(self.don_slot, self.don_donations, self.don_received, self.don_time):
+            yield (self.player_tags[slot], self.player_names[slot], self.clan_tags[slot], self.clan_names[slot],
+                   donations, received, timestamp)
+
+    def trophy_events(self):
+        """Yield ``(player_tag, player_name, clan_tag, clan_name, trophy_change, league_id, timestamp)`` per trophy log event."""
+        for slot, change, league_id, timestamp in zip(self.trophy_slot, self.trophy_change, self.trophy_league, self.trophy_time):
+            yield (self.player_tags[slot], self.player_names[slot], self.clan_tags[slot], self.clan_names[slot],
+                   change, league_id, timestamp)
+
+    def board_records(self):
+        """Return one tuple per player, in :data:`cogs.utils.board_writes.BOARD_COLUMNS` order."""
+        return [
+            (tag, old_dons, new_dons, old_rec, new_rec, trophies, league_id or None, clan_tag, name)
+            for tag, old_dons, new_dons, old_rec, new_rec, trophies, league_id, clan_tag, name in zip(
+                self.player_tags, self.old_dons, self.new_dons, self.old_rec, self.new_rec,
+                self.trophies, self.league_ids, self.clan_tags, self.player_names
+            )
+        ]
+
+    def clan_event_counts(self):
+        """Return a Counter of donation and trophy log events per clan tag."""
+        clan_tags = self.clan_tags
+        counts = Counter(clan_tags[slot] for slot in self.don_slot)
+        counts.update(clan_tags[slot] for slot in self.trophy_slot)
+        return counts
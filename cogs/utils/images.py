@@ -1,9 +1,14 @@
-import copy
+import asyncio
+import functools
+import hashlib
 import io
 import logging
 import re
-import math
 import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import creds
 
 from PIL import ImageFont, Image, ImageDraw, UnidentifiedImageError
@@ -16,51 +21,68 @@ if creds.live:
     absolute_path = "/home/mathsman/donationbot/"
 else:
     absolute_path = ""
-BACKGROUND = Image.open(f"{absolute_path}assets/snowyfield.png").resize((4000, 4500))
-TROPHYBOARD_BACKGROUND = Image.open(f"{absolute_path}assets/clash_cliffs.png").resize((4000, 4500))
 
 CJK_FRIENDLY_FONT_FP = absolute_path + "assets/NotoSansCJK-Bold.ttc"
 SUPERCELL_FONT_FP = absolute_path + "assets/DejaVuSans-Bold.ttf"
-SUPERCELL_FONT_SIZE = 70
-SUPERCELL_FONT = ImageFont.truetype(SUPERCELL_FONT_FP, SUPERCELL_FONT_SIZE)
-
 REGULAR_FONT_FP = absolute_path + "assets/Roboto-Black.ttf"
-REGULAR_FONT_SIZE = 140
-REGULAR_FONT = ImageFont.truetype(REGULAR_FONT_FP, REGULAR_FONT_SIZE)
-
-SEASON_FONT = ImageFont.truetype(REGULAR_FONT_FP, 60)
-
-IMAGE_WIDTH = 4000
-
-MINIMUM_COLUMN_HEIGHT = 200
-LEFT_COLUMN_WIDTH = 20
-NUMBER_LEFT_COLUMN_WIDTH = 40
-NAME_LEFT_COLUMN_WIDTH = 220
-DONATIONS_LEFT_COLUMN_WIDTH = 720
-RECEIVED_LEFT_COLUMN_WIDTH = 1020
-RATIO_LEFT_COLUNM_WIDTH = 1320
-LAST_ONLINE_LEFT_COLUMN_WIDTH = 1620
-
-HEADER_RECTANGLE_RGB = (40, 40, 70)
-RECTANGLE_RGB = (60,80,100)
-NUMBER_RGB = (200, 200, 255)
-NAME_RGB = (255, 255, 255)
-DONATIONS_RGB = (100, 255, 100)
-RECEIVED_RGB = (255, 100, 100)
-RATIO_RGB = (150, 220, 225)
-LAST_ONLINE_RGB = (200, 200, 200)
-
-T_TROPHIES_LEFT_COLUMN_WIDTH = 840
-T_GAIN_LEFT_COLUMN_WIDTH = 1120
-T_LAST_ONLINE_LEFT_COLUMN_WIDTH = 1420
-
-T_HEADER_RECTANGLE_RGB = (61, 66, 71)
-T_RECTANGLE_RGB = (74, 89, 82)
-T_NUMBER_RGB = (209, 227, 212)
-T_NAME_RGB = (232, 250, 235)
-T_TROPHIES_RGB = (224, 230, 69)
-T_GAIN_RGB = (33, 174, 181)
-T_LAST_ONLINE_RGB = (194, 84, 34)
+# looked up in the system font directories; unicode clan emojis fall back to DejaVu's symbols without it.
+EMOJI_FONT_FP = "Symbola.ttf"
+CLAN_HEADER_ICON_FP = absolute_path + "assets/reddit badge.png"
+BOARD_ICONS_PATH = Path(absolute_path + "assets/board_icons")
+
+# the layout follows syncboards.HTMLImages, in pixels.
+SINGLE_COLUMN_WIDTH = 1200
+DOUBLE_COLUMN_WIDTH = 2500
+DOUBLE_COLUMN_ROWS = 30
+TITLE_HEIGHT = 100
+TITLE_FONT_SIZE = 70
+TABLE_PADDING = 30
+ROW_HEIGHT = 64
+ROW_SPACING = 12
+CELL_PADDING = 7
+MIN_NAME_WIDTH = 120
+FONT_SIZE = 42
+SUP_FONT_SIZE = 26
+FOOTER_HEIGHT = 56
+FOOTER_FONT_SIZE = 40
+HEADER_ICON_SIZE = 64
+ICON_SIZE = 40
+
+TEXT_RGB = (0, 0, 0)
+TITLE_TOP_RGB = (220, 207, 186)
+TITLE_BOTTOM_RGB = (196, 183, 166)
+HEADER_RGBA = (185, 147, 108, 153)
+EVEN_ROW_RGBA = (166, 179, 196, 204)
+ODD_ROW_RGBA = (196, 186, 133, 204)
+SELECTED_RGBA = (170, 204, 238, 204)
+BACKGROUND_OPACITY = 0.9
+# used when a board's background can't be downloaded.
+FALLBACK_BACKGROUND_RGB = (120, 140, 160)
+JPEG_QUALITY = 90
+
+# how many downloaded backgrounds, and backgrounds resized for a board size, are kept.
+MAX_BACKGROUNDS = 32
+MAX_SIZED_BACKGROUNDS = 128
+
+# columns per board type, and the sort_by each column corresponds to; the None column is the clan icon.
+COLUMNS = {
+    "donation": ("#", None, "Player Name", "Dons", "Rec", "Ratio", "Last On"),
+    "trophy": ("#", None, "Player Name", "Cups", "Gain", "Last On"),
+    "legend": ("#", None, "Player Name", "Initial", "Gain", "Loss", "Final", "Best"),
+}
+SORT_COLUMNS = {
+    "donation": ("#", "Clan", "Player Name", "donations", "received", "ratio", "last_online ASC, player_name"),
+    "trophy": ("#", "Clan", "Player Name", "trophies", "gain", "last_online ASC, player_name"),
+    "legend": ("#", "Clan", "Player Name", "starting", "gain", "loss", "finishing"),
+}
+NAME_COLUMN = 2
+ICON_COLUMN = 1
+
+_backgrounds = {}
+_sized_backgrounds = {}
+_icons = {}
+# drawing happens off the event loop, one board at a time; FreeType fonts aren't safe to share between threads.
+_draw_executor = ThreadPoolExecutor(1)
 
 
 def get_readable(delta):
@@ -74,235 +96,363 @@ def get_readable(delta):
         return f"{hours}h {minutes}m"
 
 
-class DonationBoardImage:
-    def __init__(self, title, icon, season_start, season_finish):
-        self.title = title or "Donation Board"
-        self.icon = icon
-        self.season_start, self.season_finish = season_start, season_finish
-        self.height = MINIMUM_COLUMN_HEIGHT
-        self.width = 0
-        self.max_width = IMAGE_WIDTH / 2 - 40
-        #self.image = copy.deepcopy(BACKGROUND)
-        self.image = Image.new("RGBA", (4500, 4000))
-        self.draw = ImageDraw.Draw(self.image)
-
-    def special_text(self, position, text, rgb, font_fp, font_size, max_width, centre_align=False, offset=0):
-        if CJK_REGEX.search(text):
-            font_fp = CJK_FRIENDLY_FONT_FP
-
-        font = ImageFont.truetype(font_fp, font_size)
-
-        text_width, text_height = self.draw.textsize(text, font)
-
-        need_to_offset = False
-        while text_width > max_width - offset:
-            font_size -= 1
-            font = ImageFont.truetype(font_fp, font_size)
-            text_width, text_height = self.draw.textsize(text, font)
-            need_to_offset = True
-
-        if need_to_offset and centre_align:
-            position = (int((max_width - text_width + offset) / 2), position[1])
-        elif centre_align:
-            position = (int((max_width - text_width) / 2), position[1])
-        elif offset:
-            position = (position[0] + offset, position[1])
-
-        self.draw.text(position, text, rgb, font)
-
-    def add_headers(self, add_double_column=False):
-        if add_double_column:
-            self.special_text((IMAGE_WIDTH / 4.5, 20), self.title, (255, 255, 255), REGULAR_FONT_FP, REGULAR_FONT_SIZE, max_width=IMAGE_WIDTH - 40, centre_align=True, offset=180 if self.icon else 0)
+@functools.lru_cache(maxsize=256)
+def get_font(font_fp, size):
+    try:
+        return ImageFont.truetype(font_fp, size)
+    except OSError:
+        return ImageFont.truetype(SUPERCELL_FONT_FP, size)
+
+
+def _remember(cache, key, value, limit):
+    if len(cache) >= limit:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
+async def load_background(session, url):
+    try:
+        return _backgrounds[url]
+    except KeyError:
+        pass
+
+    image = None
+    try:
+        async with session.get(url) as resp:
+            if resp.status == 200:
+                image = Image.open(io.BytesIO(await resp.read())).convert("RGB")
+    except (asyncio.TimeoutError, OSError, UnidentifiedImageError):
+        log.info('failed to download board background %s', url)
+    except Exception:
+        log.exception('downloading board background %s', url)
+
+    if image is not None:
+        _remember(_backgrounds, url, image, MAX_BACKGROUNDS)
+    return image
+
+
+async def load_board_icon(session, emoji_id):
+    """A custom emoji as an icon sized for a board row, downloaded once and kept in ``assets/board_icons``."""
+    try:
+        return _icons[emoji_id]
+    except KeyError:
+        pass
+
+    path = BOARD_ICONS_PATH / f"{emoji_id}.png"
+    if not path.is_file():
+        async with session.get(f"https://cdn.discordapp.com/emojis/{emoji_id}.png") as resp:
+            if resp.status != 200:
+                return None
+            data = await resp.read()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    try:
+        icon = Image.open(path).convert("RGBA")
+    except (OSError, UnidentifiedImageError):
+        return None
+    icon.thumbnail((ICON_SIZE, ICON_SIZE))
+    _remember(_icons, emoji_id, icon, 512)
+    return icon
+
+
+@functools.lru_cache(maxsize=1)
+def clan_header_icon():
+    icon = Image.open(CLAN_HEADER_ICON_FP).convert("RGBA")
+    icon.thumbnail((HEADER_ICON_SIZE, HEADER_ICON_SIZE))
+    return icon
+
+
+class BoardTiles:
+    """The pieces of a board's last image, kept between draws so unchanged parts aren't rasterised again.
+
+    ``base`` is the background with the title, header rows and footer drawn on; ``rows`` maps each row's position
+    to the content it was drawn with and its finished (opaque) tile.
+    """
+    def __init__(self):
+        self.base_key = None
+        self.base = None
+        self.rows = {}
+
+
+class BoardImage:
+    """Draws a donation, trophy or legend board with Pillow, in-process, laid out like ``syncboards.HTMLImages``.
+
+    It takes the same rows and options, so a board can use either; :meth:`prepare` formats the rows and downloads
+    the background and clan icons, then :meth:`render` draws the board and returns a jpg, like wkhtmltoimage's.
+    """
+    def __init__(self, players, title, image, sort_by=None, footer=None, offset=None, board_type='donation', session=None):
+        self.players = players
+        self.title = title
+        self.image_url = image
+        self.footer = footer
+        self.offset = offset or 1
+        self.board_type = board_type
+        self.session = session
+
+        self.columns = COLUMNS.get(board_type, COLUMNS['trophy'])
+        sort_columns = SORT_COLUMNS.get(board_type, SORT_COLUMNS['trophy'])
+        if sort_by == 'donation':
+            sort_by = 'donations'
+        if sort_by and board_type == 'trophy':
+            sort_by = sort_by.replace('donations', 'trophies')
+        self.selected_index = [sort_columns.index(sort_by)] if sort_by in sort_columns else []
+
+        self.show_icons = any(p['emoji'] for p in players)
+        self.rows = []
+        self.row_keys = []
+        self.background = None
+
+        self.rows_drawn = 0
+        self.rows_reused = 0
+
+    def format_player(self, index, player):
+        # cells are (text, superscript) tuples, except the icon column which is an image, text or None.
+        if self.board_type == 'donation':
+            cells = (
+                player['donations'],
+                player['received'],
+                round(player['donations'] / (player['received'] or 1), 2),
+                get_readable(player['last_online']),
+            )
+        elif self.board_type == 'legend':
+            cells = (
+                player['starting'],
+                (str(player['gain']), f"({player['attacks']})"),
+                (str(player['loss']), f"({player['defenses']})"),
+                player['finishing'],
+                player['best_trophies'],
+            )
         else:
-            self.special_text((40, 20), self.title, (255, 255, 255), REGULAR_FONT_FP, REGULAR_FONT_SIZE, max_width=int(IMAGE_WIDTH / 2) - 40, centre_align=True, offset=180 if self.icon else 0)
-
-        if self.icon:
-            self.image.paste(self.icon, (10, 10))
-
-        self.draw.rectangle(((LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT), ((IMAGE_WIDTH / 2) - 40, MINIMUM_COLUMN_HEIGHT + 100)), fill=HEADER_RECTANGLE_RGB)
-        self.draw.text((NUMBER_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "#", NUMBER_RGB, font=SUPERCELL_FONT)
-        self.draw.text((NAME_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Name", NAME_RGB, font=SUPERCELL_FONT)
-        self.draw.text((DONATIONS_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Dons", DONATIONS_RGB, font=SUPERCELL_FONT)
-        self.draw.text((RECEIVED_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Rec", RECEIVED_RGB, font=SUPERCELL_FONT)
-        self.draw.text((RATIO_LEFT_COLUNM_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Ratio", RATIO_RGB, font=SUPERCELL_FONT)
-        self.draw.text((LAST_ONLINE_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Last On", LAST_ONLINE_RGB, font=SUPERCELL_FONT)
-
-        if add_double_column:
-            halfway = IMAGE_WIDTH / 2 + 40
-            self.draw.rectangle(((IMAGE_WIDTH + LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT), ((IMAGE_WIDTH / 2) + 40, MINIMUM_COLUMN_HEIGHT + 60)), fill=HEADER_RECTANGLE_RGB)
-            self.draw.text((halfway + NUMBER_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "#", NUMBER_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + NAME_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Name", NAME_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + DONATIONS_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Dons", DONATIONS_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + RECEIVED_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Rec", RECEIVED_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + RATIO_LEFT_COLUNM_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Ratio", RATIO_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + LAST_ONLINE_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Last On", LAST_ONLINE_RGB, font=SUPERCELL_FONT)
-
-    def add_player(self, player):
-        self.height += 100
-        position = ((self.width or LEFT_COLUMN_WIDTH, self.height), (self.max_width, self.height + 80))
-
-        self.draw.rectangle(position, fill=RECTANGLE_RGB)
-        self.draw.text((self.width + NUMBER_LEFT_COLUMN_WIDTH, self.height + 2), f"{player.index}.", NUMBER_RGB, font=SUPERCELL_FONT)
-        self.special_text((self.width + NAME_LEFT_COLUMN_WIDTH, self.height + 2), str(player.name), NAME_RGB, SUPERCELL_FONT_FP, SUPERCELL_FONT_SIZE, 450)
-        self.draw.text((self.width + DONATIONS_LEFT_COLUMN_WIDTH, self.height + 2), str(player.donations), DONATIONS_RGB, font=SUPERCELL_FONT)
-        self.draw.text((self.width + RECEIVED_LEFT_COLUMN_WIDTH, self.height + 2), str(player.received), RECEIVED_RGB, font=SUPERCELL_FONT)
-        self.draw.text((self.width + RATIO_LEFT_COLUNM_WIDTH, self.height + 2), f"{round((player.donations or 0) / (player.received or 1), 2)}", RATIO_RGB, font=SUPERCELL_FONT)
-        self.draw.text((self.width + LAST_ONLINE_LEFT_COLUMN_WIDTH, self.height + 2), get_readable(player.last_online), LAST_ONLINE_RGB, font=SUPERCELL_FONT)
-
-    def add_players(self, players):
-        double_column = len(players) > 25
-        self.add_headers(add_double_column=double_column)
-
-        if double_column:
-            no_players = len(players)
-
-            for p in players[:int(no_players / 2)]:
-                self.add_player(p)
-
-            self.width = IMAGE_WIDTH / 2 + 40
-            self.max_width = IMAGE_WIDTH
-            self.height = MINIMUM_COLUMN_HEIGHT
-
-            for p in players[int(no_players / 2):]:
-                self.add_player(p)
-
+            cells = (player['trophies'], player['gain'], get_readable(player['last_online']))
+
+        return (
+            (f"{index}.", None),
+            None,
+            (str(player['player_name']), None),
+            *(c if isinstance(c, tuple) else (str(c), None) for c in cells),
+        )
+
+    async def prepare(self):
+        self.rows = []
+        self.row_keys = []
+        for i, player in enumerate(self.players, start=self.offset):
+            row = list(self.format_player(i, player))
+            emoji = player['emoji']
+            if emoji and emoji.isdigit():
+                row[ICON_COLUMN] = await load_board_icon(self.session, emoji)
+            else:
+                row[ICON_COLUMN] = emoji or None
+            self.rows.append(row)
+            # what the row looks like, with the emoji id standing in for its icon.
+            self.row_keys.append(tuple(emoji if n == ICON_COLUMN else c for n, c in enumerate(row)))
+
+        if self.image_url and self.session:
+            self.background = await load_background(self.session, self.image_url)
+
+    def render_key(self, message_id):
+        """A digest of the board as it'll be seen in ``message_id``; call after :meth:`prepare`."""
+        digest = hashlib.blake2b(f"pillow:{message_id}".encode(), digest_size=16)
+        digest.update(repr((self.title, self.image_url, self.footer, self.selected_index, self.row_keys)).encode())
+        return digest.hexdigest()
+
+    def _font(self, text, size):
+        return get_font(CJK_FRIENDLY_FONT_FP if CJK_REGEX.search(text) else SUPERCELL_FONT_FP, size)
+
+    def _text_width(self, cell):
+        text, sup = cell
+        width = get_font(SUPERCELL_FONT_FP, FONT_SIZE).getlength(text)
+        if sup:
+            width += get_font(SUPERCELL_FONT_FP, SUP_FONT_SIZE).getlength(sup) + 4
+        return width
+
+    def _column_widths(self, table_width):
+        widths = []
+        for i, column in enumerate(self.columns):
+            if i == ICON_COLUMN:
+                widths.append(HEADER_ICON_SIZE + 2 * CELL_PADDING if self.show_icons else 0)
+                continue
+            width = max(
+                [get_font(SUPERCELL_FONT_FP, FONT_SIZE).getlength(column)]
+                + [self._text_width(row[i]) for row in self.rows]
+            )
+            widths.append(width + 2 * CELL_PADDING)
+
+        spare = table_width - sum(widths)
+        if spare < 0:
+            # long names give way first; they're shrunk to fit when drawn.
+            widths[NAME_COLUMN] = max(MIN_NAME_WIDTH, widths[NAME_COLUMN] + spare)
+            spare = table_width - sum(widths)
+        if spare > 0:
+            total = sum(widths)
+            widths = [w + spare * w / total for w in widths]
+        # whole pixels, so row tiles line up and the widths are stable enough to key tiles on.
+        return tuple(int(w) for w in widths)
+
+    def _background(self, size):
+        key = (self.image_url if self.background else None, size)
+        try:
+            return _sized_backgrounds[key]
+        except KeyError:
+            pass
+
+        if self.background:
+            # the html stretches it to fill the page, and draws it at 90% opacity over white.
+            image = self.background.resize(size, Image.BILINEAR)
+            image = Image.blend(Image.new("RGB", size, (255, 255, 255)), image, BACKGROUND_OPACITY)
         else:
-            for player in players:
-                self.add_player(player)
-
-        self.draw.text((40, self.height + 90), f"Season: {self.season_start} - {self.season_finish}.", NAME_RGB, font=SEASON_FONT)
-
+            image = Image.new("RGB", size, FALLBACK_BACKGROUND_RGB)
+
+        draw = ImageDraw.Draw(image)
+        for y in range(TITLE_HEIGHT):
+            fraction = y / TITLE_HEIGHT
+            colour = tuple(int(t + (b - t) * fraction) for t, b in zip(TITLE_TOP_RGB, TITLE_BOTTOM_RGB))
+            draw.line(((0, y), (size[0], y)), fill=colour)
+
+        _remember(_sized_backgrounds, key, image, MAX_SIZED_BACKGROUNDS)
+        return image
+
+    def _draw_cell(self, draw, cell, box):
+        left, top, right, bottom = box
+        centre = ((left + right) / 2, (top + bottom) / 2)
+        if isinstance(cell, str):
+            draw.text(centre, cell, TEXT_RGB, font=get_font(EMOJI_FONT_FP, FONT_SIZE), anchor="mm")
+            return
+
+        text, sup = cell
+        font = self._font(text, FONT_SIZE)
+        max_width = right - left - 2 * CELL_PADDING
+        size = FONT_SIZE
+        while font.getlength(text) > max_width and size > 12:
+            size -= 2
+            font = self._font(text, size)
+
+        if not sup:
+            draw.text(centre, text, TEXT_RGB, font=font, anchor="mm")
+            return
+
+        sup_font = get_font(SUPERCELL_FONT_FP, SUP_FONT_SIZE)
+        text_width = font.getlength(text)
+        start = centre[0] - (text_width + 4 + sup_font.getlength(sup)) / 2
+        draw.text((start, centre[1]), text, TEXT_RGB, font=font, anchor="lm")
+        draw.text((start + text_width + 4, centre[1] - FONT_SIZE / 4), sup, TEXT_RGB, font=sup_font, anchor="lm")
+
+    def _draw_row(self, base, position, widths, cells, colour):
+        """One table row drawn over the part of ``base`` it covers, as an opaque tile to paste back at ``position``."""
+        tile = base.crop((*position, position[0] + sum(widths), position[1] + ROW_HEIGHT)).convert("RGBA")
+
+        # cell backgrounds are translucent, so they're drawn on their own layer and composited in one go.
+        layer = Image.new("RGBA", tile.size)
+        layer_draw = ImageDraw.Draw(layer)
+        x = 0
+        boxes = []
+        for i, cell in enumerate(cells):
+            if not widths[i]:
+                continue
+            box = (x, 0, x + widths[i], ROW_HEIGHT)
+            layer_draw.rectangle(box, fill=SELECTED_RGBA if i in self.selected_index else colour)
+            boxes.append((cell, box))
+            x += widths[i]
+
+        tile.alpha_composite(layer)
+        draw = ImageDraw.Draw(tile)
+        for cell, (left, top, right, bottom) in boxes:
+            if cell is None:
+                continue
+            if isinstance(cell, Image.Image):
+                tile.alpha_composite(cell, (int((left + right - cell.width) / 2), int((top + bottom - cell.height) / 2)))
+            else:
+                self._draw_cell(draw, cell, (left, top, right, bottom))
+        return tile.convert("RGB")
+
+    def _draw_base(self, size, table_lefts, widths):
+        """The background, title, header rows and footer: everything that doesn't change with the players."""
+        image = self._background(size).copy()
+        draw = ImageDraw.Draw(image)
+
+        title_font = self._font(self.title, TITLE_FONT_SIZE)
+        draw.text((size[0] / 2, TITLE_HEIGHT / 2), self.title, TEXT_RGB, font=title_font, anchor="mm")
+
+        header = [(c, None) if c else None for c in self.columns]
+        if self.show_icons:
+            header[ICON_COLUMN] = clan_header_icon()
+        for left in table_lefts:
+            position = (left, TITLE_HEIGHT + ROW_SPACING)
+            image.paste(self._draw_row(image, position, widths, header, HEADER_RGBA), position)
+
+        if self.footer and self.board_type != 'legend':
+            footer_font = get_font(SUPERCELL_FONT_FP, FOOTER_FONT_SIZE)
+            draw.text((TABLE_PADDING, size[1] - FOOTER_HEIGHT / 2), self.footer, TEXT_RGB, font=footer_font, anchor="lm")
+        return image
+
+    def draw(self, tiles=None):
+        """Draw the board and return it as a jpg.
+
+        Pass the :class:`BoardTiles` from this board's last draw and only rows whose content or rank changed are
+        re-rasterised; the rest, and the background, title and headers, are pasted from it.
+        """
+        tiles = tiles or BoardTiles()
+
+        double_column = len(self.rows) >= DOUBLE_COLUMN_ROWS
+        width = DOUBLE_COLUMN_WIDTH if double_column else SINGLE_COLUMN_WIDTH
         if double_column:
-            self.image = self.image.crop((0, 0, IMAGE_WIDTH, self.height + 160))
+            half = int(len(self.rows) / 2)
+            tables = ((0, half), (half, len(self.rows)))
         else:
-            self.image = self.image.crop((0, 0, IMAGE_WIDTH / 2 - 20, self.height + 160))
-
-    def render(self):
-        background = copy.deepcopy(BACKGROUND).resize((int(self.image.size[0] / 4), int(self.image.size[1] / 4)))
-        im = self.image.resize((int(self.image.size[0] / 4), int(self.image.size[1] / 4)))
-        background.paste(im, (0, 0), im)
+            tables = ((0, len(self.rows)), )
+
+        table_width = int(width / len(tables) - 2 * TABLE_PADDING)
+        table_lefts = [TABLE_PADDING + t * (table_width + 2 * TABLE_PADDING) for t in range(len(tables))]
+        widths = self._column_widths(table_width)
+        table_rows = max(end - start for start, end in tables) + 1
+        height = TITLE_HEIGHT + table_rows * (ROW_HEIGHT + ROW_SPACING) + ROW_SPACING
+        if self.footer and self.board_type != 'legend':
+            height += FOOTER_HEIGHT
+
+        base_key = (
+            self.image_url if self.background else None, (width, height), self.title, self.footer,
+            tuple(self.selected_index), self.show_icons, widths,
+        )
+        if tiles.base_key != base_key:
+            tiles.base = self._draw_base((width, height), table_lefts, widths)
+            tiles.base_key = base_key
+            tiles.rows = {}
+
+        image = tiles.base.copy()
+        slots = set()
+        for left, (start, end) in zip(table_lefts, tables):
+            for r, i in enumerate(range(start, end), start=1):
+                position = (left, TITLE_HEIGHT + ROW_SPACING + r * (ROW_HEIGHT + ROW_SPACING))
+                slots.add(position)
+                key = self.row_keys[i]
+                try:
+                    cached_key, tile = tiles.rows[position]
+                except KeyError:
+                    cached_key = tile = None
+
+                if cached_key != key:
+                    colour = EVEN_ROW_RGBA if r % 2 else ODD_ROW_RGBA
+                    tile = self._draw_row(tiles.base, position, widths, self.rows[i], colour)
+                    tiles.rows[position] = (key, tile)
+                    self.rows_drawn += 1
+                else:
+                    self.rows_reused += 1
+                image.paste(tile, position)
+
+        for position in set(tiles.rows) - slots:
+            del tiles.rows[position]
 
         buffer = io.BytesIO()
-        background.save(buffer, format="png")
+        image.save(buffer, format="jpeg", quality=JPEG_QUALITY)
         buffer.seek(0)
         return buffer
 
-
-class TrophyBoardImage:
-    def __init__(self, title, icon, season_start, season_finish):
-        self.title = title or "Trophy Board"
-        self.icon = icon
-        self.season_start, self.season_finish = season_start, season_finish
-        self.height = MINIMUM_COLUMN_HEIGHT
-        self.width = 0
-        self.max_width = IMAGE_WIDTH / 2 - 40
-        # self.image = copy.deepcopy(TROPHYBOARD_BACKGROUND)
-        self.image = Image.new("RGBA", (4500, 4000))
-        self.draw = ImageDraw.Draw(self.image)
-
-    def special_text(self, position, text, rgb, font_fp, font_size, max_width, centre_align=False, offset=0):
-        if CJK_REGEX.search(text):
-            font_fp = CJK_FRIENDLY_FONT_FP
-
-        font = ImageFont.truetype(font_fp, font_size)
-
-        text_width, text_height = self.draw.textsize(text, font)
-
-        need_to_offset = False
-        while text_width > max_width - offset:
-            font_size -= 1
-            font = ImageFont.truetype(font_fp, font_size)
-            text_width, text_height = self.draw.textsize(text, font)
-            need_to_offset = True
-
-        if need_to_offset and centre_align:
-            position = (int((max_width - text_width + offset) / 2), position[1])
-        elif centre_align:
-            position = (int((max_width - text_width) / 2), position[1])
-        elif offset:
-            position = (position[0] + offset, position[1])
-
-        self.draw.text(position, text, rgb, font)
-
-    def add_headers(self, add_double_column=False):
-        if add_double_column:
-            self.special_text((IMAGE_WIDTH / 4.5, 20), self.title, (255, 255, 255), REGULAR_FONT_FP, REGULAR_FONT_SIZE, max_width=IMAGE_WIDTH - 40, centre_align=True, offset=180 if self.icon else 0)
-        else:
-            self.special_text((40, 20), self.title, (255, 255, 255), REGULAR_FONT_FP, REGULAR_FONT_SIZE, max_width=int(IMAGE_WIDTH / 2) - 40, centre_align=True, offset=180 if self.icon else 0)
-
-        if self.icon:
-            self.image.paste(self.icon, (10, 10))
-
-        self.draw.rectangle(((LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT), ((IMAGE_WIDTH / 2) - 40, MINIMUM_COLUMN_HEIGHT + 100)), fill=T_HEADER_RECTANGLE_RGB)
-        self.draw.text((NUMBER_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "#", T_NUMBER_RGB, font=SUPERCELL_FONT)
-        self.draw.text((NAME_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Name", T_NAME_RGB, font=SUPERCELL_FONT)
-        self.draw.text((T_TROPHIES_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Cups", T_TROPHIES_RGB, font=SUPERCELL_FONT)
-        self.draw.text((T_GAIN_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Gain", T_GAIN_RGB, font=SUPERCELL_FONT)
-        self.draw.text((T_LAST_ONLINE_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Last On", T_LAST_ONLINE_RGB, font=SUPERCELL_FONT)
-
-        if add_double_column:
-            halfway = IMAGE_WIDTH / 2 + 40
-            self.draw.rectangle(((IMAGE_WIDTH + LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT), ((IMAGE_WIDTH / 2) + 40, MINIMUM_COLUMN_HEIGHT + 60)), fill=T_HEADER_RECTANGLE_RGB)
-            self.draw.text((halfway + NUMBER_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "#", T_NUMBER_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + NAME_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Name", T_NAME_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + T_TROPHIES_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Cups", T_TROPHIES_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + T_GAIN_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Gain", T_GAIN_RGB, font=SUPERCELL_FONT)
-            self.draw.text((halfway + T_LAST_ONLINE_LEFT_COLUMN_WIDTH, MINIMUM_COLUMN_HEIGHT + 2), "Last On", T_LAST_ONLINE_RGB, font=SUPERCELL_FONT)
-
-    def add_player(self, player):
-        self.height += 100
-        position = ((self.width or LEFT_COLUMN_WIDTH, self.height), (self.max_width, self.height + 80))
-
-        self.draw.rectangle(position, fill=T_RECTANGLE_RGB)
-        self.draw.text((self.width + NUMBER_LEFT_COLUMN_WIDTH, self.height + 2), f"{player.index}.", T_NUMBER_RGB, font=SUPERCELL_FONT)
-        self.special_text((self.width + NAME_LEFT_COLUMN_WIDTH, self.height + 2), str(player.name), T_NAME_RGB, SUPERCELL_FONT_FP, SUPERCELL_FONT_SIZE, 450)
-        self.draw.text((self.width + T_TROPHIES_LEFT_COLUMN_WIDTH, self.height + 2), str(player.trophies), T_TROPHIES_RGB, font=SUPERCELL_FONT)
-        self.draw.text((self.width + T_GAIN_LEFT_COLUMN_WIDTH, self.height + 2), str(player.gain), T_GAIN_RGB, font=SUPERCELL_FONT)
-        self.draw.text((self.width + T_LAST_ONLINE_LEFT_COLUMN_WIDTH, self.height + 2), get_readable(player.last_online), T_LAST_ONLINE_RGB, font=SUPERCELL_FONT)
-
-    def add_players(self, players):
-        double_column = len(players) > 25
-        self.add_headers(add_double_column=double_column)
-
-        if double_column:
-            no_players = len(players)
-
-            for p in players[:int(no_players / 2)]:
-                self.add_player(p)
-
-            self.width = IMAGE_WIDTH / 2 + 40
-            self.max_width = IMAGE_WIDTH
-            self.height = MINIMUM_COLUMN_HEIGHT
-
-            for p in players[int(no_players / 2):]:
-                self.add_player(p)
-
-        else:
-            for player in players:
-                self.add_player(player)
-
-        self.draw.text((40, self.height + 90), f"Season: {self.season_start} - {self.season_finish}.", NAME_RGB, font=SEASON_FONT)
-
-        if double_column:
-            self.image = self.image.crop((0, 0, IMAGE_WIDTH, self.height + 120))
-        else:
-            self.image = self.image.crop((0, 0, IMAGE_WIDTH / 2 - 20, self.height + 160))
-
-
-    def render(self):
-        background = copy.deepcopy(TROPHYBOARD_BACKGROUND).resize((int(self.image.size[0] / 4), int(self.image.size[1] / 4)))
-        im = self.image.resize((int(self.image.size[0] / 4), int(self.image.size[1] / 4)))
-        background.paste(im, (0, 0), im)
-
-        buffer = io.BytesIO()
-        background.save(buffer, format="png")
-        buffer.seek(0)
-        return buffer
-
-        self.image = self.image.resize((int(self.image.size[0] / 4), int(self.image.size[1] / 4)))
-        buffer = io.BytesIO()
-        self.image.save(buffer, format="png")
-        buffer.seek(0)
+    async def render(self, tiles=None):
+        s = time.perf_counter()
+        buffer = await asyncio.get_event_loop().run_in_executor(_draw_executor, self.draw, tiles)
+        log.debug((time.perf_counter() - s)*1000)
         return buffer
 
-
+    async def make(self):
+        await self.prepare()
+        return await self.render()
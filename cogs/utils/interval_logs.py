@@ -0,0 +1,293 @@
+import asyncio
+import heapq
+import logging
+
+log = logging.getLogger(__name__)
+
+# channels due within this many seconds of each other are drained and sent together.
+TICK = 5.0
+# the longest we'll sleep before checking the routing table for new or removed interval logs.
+MAX_SLEEP = 60.0
+
+# how often pending lines are written to postgres, so a restart doesn't lose them.
+CHECKPOINT_INTERVAL = 30.0
+
+PLAIN_LOAD_QUERY = "SELECT channel_id, type, fmt FROM tempevents WHERE shard IS NOT DISTINCT FROM $1 ORDER BY id"
+DETAILED_LOAD_QUERY = """SELECT channel_id, clan_tag, exact, combo, unknown
+                         FROM detailedtempevents
+                         WHERE shard IS NOT DISTINCT FROM $1
+                         ORDER BY id
+                      """
+
+PLAIN_DELETE_QUERY = """DELETE FROM tempevents
+                        USING unnest($1::BIGINT[], $2::TEXT[]) AS sent(channel_id, type)
+                        WHERE tempevents.channel_id = sent.channel_id
+                        AND tempevents.type = sent.type
+                        AND tempevents.shard IS NOT DISTINCT FROM $3
+                     """
+DETAILED_DELETE_QUERY = """DELETE FROM detailedtempevents
+                           WHERE channel_id = ANY($1::BIGINT[])
+                           AND shard IS NOT DISTINCT FROM $2
+                        """
+
+
+class IntervalLogBuffer:
+    """Holds the lines waiting for an interval log to fire, in memory.
+
+    Plain lines are kept per ``(channel_id, log type)``; detailed donation logs are kept per channel as
+    ``(clan_tag, exact, combo, unknown)`` tuples. Nothing touches the database when a line is added:
+    :meth:`checkpoint` copies everything added since the last checkpoint to ``tempevents`` / ``detailedtempevents``
+    in bulk, and :meth:`load` reads them back after a restart. Taking a channel's lines
+    (when its interval fires) deletes whatever part of them had been checkpointed.
+
+    Rows are tagged with the shard name when running sharded, so each process only recovers its own.
+    """
+    def __init__(self, pool, shard_name=None):
+        self.pool = pool
+        self.shard_name = shard_name
+
+        # key -> [items, number of items already checkpointed]
+        self.plain = {}
+        self.detailed = {}
+        self._plain_sent = set()
+        self._detailed_sent = set()
+
+        self.checkpoints = 0
+        self.checkpointed = 0
+
+    @property
+    def pending(self):
+        return sum(len(n[0]) for n in self.plain.values()) + sum(len(n[0]) for n in self.detailed.values())
+
+    def add(self, channel_id, log_type, fmt):
+        try:
+            self.plain[(channel_id, log_type)][0].append(fmt)
+        except KeyError:
+            self.plain[(channel_id, log_type)] = [[fmt], 0]
+
+    def add_detailed(self, channel_id, clan_tag, events):
+        item = (clan_tag, "\n".join(events["exact"]), "\n".join(events["combo"]), "\n".join(events["unknown"]))
+        try:
+            self.detailed[channel_id][0].append(item)
+        except KeyError:
+            self.detailed[channel_id] = [[item], 0]
+
+    def take(self, config):
+        """Remove and return the pending lines for a log config."""
+        if config.type == 'donation' and config.detailed:
+            items, persisted = self.detailed.pop(config.channel_id, ((), 0))
+            if persisted:
+                self._detailed_sent.add(config.channel_id)
+        else:
+            key = (config.channel_id, config.type)
+            items, persisted = self.plain.pop(key, ((), 0))
+            if persisted:
+                self._plain_sent.add(key)
+        return items
+
+    def discard_unrouted(self, configs):
+        """Drop the lines of logs that are no longer in ``configs``, eg. deleted or disabled, and return how many.
+
+        Lines that had been checkpointed are deleted from postgres at the next checkpoint, as if they'd been sent.
+        """
+        def routed(channel_id, log_type, detailed):
+            config = configs.get((channel_id, log_type))
+            return config is not None and (config.type == 'donation' and bool(config.detailed)) == detailed
+
+        dropped = 0
+        for key in [k for k in self.plain if not routed(*k, False)]:
+            items, persisted = self.plain.pop(key)
+            if persisted:
+                self._plain_sent.add(key)
+            dropped += len(items)
+        for channel_id in [k for k in self.detailed if not routed(k, 'donation', True)]:
+            items, persisted = self.detailed.pop(channel_id)
+            if persisted:
+                self._detailed_sent.add(channel_id)
+            dropped += len(items)
+        return dropped
+
+    async def load(self):
+        fetch = await self.pool.fetch(PLAIN_LOAD_QUERY, self.shard_name)
+        for row in fetch:
+            self.add(row['channel_id'], row['type'], row['fmt'])
+        for entry in self.plain.values():
+            entry[1] = len(entry[0])
+
+        detailed = await self.pool.fetch(DETAILED_LOAD_QUERY, self.shard_name)
+        for row in detailed:
+            item = (row['clan_tag'], row['exact'], row['combo'], row['unknown'])
+            self.detailed.setdefault(row['channel_id'], [[], 0])[0].append(item)
+        for entry in self.detailed.values():
+            entry[1] = len(entry[0])
+
+        if fetch or detailed:
+            log.info('recovered %s interval log lines and %s detailed events', len(fetch), len(detailed))
+
+    async def checkpoint(self):
+        """Delete checkpointed lines that have since been sent, then write everything new, in one transaction."""
+        plain_sent, self._plain_sent = self._plain_sent, set()
+        detailed_sent, self._detailed_sent = self._detailed_sent, set()
+
+        # snapshot how far each list has got, since more lines can be added while we're writing.
+        plain = [(key, entry, len(entry[0])) for key, entry in self.plain.items() if len(entry[0]) > entry[1]]
+        detailed = [(key, entry, len(entry[0])) for key, entry in self.detailed.items() if len(entry[0]) > entry[1]]
+
+        plain_records = [(key[0], fmt, key[1], self.shard_name) for key, entry, end in plain for fmt in entry[0][entry[1]:end]]
+        detailed_records = [(key, *item, self.shard_name) for key, entry, end in detailed for item in entry[0][entry[1]:end]]
+
+        if not (plain_sent or detailed_sent or plain_records or detailed_records):
+            return
+
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    if plain_sent:
+                        await conn.execute(PLAIN_DELETE_QUERY, *zip(*plain_sent), self.shard_name)
+                    if detailed_sent:
+                        await conn.execute(DETAILED_DELETE_QUERY, list(detailed_sent), self.shard_name)
+                    if plain_records:
+                        await conn.copy_records_to_table(
+                            'tempevents', records=plain_records, columns=('channel_id', 'fmt', 'type', 'shard')
+                        )
+                    if detailed_records:
+                        await conn.copy_records_to_table(
+                            'detailedtempevents',
+                            records=detailed_records,
+                            columns=('channel_id', 'clan_tag', 'exact', 'combo', 'unknown', 'shard')
+                        )
+        except:
+            # nothing was written; the deletes must still go first next time, before these keys are re-checkpointed.
+            self._plain_sent |= plain_sent
+            self._detailed_sent |= detailed_sent
+            raise
+
+        for _, entry, end in plain + detailed:
+            entry[1] = end
+
+        self.checkpoints += 1
+        self.checkpointed += len(plain_records) + len(detailed_records)
+
+
+class IntervalLogScheduler:
+    """Runs every interval log from a single task.
+
+    Each ``(channel_id, log type)`` with an interval has one entry in a heap ordered by when it's next due.
+    Lines waiting to be sent are held in an :class:`IntervalLogBuffer`; when a tick comes round, every channel
+    due in it has its lines taken and handed to ``dispatch(config, items)``. The same task checkpoints the buffer
+    every ``CHECKPOINT_INTERVAL`` seconds, so a checkpoint never races a channel being drained.
+
+    Configs come from the in-memory :class:`LogRoutingTable`, which is re-read whenever its version changes.
+    """
+    def __init__(self, pool, log_routes, dispatch, tick=TICK, shard_name=None):
+        self.pool = pool
+        self.log_routes = log_routes
+        self.dispatch = dispatch
+        self.tick = tick
+
+        self.buffer = IntervalLogBuffer(pool, shard_name)
+
+        self.configs = {}
+        self.due = {}
+        self._heap = []
+        self._version = None
+        self._next_checkpoint = 0.0
+        self._task = None
+
+        self.ticks = 0
+        self.fired = 0
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def _push(self, key, due):
+        self.due[key] = due
+        heapq.heappush(self._heap, (due, key))
+
+    def _sync(self, now):
+        if self._version == self.log_routes.version:
+            return
+
+        self._version = self.log_routes.version
+        self.configs = configs = self.log_routes.interval_configs()
+
+        for key, config in configs.items():
+            if key not in self.due:
+                self._push(key, now + config.seconds)
+
+        for key in [k for k in self.due if k not in configs]:
+            # the heap entry is left behind and skipped when it comes up.
+            del self.due[key]
+
+        dropped = self.buffer.discard_unrouted(configs)
+        if dropped:
+            log.info('discarded %s interval log lines for removed or disabled logs', dropped)
+
+    def _pop_due(self, now):
+        batch = []
+        while self._heap and self._heap[0][0] <= now + self.tick:
+            due, key = heapq.heappop(self._heap)
+            if self.due.get(key) != due:
+                continue  # removed or rescheduled since this entry was pushed
+
+            config = self.configs[key]
+            next_due = due + config.seconds
+            if next_due <= now:
+                # we've fallen behind (eg. a long flush), so don't try to catch up with a burst of sends.
+                next_due = now + config.seconds
+            self._push(key, next_due)
+            batch.append(config)
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        try:
+            await self.buffer.load()
+        except Exception:
+            log.exception('recovering checkpointed interval log lines')
+
+        self._next_checkpoint = loop.time() + CHECKPOINT_INTERVAL
+
+        while True:
+            now = loop.time()
+            self._sync(now)
+
+            batch = self._pop_due(now)
+            if batch:
+                self.fire(batch)
+
+            if now >= self._next_checkpoint:
+                self._next_checkpoint = now + CHECKPOINT_INTERVAL
+                try:
+                    await self.buffer.checkpoint()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception('checkpointing %s interval log lines', self.buffer.pending)
+
+            delay = min(MAX_SLEEP, self._next_checkpoint - loop.time())
+            if self._heap:
+                delay = min(delay, self._heap[0][0] - loop.time())
+            await asyncio.sleep(max(0.0, delay))
+
+    def fire(self, batch):
+        self.ticks += 1
+
+        for config in batch:
+            items = self.buffer.take(config)
+            if not items:
+                continue
+
+            self.fired += 1
+            asyncio.ensure_future(self._dispatch(config, items))
+
+    async def _dispatch(self, config, items):
+        try:
+            await self.dispatch(config, items)
+        except Exception:
+            log.exception('sending interval %s log to %s', config.type, config.channel_id)
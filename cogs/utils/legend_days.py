@@ -0,0 +1,186 @@
+import logging
+
+from array import array
+from datetime import timedelta
+
+log = logging.getLogger(__name__)
+
+LEGEND_LEAGUE_ID = 29000022
+# legend league days roll over at 5am UTC.
+RESET_HOUR = 5
+
+# column order of the running aggregates kept per player.
+STARTING, GAIN, LOSS, FINISHING, ATTACKS, DEFENSES = range(6)
+
+LOAD_QUERY = """SELECT player_tag, starting, gain, loss, finishing, attacks, defenses
+                FROM legend_days
+                WHERE day = $1
+             """
+# every value is absolute, so writing the same snapshot twice is harmless. the WHERE stops a snapshot that's older
+# than the row (fewer attacks + defenses, eg. from a shard that has since lost the player's clan) overwriting it.
+SNAPSHOT_QUERY = """INSERT INTO legend_days (player_tag, day, starting, gain, loss, finishing, attacks, defenses)
+                    SELECT x.player_tag, x.today, x.starting, x.gain, x.loss, x.finishing, x.attacks, x.defenses
+                    FROM jsonb_to_recordset($1::jsonb)
+                    AS x(
+                        player_tag TEXT,
+                        today timestamp,
+                        starting integer,
+                        gain integer,
+                        loss integer,
+                        finishing integer,
+                        attacks integer,
+                        defenses integer
+                    )
+                    ON CONFLICT (player_tag, day)
+                    DO UPDATE SET gain = excluded.gain,
+                                  loss = excluded.loss,
+                                  finishing = excluded.finishing,
+                                  attacks = excluded.attacks,
+                                  defenses = excluded.defenses
+                    WHERE legend_days.attacks + legend_days.defenses <= excluded.attacks + excluded.defenses
+                 """
+FINALISE_QUERY = """INSERT INTO legend_day_finalisations (day, finalised_at)
+                    VALUES ($1, now())
+                    ON CONFLICT (day) DO NOTHING
+                    RETURNING day
+                 """
+NEXT_DAY_QUERY = """INSERT INTO legend_days (player_tag, day, starting, gain, loss, finishing, attacks, defenses)
+                    SELECT player_tag, $1, trophies, 0, 0, trophies, 0, 0
+                    FROM players
+                    WHERE season_id = $2
+                    AND league_id = 29000022
+                    ON CONFLICT (player_tag, day)
+                    DO NOTHING
+                 """
+
+
+def legend_day_bounds(now):
+    """Return ``(start of the current legend day, start of the next one)`` for a naive UTC datetime."""
+    if now.hour >= RESET_HOUR:
+        tomorrow = (now + timedelta(days=1)).replace(hour=RESET_HOUR, minute=0, second=0, microsecond=0)
+    else:
+        tomorrow = now.replace(hour=RESET_HOUR, minute=0, second=0, microsecond=0)
+    return tomorrow - timedelta(days=1), tomorrow
+
+
+async def is_finalised(pool, day):
+    return bool(await pool.fetchval("SELECT 1 FROM legend_day_finalisations WHERE day = $1", day))
+
+
+async def finalise_legend_day(pool, day, season_id):
+    """Close ``day`` and open the next one, exactly once, whichever process gets here first.
+
+    The next day's rows start every legend league player at their current trophies. Claiming the day in
+    ``legend_day_finalisations`` happens in the same transaction, so a second caller (or a retry) blocks on the first
+    and then does nothing. Returns ``True`` if this call did the work.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if not await conn.fetchval(FINALISE_QUERY, day):
+                return False
+            await conn.execute(NEXT_DAY_QUERY, day + timedelta(days=1), season_id)
+
+    log.info('finalised legend day %s', day)
+    return True
+
+
+class LegendDays:
+    """Running legend league aggregates for the current day, per player, kept in memory.
+
+    Trophy changes are folded in as they happen by :meth:`record`; :meth:`snapshot` writes the players that changed
+    since the last one with absolute values, so a retried or repeated snapshot never double counts.
+    At the day boundary :meth:`finish_day` writes a final snapshot and runs the shared :func:`finalise_legend_day`.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+        self.day = None
+        self.players = {}
+        self.dirty = set()
+
+        self.snapshots = 0
+        self.rows_written = 0
+
+    def record(self, player_tag, old_trophies, trophies):
+        try:
+            row = self.players[player_tag]
+        except KeyError:
+            row = self.players[player_tag] = array('l', (old_trophies, 0, 0, old_trophies, 0, 0))
+
+        change = trophies - old_trophies
+        if change > 0:
+            row[GAIN] += change
+            row[ATTACKS] += 1
+        else:
+            row[LOSS] += change
+            row[DEFENSES] += 1
+        row[FINISHING] = trophies
+        self.dirty.add(player_tag)
+
+    async def start_day(self, day):
+        """Load what's already stored for ``day`` (eg. before a restart, or the rows opening it) under what we've got."""
+        fetch = await self.pool.fetch(LOAD_QUERY, day)
+        # anything recorded before this was for the day that's just started.
+        self.day = day
+
+        for record in fetch:
+            stored = array('l', (record['starting'], record['gain'] or 0, record['loss'] or 0, record['finishing'],
+                                 record['attacks'] or 0, record['defenses'] or 0))
+            row = self.players.get(record['player_tag'])
+            if row is None:
+                self.players[record['player_tag']] = stored
+                continue
+
+            # we've seen this player since the day started but before this load finished (and before any snapshot
+            # of the day, see snapshot()); add ours on top.
+            row[STARTING] = stored[STARTING]
+            for column in (GAIN, LOSS, ATTACKS, DEFENSES):
+                row[column] += stored[column]
+
+        log.info('loaded legend day %s for %s players', day, len(fetch))
+
+    async def _write(self, day, players, tags):
+        rows = [
+            {
+                'player_tag': tag,
+                'today': day.isoformat(),
+                'starting': players[tag][STARTING],
+                'gain': players[tag][GAIN],
+                'loss': players[tag][LOSS],
+                'finishing': players[tag][FINISHING],
+                'attacks': players[tag][ATTACKS],
+                'defenses': players[tag][DEFENSES],
+            }
+            for tag in tags
+        ]
+        await self.pool.execute(SNAPSHOT_QUERY, rows)
+        self.snapshots += 1
+        self.rows_written += len(rows)
+
+    async def snapshot(self):
+        if not self.dirty or self.day is None:
+            return
+
+        day, players = self.day, self.players
+        tags, self.dirty = self.dirty, set()
+        try:
+            await self._write(day, players, tags)
+        except:
+            if self.day == day:
+                self.dirty |= tags
+            raise
+
+    async def finish_day(self, season_id):
+        """Write the day's final snapshot, finalise it, and start the next day."""
+        day, players, dirty = self.day, self.players, self.dirty
+        # no snapshots until the next day is loaded, or what's recorded in between would be counted twice.
+        self.day, self.players, self.dirty = None, {}, set()
+
+        if dirty:
+            try:
+                await self._write(day, players, dirty)
+            except Exception:
+                log.exception('writing the final legend snapshot for %s', day)
+
+        await finalise_legend_day(self.pool, day, season_id)
+        await self.start_day(day + timedelta(days=1))
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import logging
+import math
+
+from cogs.utils.db_objects import LogConfig
+
+log = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'log_routes'
+
+ROUTES_QUERY = """SELECT logs.channel_id,
+                         clans.clan_tag,
+                         logs.guild_id,
+                         "interval",
+                         toggle,
+                         type,
+                         detailed
+                  FROM logs
+                  INNER JOIN clans
+                  ON logs.channel_id = clans.channel_id
+                  WHERE logs.toggle = TRUE
+               """
+
+CHECKSUM_QUERY = """SELECT md5(COALESCE(string_agg(x.line, E'\\n' ORDER BY x.line COLLATE "C"), ''))
+                    FROM (
+                        SELECT concat_ws('|',
+                                         logs.channel_id,
+                                         COALESCE(clans.clan_tag, ''),
+                                         COALESCE(logs.guild_id, 0),
+                                         COALESCE(floor(extract(epoch FROM "interval"))::bigint, 0),
+                                         COALESCE(logs.type, ''),
+                                         COALESCE(logs.detailed, FALSE)::int
+                               ) AS line
+                        FROM logs
+                        INNER JOIN clans
+                        ON logs.channel_id = clans.channel_id
+                        WHERE logs.toggle = TRUE
+                    ) AS x
+                 """
+
+
+def checksum_line(row):
+    """A route serialised exactly as ``CHECKSUM_QUERY`` serialises it, eg. ``123|#ABC|456|300|donation|1``."""
+    return '|'.join((
+        str(row['channel_id']),
+        row['clan_tag'] or '',
+        str(row['guild_id'] or 0),
+        str(math.floor(row['interval'].total_seconds()) if row['interval'] else 0),
+        row['type'] or '',
+        str(int(bool(row['detailed']))),
+    ))
+
+
+class LogRoutingTable:
+    """An in-memory map of ``(clan_tag, log type) -> [LogConfig]`` for every enabled log.
+
+    The table is loaded once, then kept up to date by the ``log_routes`` notifications that the
+    triggers on ``logs`` and ``clans`` send with the affected channel ID; only that channel's routes are re-read.
+    A periodic checksum against the database catches anything a dropped notification missed.
+    """
+    def __init__(self, pool, listener):
+        self.pool = pool
+        self.listener = listener
+
+        self.routes = {}
+        self._channel_rows = {}
+        # bumped on every change, so consumers can cheaply tell when to re-read the table.
+        self.version = 0
+
+        self.reloads = 0
+        self.channel_refreshes = 0
+        self.mismatches = 0
+
+    def get(self, clan_tag, log_type):
+        return self.routes.get((clan_tag, log_type), [])
+
+    def _rebuild(self):
+        routes = {}
+        for rows in self._channel_rows.values():
+            for row in rows:
+                routes.setdefault((row['clan_tag'], row['type']), []).append(LogConfig(bot=None, record=row))
+        self.routes = routes
+        self.version += 1
+
+    def _replace_channel(self, channel_id, rows):
+        for row in self._channel_rows.pop(channel_id, ()):
+            key = (row['clan_tag'], row['type'])
+            configs = [c for c in self.routes.get(key, ()) if c.channel_id != channel_id]
+            if configs:
+                self.routes[key] = configs
+            else:
+                self.routes.pop(key, None)
+
+        self.version += 1
+        if not rows:
+            return
+
+        self._channel_rows[channel_id] = rows
+        for row in rows:
+            self.routes.setdefault((row['clan_tag'], row['type']), []).append(LogConfig(bot=None, record=row))
+
+    def interval_configs(self):
+        """Return ``{(channel_id, log type): LogConfig}`` for every enabled log that posts on an interval."""
+        configs = {}
+        for channel_id, rows in self._channel_rows.items():
+            for row in rows:
+                key = (channel_id, row['type'])
+                if key not in configs and row['interval'] and row['interval'].total_seconds() > 0:
+                    configs[key] = LogConfig(bot=None, record=row)
+        return configs
+
+    async def start(self):
+        await self.listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        await self.reload()
+
+    def _on_notify(self, payload):
+        try:
+            channel_id = int(payload)
+        except ValueError:
+            log.warning('ignoring malformed %s notification %r', NOTIFY_CHANNEL, payload)
+            return
+
+        asyncio.ensure_future(self.refresh_channel(channel_id))
+
+    async def reload(self):
+        fetch = await self.pool.fetch(ROUTES_QUERY)
+        channel_rows = {}
+        for row in fetch:
+            channel_rows.setdefault(row['channel_id'], []).append(row)
+
+        self._channel_rows = channel_rows
+        self._rebuild()
+        self.reloads += 1
+        log.info('loaded %s log routes for %s channels', len(fetch), len(channel_rows))
+
+    async def refresh_channel(self, channel_id):
+        try:
+            fetch = await self.pool.fetch(ROUTES_QUERY + " AND logs.channel_id = $1", channel_id)
+        except Exception:
+            log.exception('refreshing log routes for channel %s', channel_id)
+            return
+
+        self._replace_channel(channel_id, fetch)
+        self.channel_refreshes += 1
+
+    def checksum(self):
+        lines = sorted(checksum_line(row) for rows in self._channel_rows.values() for row in rows)
+        # sorted() compares code points, which matches the "C" collation used by CHECKSUM_QUERY.
+        return hashlib.md5('\n'.join(lines).encode('utf-8')).hexdigest()
+
+    async def reconcile(self):
+        """Compare the in-memory table with the database, reloading it if they've drifted apart."""
+        await self.listener.connect()
+
+        remote = await self.pool.fetchval(CHECKSUM_QUERY)
+        if remote == self.checksum():
+            return False
+
+        self.mismatches += 1
+        log.warning('log routing table was out of sync with the database, reloading it')
+        await self.reload()
+        return True
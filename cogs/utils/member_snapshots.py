@@ -0,0 +1,111 @@
+import logging
+
+from coc.events import _ValidateEvent
+
+log = logging.getLogger(__name__)
+
+# the member fields the syncer cares about, in snapshot tuple order.
+NAME, EXP_LEVEL, TROPHIES, VERSUS_TROPHIES, DONATIONS, RECEIVED, LEAGUE_ID = range(7)
+
+
+def snapshot_of(data):
+    """Pack the tracked fields of one raw ``memberList`` entry into a tuple."""
+    data_get = data.get
+    return (
+        data_get("name"),
+        data_get("expLevel"),
+        data_get("trophies"),
+        data_get("versusTrophies"),
+        data_get("donations"),
+        data_get("donationsReceived"),
+        data_get("league", {}).get("id", None),
+    )
+
+
+def data_of(tag, snapshot):
+    """Rebuild just enough of a ``memberList`` entry from a snapshot to construct a member object from it."""
+    return {
+        "tag": tag,
+        "name": snapshot[NAME],
+        "expLevel": snapshot[EXP_LEVEL],
+        "trophies": snapshot[TROPHIES],
+        "versusTrophies": snapshot[VERSUS_TROPHIES],
+        "donations": snapshot[DONATIONS],
+        "donationsReceived": snapshot[RECEIVED],
+        "league": {"id": snapshot[LEAGUE_ID]} if snapshot[LEAGUE_ID] is not None else {},
+    }
+
+
+def clan_update():
+    """A clan event that calls back with every fresh clan, rather than running one member-by-member predicate per
+    attribute like coc.py's ``member_x`` events do."""
+    async def wrapped(cached_clan, clan, callback):
+        await callback(cached_clan, clan)
+
+    return _ValidateEvent.shortcut_register(wrapped, None, None, None, "clan")
+
+
+class MemberDiff:
+    __slots__ = ('changed', 'joined', 'left')
+
+    def __init__(self):
+        # (tag, old snapshot, new snapshot, raw data)
+        self.changed = []
+        # raw data
+        self.joined = []
+        # (tag, old snapshot)
+        self.left = []
+
+
+class MemberSnapshots:
+    """The last seen state of every member of every polled clan, as one tuple of tracked fields per member.
+
+    :meth:`diff` compares a clan's raw ``memberList`` with its snapshot field by field,
+    so the caller only needs to build member objects for the handful of members that changed.
+    """
+    def __init__(self):
+        self.clans = {}
+
+        self.diffs = 0
+        self.members_seen = 0
+        self.members_changed = 0
+
+    def __len__(self):
+        return sum(len(n) for n in self.clans.values())
+
+    def forget(self, clan_tag):
+        self.clans.pop(clan_tag, None)
+
+    def diff(self, clan_tag, member_list):
+        """Diff a clan's raw member list against its snapshot and replace the snapshot.
+
+        Returns ``None`` the first time a clan is seen, since there's nothing to compare against.
+        Joins and leaves are only reported when both the old and new member lists are non-empty,
+        like coc.py's join and leave events.
+        """
+        new = {m["tag"]: (snapshot_of(m), m) for m in member_list}
+        old = self.clans.get(clan_tag)
+        self.clans[clan_tag] = {tag: snapshot for tag, (snapshot, _) in new.items()}
+
+        self.diffs += 1
+        self.members_seen += len(new)
+        if old is None:
+            return None
+
+        diff = MemberDiff()
+        for tag, (snapshot, data) in new.items():
+            try:
+                old_snapshot = old[tag]
+            except KeyError:
+                if old:
+                    diff.joined.append(data)
+                continue
+
+            if old_snapshot != snapshot:
+                diff.changed.append((tag, old_snapshot, snapshot, data))
+
+        if new:
+            diff.left.extend((tag, snapshot) for tag, snapshot in old.items() if tag not in new)
+
+        self.members_changed += len(diff.changed)
+        return diff
@@ -0,0 +1,240 @@
+import asyncio
+import bisect
+import logging
+import re
+import time
+
+from aiohttp import web
+from coc.utils import HTTPStats
+
+log = logging.getLogger(__name__)
+
+# latency buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# how often the pool acquire probe takes and releases a connection, in seconds.
+POOL_PROBE_INTERVAL = 5
+# clan and player tags in coc API urls, so latencies are grouped per endpoint rather than per clan.
+COC_TAG_PATTERN = re.compile(r'/(%23|#)[0-9A-Za-z]+')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [*zip(labelnames, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(labels[n] for n in self.labelnames)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A gauge that's either set directly, or read from ``func`` at scrape time.
+
+    ``func`` returns a number, or for a labelled gauge an iterable of ``(label values tuple, number)``.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def samples(self):
+        if self.func is None:
+            yield from super().samples()
+            return
+
+        try:
+            value = self.func()
+        except Exception:
+            log.exception('reading gauge %s', self.name)
+            return
+
+        if not self.labelnames:
+            yield self.name, '', value
+            return
+        for key, value in value:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        try:
+            counts, total = self.values[key]
+        except KeyError:
+            counts, total = self.values[key] = [0] * (len(self.buckets) + 1), [0.0]
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def time(self, **labels):
+        """Context manager observing how long its body takes, in seconds."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _format_labels(self.labelnames, key, (('le', _format_value(bound)), )), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labelnames, key), total[0]
+            yield f'{self.name}_count', _format_labels(self.labelnames, key), cumulative
+
+
+class MetricsRegistry:
+    """The metrics a process exposes, rendered in the Prometheus text format by :func:`start_metrics`."""
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        try:
+            existing = self.metrics[metric.name]
+        except KeyError:
+            self.metrics[metric.name] = metric
+            return metric
+
+        # a module imported twice (eg. once as __main__) registers its metrics again; hand back the first ones.
+        if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError(f'metric {metric.name} is already registered')
+        return existing
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self._add(Gauge(name, documentation, labelnames, func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        return '\n'.join(m.render() for m in self.metrics.values()) + '\n'
+
+
+# every process has its own; modules register what they measure against this one at import.
+registry = MetricsRegistry()
+
+COC_HTTP_SECONDS = registry.histogram(
+    'coc_http_request_seconds', 'Latency of coc API requests, per endpoint.', ('endpoint', )
+)
+POOL_ACQUIRE_SECONDS = registry.histogram(
+    'db_pool_acquire_seconds', 'Time taken to acquire a connection from the asyncpg pool, sampled periodically.'
+)
+
+
+class InstrumentedHTTPStats(HTTPStats):
+    """coc.py's per-url latency store, also feeding :data:`COC_HTTP_SECONDS`.
+
+    coc.py records every request's latency (in ms) with ``stats[url] = latency``; the url is reduced to its endpoint.
+    """
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        endpoint = COC_TAG_PATTERN.sub('/{tag}', key.split('?', 1)[0].split('/v1', 1)[-1])
+        COC_HTTP_SECONDS.observe(value / 1000, endpoint=endpoint)
+
+
+async def _probe_pool(pool):
+    while True:
+        start = time.perf_counter()
+        try:
+            async with pool.acquire():
+                POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - start)
+        except Exception:
+            log.exception('probing pool acquire time')
+        await asyncio.sleep(POOL_PROBE_INTERVAL)
+
+
+async def _handle_metrics(request):
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def start_metrics(port, *, pool=None, coc_client=None, host='127.0.0.1'):
+    """Serve :data:`registry` on ``http://host:port/metrics``, and instrument the pool and coc client if given.
+
+    Failing to bind is logged rather than raised, so a port clash never stops the process itself from running.
+    """
+    if coc_client is not None and coc_client.http is not None:
+        stats = coc_client.http.stats
+        coc_client.http.stats = InstrumentedHTTPStats(max_size=stats.max_size)
+
+    if pool is not None:
+        registry.gauge('db_pool_size', 'Connections currently open in the asyncpg pool.',
+                       func=lambda: sum(1 for holder in pool._holders if holder._con is not None))
+        registry.gauge('db_pool_available', 'Connection slots in the asyncpg pool free to be acquired.',
+                       func=lambda: pool._queue.qsize())
+        asyncio.ensure_future(_probe_pool(pool))
+
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        log.exception('failed to start the metrics endpoint on %s:%s', host, port)
+    else:
+        log.info('serving metrics on http://%s:%s/metrics', host, port)
+    return runner
@@ -0,0 +1,45 @@
+import logging
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+
+class NotificationListener:
+    """A single dedicated connection for Postgres LISTEN/NOTIFY, shared by everything in a process that needs it.
+
+    Pool connections can't be used for this, since the pool issues ``UNLISTEN *`` whenever a connection is released.
+    """
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.callbacks = {}
+        self._conn = None
+
+    @property
+    def connected(self):
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def add_listener(self, channel, callback):
+        """Register ``callback(payload)`` to be called for every notification on ``channel``."""
+        self.callbacks[channel] = callback
+        if self.connected:
+            await self._conn.add_listener(channel, self._dispatch)
+        else:
+            await self.connect()
+
+    def _dispatch(self, conn, pid, channel, payload):
+        try:
+            self.callbacks[channel](payload)
+        except Exception:
+            log.exception('handling notification on %s: %r', channel, payload)
+
+    async def connect(self):
+        """(Re)connect if needed. Returns True if a new connection was made, in which case notifications may have been missed."""
+        if self.connected:
+            return False
+
+        self._conn = await asyncpg.connect(self.dsn)
+        for channel in self.callbacks:
+            await self._conn.add_listener(channel, self._dispatch)
+        log.info('listening for notifications on %s', ', '.join(self.callbacks))
+        return True
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+StageTiming = namedtuple('StageTiming', 'name started waited elapsed success')
+
+
+class FlushStage:
+    __slots__ = ('name', 'func', 'depends_on', 'uses_db')
+
+    def __init__(self, name, func, depends_on=(), uses_db=True):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.uses_db = uses_db
+
+
+class FlushPipeline:
+    """Runs a set of flush stages concurrently, respecting the dependencies between them.
+
+    A stage only starts once every stage it depends on has finished (successfully or not),
+    and stages that use the database share a semaphore sized to the connection pool,
+    so we never queue more work on the pool than it can hand out connections for.
+    """
+    def __init__(self, max_concurrency=10):
+        self.max_concurrency = max_concurrency
+        self.stages = {}
+        self.last_timings = []
+
+    def add_stage(self, name, func, *, depends_on=(), uses_db=True):
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"stage {name} depends on {dependency} which hasn't been added yet")
+
+        self.stages[name] = FlushStage(name, func, depends_on, uses_db)
+
+    async def _run_stage(self, stage, futures, semaphore, start):
+        if stage.depends_on:
+            await asyncio.gather(*(futures[n] for n in stage.depends_on if n in futures))
+
+        queued = time.perf_counter()
+        if stage.uses_db:
+            await semaphore.acquire()
+
+        started = time.perf_counter()
+        try:
+            await stage.func()
+        except Exception:
+            log.exception('flush stage %s failed', stage.name)
+            success = False
+        else:
+            success = True
+        finally:
+            if stage.uses_db:
+                semaphore.release()
+
+        now = time.perf_counter()
+        return StageTiming(
+            name=stage.name,
+            started=(started - start) * 1000,
+            waited=(started - queued) * 1000,
+            elapsed=(now - started) * 1000,
+            success=success,
+        )
+
+    async def run(self, only=None):
+        """Run every stage once and return a list of :class:`StageTiming`, in the order stages were added.
+
+        All times are in milliseconds; ``started`` is relative to the start of the flush.
+        Pass ``only``, some stage names, to run just those; they still wait for each other, but not for the rest.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        start = time.perf_counter()
+
+        futures = {}
+        for name, stage in self.stages.items():
+            if only is not None and name not in only:
+                continue
+            # stages are added in dependency order, so every future we depend on already exists.
+            futures[name] = asyncio.ensure_future(self._run_stage(stage, futures, semaphore, start))
+
+        timings = await asyncio.gather(*futures.values())
+        if only is None:
+            self.last_timings = timings
+        return timings
+
+    @staticmethod
+    def to_struct(timings):
+        return {
+            'total': max((t.started + t.elapsed for t in timings), default=0),
+            'stages': {t.name: t._asdict() for t in timings},
+        }
@@ -0,0 +1,130 @@
+import logging
+import time
+
+from collections import Counter
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# polling intervals are kept between these, in seconds. coc.py's clan loop sleeps 10 seconds between loops anyway.
+MIN_INTERVAL = 10
+MAX_INTERVAL = 600
+# poll often enough to expect about this many donation/trophy events per poll.
+EVENTS_PER_POLL = 1.0
+# how many days of activity_query to build the hour-of-day profile from.
+PROFILE_DAYS = 14
+# weight given to the newest observed rate in each clan's moving average.
+LIVE_RATE_WEIGHT = 0.3
+# unused budget can build up to this many seconds' worth, so a quiet spell lets the next busy one catch up.
+BUDGET_BURST_SECONDS = 60
+
+PROFILE_QUERY = """SELECT clan_tag, hour_digit, SUM(counter) AS events
+                   FROM activity_query
+                   WHERE hour_time > now() - ($1 || ' days')::interval
+                   GROUP BY clan_tag, hour_digit
+                """
+
+
+class ClanPollSchedule:
+    """Decides which clans coc.py polls on each clan loop.
+
+    Each clan is given an interval from its expected event rate: the busier of its usual rate for this hour of day
+    (from ``activity_query``) and a moving average of what the syncer has actually seen lately.
+    A clan expected to donate constantly is polled every loop; a dead one every :data:`MAX_INTERVAL` seconds.
+
+    Each loop, the clans that are due are ranked by how overdue they are and only as many as the request budget
+    allows are polled. The budget is a token bucket filled at ``requests_per_second``;
+    clans that miss out stay due and rank higher next loop.
+    """
+    def __init__(self, pool, coc_client, requests_per_second):
+        self.pool = pool
+        self.coc_client = coc_client
+        self.requests_per_second = requests_per_second
+
+        self.tags = set()
+        self.profile = {}
+        self.live_rate = {}
+        self.next_due = {}
+        self.last_polled = {}
+        self.polling = []
+        # called with the tags that are no longer polled, so whatever's cached for them can be dropped.
+        self.on_remove = None
+
+        self.tokens = requests_per_second * BUDGET_BURST_SECONDS
+        self._last_refill = time.monotonic()
+
+        self.polled = 0
+        self.deferred = 0
+
+    def set_tags(self, tags):
+        """Replace the set of clans to poll. New clans are due straight away."""
+        tags = set(tags)
+        removed = self.tags - tags
+        for tag in tags - self.tags:
+            self.next_due[tag] = 0
+        for tag in removed:
+            self.next_due.pop(tag, None)
+            self.last_polled.pop(tag, None)
+            self.live_rate.pop(tag, None)
+        self.tags = tags
+
+        if removed and self.on_remove:
+            self.on_remove(removed)
+
+    async def load_profile(self):
+        fetch = await self.pool.fetch(PROFILE_QUERY, str(PROFILE_DAYS))
+        profile = {}
+        for row in fetch:
+            profile.setdefault(row['clan_tag'], [0.0] * 24)[row['hour_digit']] = row['events'] / PROFILE_DAYS
+        self.profile = profile
+        log.info('loaded hourly activity profiles for %s clans', len(profile))
+
+    def interval(self, tag, hour):
+        try:
+            expected = self.profile[tag][hour]
+        except KeyError:
+            expected = 0.0
+        rate = max(expected, self.live_rate.get(tag, 0.0))  # events per hour
+        if rate <= 0:
+            return MAX_INTERVAL
+        return min(MAX_INTERVAL, max(MIN_INTERVAL, 3600 * EVENTS_PER_POLL / rate))
+
+    def record(self, clan_event_counts: Counter):
+        """Fold the events seen for the clans polled last loop into their moving averages."""
+        now = time.monotonic()
+        for tag in self.polling:
+            if tag not in self.tags:
+                continue  # removed since
+            last = self.last_polled.get(tag)
+            self.last_polled[tag] = now
+            if last is None:
+                continue
+
+            rate = clan_event_counts[tag] * 3600 / max(now - last, 1)
+            self.live_rate[tag] = LIVE_RATE_WEIGHT * rate + (1 - LIVE_RATE_WEIGHT) * self.live_rate.get(tag, rate)
+
+    def next_loop(self):
+        """Pick the clans for the next loop and hand them to coc.py."""
+        now = time.monotonic()
+        self.tokens = min(
+            self.tokens + (now - self._last_refill) * self.requests_per_second,
+            self.requests_per_second * BUDGET_BURST_SECONDS
+        )
+        self._last_refill = now
+
+        hour = datetime.utcnow().hour
+        due = [tag for tag in self.tags if self.next_due[tag] <= now]
+        if len(due) > self.tokens:
+            # most overdue (relative to how often they should be polled) first.
+            due.sort(key=lambda t: (now - self.last_polled.get(t, 0)) / self.interval(t, hour), reverse=True)
+            self.deferred += len(due) - int(self.tokens)
+            due = due[:int(self.tokens)]
+
+        for tag in due:
+            self.next_due[tag] = now + self.interval(tag, hour)
+
+        self.tokens -= len(due)
+        self.polled += len(due)
+        self.polling = due
+        self.coc_client._clan_updates = due
+        return due
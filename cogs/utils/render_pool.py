@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import struct
+import sys
+
+log = logging.getLogger(__name__)
+
+# how long a worker may take to start, answer a ping, or render one board, in seconds.
+START_TIMEOUT = 30
+PING_TIMEOUT = 5
+RENDER_TIMEOUT = 30
+# how often idle workers are pinged.
+HEALTH_CHECK_INTERVAL = 30
+
+
+class RendererBusy(Exception):
+    """Raised when too many renders are already waiting for a worker."""
+
+
+class RenderError(Exception):
+    pass
+
+
+async def cold_render(html):
+    """Render with a fresh ``wkhtmltoimage`` process, paying its start-up for every image."""
+    proc = await asyncio.create_subprocess_exec(
+        "wkhtmltoimage", "-", "-",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, stdin=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await proc.communicate(input=html)
+    return stdout
+
+
+class RenderWorker:
+    """One ``cogs.utils.render_worker`` process, spoken to with length-prefixed messages over its stdin and stdout."""
+    def __init__(self):
+        self.proc = None
+        self.renders = 0
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "cogs.utils.render_worker",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+        )
+        status, payload = await asyncio.wait_for(self._read(), START_TIMEOUT)
+        if status != b'O':
+            await self.kill()
+            raise RenderError(payload.decode(errors='replace'))
+
+    async def _read(self):
+        header = await self.proc.stdout.readexactly(4)
+        (length, ) = struct.unpack('>I', header)
+        message = await self.proc.stdout.readexactly(length)
+        return message[:1], message[1:]
+
+    async def request(self, kind, payload=b'', timeout=RENDER_TIMEOUT):
+        self.proc.stdin.write(struct.pack('>I', len(payload) + 1) + kind + payload)
+        await self.proc.stdin.drain()
+        status, payload = await asyncio.wait_for(self._read(), timeout)
+        if status != b'O':
+            raise RenderError(payload.decode(errors='replace'))
+        return payload
+
+    async def kill(self):
+        if self.proc and self.proc.returncode is None:
+            self.proc.kill()
+            await self.proc.wait()
+
+
+class RendererPool:
+    """A fixed number of warm renderer workers, so a board render doesn't pay for starting WebKit.
+
+    Renders wait for an idle worker; once ``max_queue`` are already waiting, :meth:`render` raises
+    :class:`RendererBusy` instead of queueing more. A worker that dies, hangs or fails a health check is replaced.
+    If no worker can be started at all (eg. libwkhtmltox isn't installed) renders fall back to :func:`cold_render`.
+    """
+    def __init__(self, size=2, max_queue=20):
+        self.size = size
+        self.max_queue = max_queue
+
+        self._idle = asyncio.Queue()
+        self._waiting = 0
+        self._health_task = None
+        self.available = False
+
+        self.restarts = 0
+        self.fallbacks = 0
+
+    async def start(self):
+        for _ in range(self.size):
+            worker = await self._new_worker()
+            if worker is None:
+                log.warning('renderer workers are unavailable, boards will be rendered with a process each')
+                return
+            self._idle.put_nowait(worker)
+
+        self.available = True
+        self._health_task = asyncio.ensure_future(self._health_checks())
+
+    async def _new_worker(self):
+        worker = RenderWorker()
+        try:
+            await worker.start()
+        except Exception:
+            log.exception('starting a renderer worker')
+            await worker.kill()
+            return None
+        return worker
+
+    async def _replace(self, worker):
+        await worker.kill()
+        self.restarts += 1
+        new = await self._new_worker()
+        if new is None:
+            # try again at the next health check rather than losing the slot.
+            new = RenderWorker()
+        self._idle.put_nowait(new)
+
+    async def _health_checks(self):
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for _ in range(self._idle.qsize()):
+                worker = self._idle.get_nowait()
+                try:
+                    await worker.request(b'P', timeout=PING_TIMEOUT)
+                except Exception:
+                    log.warning('renderer worker failed a health check, restarting it')
+                    await self._replace(worker)
+                else:
+                    self._idle.put_nowait(worker)
+
+    async def render(self, html):
+        """Return the image for an HTML document, as bytes."""
+        if not self.available:
+            self.fallbacks += 1
+            return await cold_render(html)
+        if self._waiting >= self.max_queue:
+            raise RendererBusy(f'{self._waiting} renders are already waiting for a worker')
+
+        self._waiting += 1
+        try:
+            worker = await self._idle.get()
+        finally:
+            self._waiting -= 1
+
+        if worker.proc is None:
+            # its last restart failed; try again in the background and render this one the slow way.
+            asyncio.ensure_future(self._replace(worker))
+            self.fallbacks += 1
+            return await cold_render(html)
+
+        try:
+            image = await worker.request(b'H', html)
+        except RenderError:
+            # the worker's fine, the document wasn't.
+            self._idle.put_nowait(worker)
+            raise
+        except (Exception, asyncio.CancelledError):
+            # died, hung or we were cancelled mid-message; its pipe can't be trusted any more either way.
+            asyncio.ensure_future(self._replace(worker))
+            raise
+        else:
+            worker.renders += 1
+            self._idle.put_nowait(worker)
+            return image
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+        self.available = False
+        while not self._idle.empty():
+            await self._idle.get_nowait().kill()
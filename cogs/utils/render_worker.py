@@ -0,0 +1,113 @@
+"""A long-lived board renderer, run by :class:`cogs.utils.render_pool.RendererPool` as ``python -m cogs.utils.render_worker``.
+
+It loads libwkhtmltox (the library behind the wkhtmltoimage binary) once, so WebKit and the fonts are initialised
+once per worker rather than once per board, then renders HTML documents read from stdin until stdin closes.
+
+Every message in either direction is a 4 byte big-endian length followed by that many bytes.
+Requests start with ``H`` (render the HTML that follows) or ``P`` (ping). Responses start with ``O`` (ok,
+followed by the image for a render) or ``E`` (error, followed by a message). A ``O`` is sent once at start-up
+when the library's loaded.
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+LIBRARY_NAMES = ('wkhtmltox', 'libwkhtmltox.so.0', 'libwkhtmltox.so')
+# the same output `wkhtmltoimage - -` gives: it writes jpg when it can't tell the format from a file name.
+GLOBAL_SETTINGS = {
+    'fmt': 'jpg',
+    'out': '',  # keep the image in memory
+    'load.blockLocalFileAccess': 'false',  # board icons are local files
+}
+
+
+def load_library():
+    for name in LIBRARY_NAMES:
+        path = ctypes.util.find_library(name) if '.' not in name else name
+        if not path:
+            continue
+        try:
+            lib = ctypes.CDLL(path)
+        except OSError:
+            continue
+
+        lib.wkhtmltoimage_create_global_settings.restype = ctypes.c_void_p
+        lib.wkhtmltoimage_set_global_setting.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p)
+        lib.wkhtmltoimage_create_converter.restype = ctypes.c_void_p
+        lib.wkhtmltoimage_create_converter.argtypes = (ctypes.c_void_p, ctypes.c_char_p)
+        lib.wkhtmltoimage_convert.argtypes = (ctypes.c_void_p, )
+        lib.wkhtmltoimage_get_output.restype = ctypes.c_long
+        lib.wkhtmltoimage_get_output.argtypes = (ctypes.c_void_p, ctypes.POINTER(ctypes.POINTER(ctypes.c_ubyte)))
+        lib.wkhtmltoimage_destroy_converter.argtypes = (ctypes.c_void_p, )
+        return lib
+
+    raise OSError('libwkhtmltox could not be found')
+
+
+def render(lib, html):
+    # the converter takes ownership of the settings object, so each render needs a fresh one.
+    settings = lib.wkhtmltoimage_create_global_settings()
+    for name, value in GLOBAL_SETTINGS.items():
+        lib.wkhtmltoimage_set_global_setting(settings, name.encode(), value.encode())
+
+    converter = lib.wkhtmltoimage_create_converter(settings, html)
+    try:
+        if not lib.wkhtmltoimage_convert(converter):
+            raise RuntimeError('wkhtmltoimage failed to convert the document')
+        data = ctypes.POINTER(ctypes.c_ubyte)()
+        length = lib.wkhtmltoimage_get_output(converter, ctypes.byref(data))
+        return ctypes.string_at(data, length)
+    finally:
+        lib.wkhtmltoimage_destroy_converter(converter)
+
+
+def read_message(stream):
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    (length, ) = struct.unpack('>I', header)
+    return stream.read(length)
+
+
+def write_message(stream, payload):
+    stream.write(struct.pack('>I', len(payload)) + payload)
+    stream.flush()
+
+
+def main():
+    stdin = sys.stdin.buffer
+    # anything WebKit prints goes to stderr, so it can't corrupt the responses.
+    stdout = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    try:
+        lib = load_library()
+        lib.wkhtmltoimage_init(0)
+    except Exception as exc:
+        write_message(stdout, b'E' + str(exc).encode())
+        return
+    write_message(stdout, b'O')
+
+    while True:
+        message = read_message(stdin)
+        if message is None:
+            break
+
+        if message[:1] == b'P':
+            write_message(stdout, b'O')
+            continue
+
+        try:
+            image = render(lib, message[1:])
+        except Exception as exc:
+            write_message(stdout, b'E' + str(exc).encode())
+        else:
+            write_message(stdout, b'O' + image)
+
+    lib.wkhtmltoimage_deinit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# how often a process that isn't running the rollover checks whether it's finished, in seconds.
+FOLLOW_INTERVAL = 10
+# players copied per chunk: where it starts, and the bounds it's adjusted within.
+INITIAL_CHUNK_SIZE = 1000
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 10000
+# chunks taking longer than this mean the database is busy, so they're shrunk (and grown again when it isn't).
+TARGET_CHUNK_SECONDS = 0.25
+
+# the column list the new season's rows are created with; the carried over trophies are capped at 5000 like in-game.
+COPY_COLUMNS = """player_tag,
+                  donations,
+                  received,
+                  user_id,
+                  season_id,
+                  player_name,
+                  start_trophies,
+                  trophies,
+                  clan_tag,
+                  league_id,
+                  legend_trophies
+               """
+COPY_SELECT = """SELECT player_tag,
+                        0,
+                        0,
+                        user_id,
+                        $2,
+                        player_name,
+                        LEAST(trophies, 5000),
+                        LEAST(trophies, 5000),
+                        clan_tag,
+                        league_id,
+                        CASE WHEN league_id = 29000022 AND trophies > 5000 THEN legend_trophies + trophies - 5000 ELSE legend_trophies END
+              """
+
+START_QUERY = """INSERT INTO season_rollovers (season_id, from_season_id, last_player_tag, copied, started_at)
+                 VALUES ($1, $2, '', 0, now())
+                 ON CONFLICT (season_id) DO NOTHING
+              """
+PENDING_QUERY = "SELECT season_id, from_season_id FROM season_rollovers WHERE finished_at IS NULL ORDER BY season_id"
+STATUS_QUERY = "SELECT from_season_id, finished_at FROM season_rollovers WHERE season_id = $1"
+# locking the progress row means two runners (eg. after a shard leader change) take turns rather than racing.
+PROGRESS_QUERY = """SELECT from_season_id, last_player_tag, finished_at
+                    FROM season_rollovers
+                    WHERE season_id = $1
+                    FOR UPDATE
+                 """
+# players are taken in player_tag order after the last one copied, which the (season_id, player_tag) unique index
+# serves directly. rows the syncer has already created in the new season are left alone.
+CHUNK_QUERY = f"""WITH chunk AS (
+                      SELECT *
+                      FROM players
+                      WHERE season_id = $1
+                      AND player_tag > $3
+                      ORDER BY player_tag
+                      LIMIT $4
+                  ),
+                  inserted AS (
+                      INSERT INTO players ({COPY_COLUMNS})
+                      {COPY_SELECT}
+                      FROM chunk
+                      ON CONFLICT (season_id, player_tag) DO NOTHING
+                      RETURNING 1
+                  )
+                  SELECT max(chunk.player_tag) AS last_player_tag,
+                         count(*) AS chunk_size,
+                         (SELECT count(*) FROM inserted) AS inserted
+                  FROM chunk
+               """
+ADVANCE_QUERY = """UPDATE season_rollovers
+                   SET last_player_tag = $2, copied = copied + $3
+                   WHERE season_id = $1
+                """
+FINISH_QUERY = "UPDATE season_rollovers SET finished_at = now() WHERE season_id = $1"
+COPY_PLAYERS_QUERY = f"""INSERT INTO players ({COPY_COLUMNS})
+                         {COPY_SELECT}
+                         FROM players
+                         WHERE season_id = $1
+                         AND player_tag = ANY($3::TEXT[])
+                         ON CONFLICT (season_id, player_tag) DO NOTHING
+                      """
+
+
+class SeasonRollover:
+    """Copies every player from the previous season into a new one, a chunk at a time.
+
+    Progress is kept in ``season_rollovers``, committed with each chunk, so a restarted syncer carries on from the
+    last player copied. Chunks are sized to keep each one near :data:`TARGET_CHUNK_SECONDS`,
+    and the job sleeps as long as each chunk took, so it never has the database more than about half the time.
+
+    While a rollover runs, :meth:`copy_players` lets the flush copy the handful of players it's about to write to
+    first, so their events land in the new season instead of updating rows that don't exist yet.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        # new season id: previous season id, for rollovers in progress.
+        self.active = {}
+        self.chunk_size = INITIAL_CHUNK_SIZE
+
+        self.chunks = 0
+        self.copied = 0
+
+    async def start(self, conn, season_id, from_season_id):
+        """Record a rollover to run; pass the connection that's creating the season so it's in the same transaction."""
+        await conn.execute(START_QUERY, season_id, from_season_id)
+
+    async def pending(self):
+        return await self.pool.fetch(PENDING_QUERY)
+
+    async def _copy_chunk(self, season_id):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                progress = await conn.fetchrow(PROGRESS_QUERY, season_id)
+                if progress is None or progress['finished_at'] is not None:
+                    return None
+
+                result = await conn.fetchrow(
+                    CHUNK_QUERY, progress['from_season_id'], season_id, progress['last_player_tag'], self.chunk_size
+                )
+                if not result['chunk_size']:
+                    await conn.execute(FINISH_QUERY, season_id)
+                    return None
+
+                await conn.execute(ADVANCE_QUERY, season_id, result['last_player_tag'], result['chunk_size'])
+                return result['chunk_size']
+
+    def _adjust(self, elapsed):
+        if elapsed > TARGET_CHUNK_SECONDS:
+            self.chunk_size = max(MIN_CHUNK_SIZE, self.chunk_size // 2)
+        elif elapsed < TARGET_CHUNK_SECONDS / 2:
+            self.chunk_size = min(MAX_CHUNK_SIZE, self.chunk_size * 3 // 2)
+
+    async def run(self, season_id, from_season_id):
+        """Copy chunks until the previous season is exhausted. Safe to call again (or concurrently) after a restart."""
+        self.active[season_id] = from_season_id
+        log.info('rolling players over from season %s to %s', from_season_id, season_id)
+        try:
+            while True:
+                start = time.perf_counter()
+                copied = await self._copy_chunk(season_id)
+                if copied is None:
+                    break
+
+                elapsed = time.perf_counter() - start
+                self.chunks += 1
+                self.copied += copied
+                self._adjust(elapsed)
+                await asyncio.sleep(elapsed)
+        finally:
+            self.active.pop(season_id, None)
+
+        log.info('finished rolling players over to season %s', season_id)
+
+    async def follow(self, season_id, is_leader=None):
+        """Track a rollover another process is running, so :meth:`copy_players` works here too until it's finished.
+
+        ``is_leader`` is checked each time round; once it returns True (eg. the process running the rollover died
+        and this one took over its lock) this process carries on copying from where it got to.
+        """
+        while True:
+            status = await self.pool.fetchrow(STATUS_QUERY, season_id)
+            if status is None or status['finished_at'] is not None:
+                self.active.pop(season_id, None)
+                return
+            if is_leader is not None and is_leader():
+                return await self.run(season_id, status['from_season_id'])
+            self.active[season_id] = status['from_season_id']
+            await asyncio.sleep(FOLLOW_INTERVAL)
+
+    async def copy_players(self, season_id, player_tags):
+        """Copy these players into ``season_id`` now, if it's being rolled over and they haven't been already."""
+        try:
+            from_season_id = self.active[season_id]
+        except KeyError:
+            return
+        await self.pool.execute(COPY_PLAYERS_QUERY, from_season_id, season_id, list(player_tags))
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+
+import discord
+
+log = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 2000
+# how often buckets for channels that have gone quiet are dropped, in seconds.
+PRUNE_INTERVAL = 60
+
+
+class ChannelBucket:
+    """Mirrors Discord's per-channel message bucket, so we hold off before hitting a 429 rather than after.
+
+    Discord allows roughly 5 messages per channel every 5 seconds; a 429 tells us exactly when the bucket resets.
+    """
+    __slots__ = ('limit', 'per', 'remaining', 'reset_at')
+
+    def __init__(self, limit=5, per=5.0):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def delay(self, now):
+        """Return how long to wait before sending, or 0 if a message can go now (consuming a slot)."""
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+
+        if self.remaining <= 0:
+            return self.reset_at - now
+
+        self.remaining -= 1
+        return 0
+
+    def rate_limited(self, now, retry_after):
+        self.remaining = 0
+        self.reset_at = now + retry_after
+
+
+class SendScheduler:
+    """Queues log messages per channel and sends them with a fixed number of workers.
+
+    Each channel has its own queue and rate limit bucket, and only one message per channel is in flight at once,
+    so a slow or rate limited channel only delays itself. While a channel is backed up,
+    consecutive plain-text messages are merged up to Discord's 2000 character limit so it catches up in fewer requests.
+    """
+    def __init__(self, send_func, max_concurrency=10):
+        self.send_func = send_func
+        self.max_concurrency = max_concurrency
+
+        self.queues = {}
+        self.buckets = {}
+        self._scheduled = set()
+        self._ready = asyncio.Queue()
+        self._workers = []
+        self._next_prune = 0.0
+
+        self.sent = 0
+        self.merged = 0
+        self.rate_limited = 0
+
+    @property
+    def pending(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def start(self):
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.max_concurrency)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+
+    def send(self, channel_id, content=None, embed=None):
+        """Queue a message for a channel. This never blocks."""
+        try:
+            queue = self.queues[channel_id]
+        except KeyError:
+            queue = self.queues[channel_id] = deque()
+
+        queue.append((content, embed))
+        self._schedule(channel_id)
+
+    def _schedule(self, channel_id):
+        if channel_id in self._scheduled:
+            return
+        self._scheduled.add(channel_id)
+        self._ready.put_nowait(channel_id)
+
+    def _reschedule_later(self, channel_id, delay):
+        loop = asyncio.get_event_loop()
+        loop.call_later(delay, self._ready.put_nowait, channel_id)
+
+    def prune_buckets(self, now):
+        """Drop the buckets of channels with nothing queued whose rate limit has reset; a fresh one is the same."""
+        stale = [
+            channel_id for channel_id, bucket in self.buckets.items()
+            if bucket.reset_at <= now and not self.queues.get(channel_id)
+        ]
+        for channel_id in stale:
+            del self.buckets[channel_id]
+        return len(stale)
+
+    def _channel_done(self, channel_id):
+        self._scheduled.discard(channel_id)
+        self.queues.pop(channel_id, None)
+
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._next_prune = now + PRUNE_INTERVAL
+            self.prune_buckets(now)
+
+    def _next_message(self, queue):
+        content, embed = queue.popleft()
+        if embed is not None or content is None:
+            return content, embed
+
+        lines = [content]
+        length = len(content)
+        while queue:
+            next_content, next_embed = queue[0]
+            if next_embed is not None or next_content is None:
+                break
+            if length + 1 + len(next_content) > MAX_MESSAGE_LENGTH:
+                break
+            queue.popleft()
+            lines.append(next_content)
+            length += 1 + len(next_content)
+            self.merged += 1
+
+        return '\n'.join(lines), None
+
+    async def _worker(self):
+        while True:
+            channel_id = await self._ready.get()
+            queue = self.queues.get(channel_id)
+            if not queue:
+                self._channel_done(channel_id)
+                continue
+
+            try:
+                bucket = self.buckets[channel_id]
+            except KeyError:
+                bucket = self.buckets[channel_id] = ChannelBucket()
+
+            delay = bucket.delay(time.monotonic())
+            if delay:
+                # leave this channel scheduled, but let the worker get on with everyone else in the meantime.
+                self._reschedule_later(channel_id, delay)
+                continue
+
+            content, embed = self._next_message(queue)
+            try:
+                await self.send_func(channel_id, content, embed=embed)
+            except discord.HTTPException as exc:
+                if exc.status == 429:
+                    self.rate_limited += 1
+                    queue.appendleft((content, embed))
+                    retry_after = getattr(exc, 'retry_after', None) or bucket.per
+                    bucket.rate_limited(time.monotonic(), retry_after)
+                    self._reschedule_later(channel_id, retry_after)
+                    continue
+                log.exception('%s failed to send', channel_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('%s failed to send', channel_id)
+            else:
+                self.sent += 1
+
+            if queue:
+                self._ready.put_nowait(channel_id)
+            else:
+                self._channel_done(channel_id)
@@ -0,0 +1,130 @@
+import logging
+import math
+import zlib
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+# clan tags hash into this many fixed partitions, which are what shards claim.
+# it's set well above the number of processes we'd ever run, so a rebalance only moves a few partitions at a time.
+PARTITIONS = 64
+
+# advisory lock keys, as (LOCK_NAMESPACE, key) pairs.
+LOCK_NAMESPACE = 0x5359  # 'SY'
+MEMBER_KEY = 0
+LEADER_KEY = 1
+PARTITION_KEY_OFFSET = 100
+
+LIVE_SHARDS_QUERY = """SELECT count(DISTINCT pid)
+                       FROM pg_locks
+                       WHERE locktype = 'advisory'
+                       AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+                       AND classid = $1::oid
+                       AND objid = $2::oid
+                       AND objsubid = 2
+                       AND granted
+                    """
+
+
+def partition_of(clan_tag):
+    # crc32 rather than hash(), which is salted per process.
+    return zlib.crc32(clan_tag.encode('utf-8')) % PARTITIONS
+
+
+class ClanSharding:
+    """Splits the tracked clans between several syncer processes.
+
+    Each clan tag hashes into one of :data:`PARTITIONS` partitions, and each shard claims partitions by holding a
+    session-level advisory lock on them from a dedicated connection (pool connections release advisory locks when
+    they're returned). Every shard also holds a shared "member" lock, so live shards can be counted from ``pg_locks``.
+
+    :meth:`rebalance` aims for an even split: a shard over its share releases the partitions it least prefers, and a
+    shard under it claims free ones, most preferred first. Preference is a rendezvous hash of the shard name and
+    partition, so a shard tends to get the same partitions back after a restart. When a process dies its connection
+    goes with it, its locks are freed and the other shards pick its partitions up on their next rebalance.
+
+    One shard also holds the leader lock; it alone runs the once-per-deployment jobs, like starting a new season.
+    """
+    def __init__(self, dsn, name):
+        self.dsn = dsn
+        self.name = name
+
+        self.owned = set()
+        self.is_leader = False
+        self.live_shards = 0
+        self.on_change = None
+
+        self._conn = None
+        self._preference = sorted(
+            range(PARTITIONS), key=lambda p: zlib.crc32(f'{name}:{p}'.encode('utf-8')), reverse=True
+        )
+
+        self.rebalances = 0
+
+    @property
+    def connected(self):
+        return self._conn is not None and not self._conn.is_closed()
+
+    def owns(self, clan_tag):
+        return partition_of(clan_tag) in self.owned
+
+    async def connect(self):
+        """(Re)connect if needed. A new connection holds no locks, so everything has to be claimed again."""
+        if self.connected:
+            return False
+
+        if self.owned or self.is_leader:
+            log.warning('shard %s lost its lock connection, releasing %s partitions', self.name, len(self.owned))
+            self.owned = set()
+            self.is_leader = False
+            self._changed()
+
+        self._conn = await asyncpg.connect(self.dsn)
+        await self._conn.execute("SELECT pg_advisory_lock_shared($1, $2)", LOCK_NAMESPACE, MEMBER_KEY)
+        return True
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    async def _try_lock(self, key):
+        return await self._conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", LOCK_NAMESPACE, key)
+
+    async def _unlock(self, key):
+        await self._conn.execute("SELECT pg_advisory_unlock($1, $2)", LOCK_NAMESPACE, key)
+
+    async def rebalance(self):
+        await self.connect()
+
+        if not self.is_leader:
+            self.is_leader = await self._try_lock(LEADER_KEY)
+            if self.is_leader:
+                log.info('shard %s is now the leader', self.name)
+
+        self.live_shards = live = await self._conn.fetchval(LIVE_SHARDS_QUERY, LOCK_NAMESPACE, MEMBER_KEY)
+        target = math.ceil(PARTITIONS / max(live, 1))
+
+        released, claimed = [], []
+        for partition in reversed(self._preference):
+            if len(self.owned) <= target:
+                break
+            if partition in self.owned:
+                await self._unlock(PARTITION_KEY_OFFSET + partition)
+                self.owned.discard(partition)
+                released.append(partition)
+
+        for partition in self._preference:
+            if len(self.owned) >= target:
+                break
+            if partition in self.owned:
+                continue
+            if await self._try_lock(PARTITION_KEY_OFFSET + partition):
+                self.owned.add(partition)
+                claimed.append(partition)
+
+        self.rebalances += 1
+        if released or claimed:
+            log.info('shard %s: %s live shards, released %s and claimed %s partitions, now owns %s',
+                     self.name, live, len(released), len(claimed), len(self.owned))
+            self._changed()
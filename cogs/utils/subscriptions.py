@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'clan_subscriptions'
+
+
+class ClanSubscriptions:
+    """Keeps the set of clan tags the syncer polls in memory.
+
+    A trigger on ``clans`` sends ``{"op": "add" | "remove", "clan_tag": ...}`` on the ``clan_subscriptions`` channel
+    whenever a clan is claimed (``+add clan``) or unclaimed (``+remove clan``, removing a board, deleting a channel).
+    Adds are applied straight away and the clan is fetched so it's in the coc.py cache before its first loop;
+    a remove only drops the tag if no other channel still has that clan claimed.
+
+    When a :class:`ClanSharding` is given, every tag is still tracked but only the ones this shard owns are polled.
+    When a :class:`ClanPollSchedule` is given, it's handed the tags instead and decides which are polled each loop.
+    """
+    def __init__(self, pool, listener, coc_client, shard=None, poll_schedule=None):
+        self.pool = pool
+        self.listener = listener
+        self.coc_client = coc_client
+        self.shard = shard
+        self.poll_schedule = poll_schedule
+
+        self.tags = set()
+
+    async def start(self):
+        await self.listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        await self.reload()
+
+    def publish(self):
+        # give coc.py a fresh list rather than mutating the one its clan loop may be iterating over.
+        if self.shard is None:
+            tags = list(self.tags)
+        else:
+            tags = [n for n in self.tags if self.shard.owns(n)]
+
+        if self.poll_schedule is None:
+            self.coc_client._clan_updates = tags
+        else:
+            self.poll_schedule.set_tags(tags)
+
+    async def reload(self):
+        fetch = await self.pool.fetch("SELECT DISTINCT(clan_tag) FROM clans")
+        tags = set(n[0] for n in fetch)
+
+        added, removed = tags - self.tags, self.tags - tags
+        if self.tags and (added or removed):
+            log.warning('clan subscriptions had drifted: %s missing, %s stale', len(added), len(removed))
+
+        self.tags = tags
+        self.publish()
+        log.info(f"Setting {len(tags)} tags to update")
+
+    def _on_notify(self, payload):
+        data = json.loads(payload)
+        clan_tag = data['clan_tag']
+        if not clan_tag:
+            return
+
+        if data['op'] == 'add':
+            asyncio.ensure_future(self.add(clan_tag))
+        else:
+            asyncio.ensure_future(self.remove(clan_tag))
+
+    async def add(self, clan_tag):
+        if clan_tag in self.tags:
+            return
+
+        self.tags.add(clan_tag)
+        self.publish()
+        log.info('subscribed to clan %s', clan_tag)
+
+        if self.shard is not None and not self.shard.owns(clan_tag):
+            return
+        try:
+            await self.coc_client.get_clan(clan_tag)
+        except Exception:
+            log.info('failed to warm the cache for new clan %s', clan_tag)
+
+    async def remove(self, clan_tag):
+        if clan_tag not in self.tags:
+            return
+        if await self.pool.fetchval("SELECT 1 FROM clans WHERE clan_tag = $1 LIMIT 1", clan_tag):
+            return  # still claimed in another channel
+
+        self.tags.discard(clan_tag)
+        self.publish()
+        log.info('unsubscribed from clan %s', clan_tag)
+
+    async def reconcile(self):
+        if await self.listener.connect():
+            log.info('notification listener reconnected, reloading clan subscriptions')
+        await self.reload()
@@ -1,4 +1,5 @@
 import asyncio
+import hashlib
 import io
 import itertools
 import logging
@@ -18,8 +19,13 @@ import creds
 
 from botlog import setup_logging
 
-from bot import setup_db
+from cogs.utils.db import setup_db
+from cogs.utils import metrics
+from cogs.utils.board_ranks import BoardRanks
 from cogs.utils.db_objects import BoardConfig
+from cogs.utils.images import BoardImage, BoardTiles
+from cogs.utils.legend_days import finalise_legend_day, is_finalised, legend_day_bounds
+from cogs.utils.render_pool import RendererBusy, RendererPool, cold_render
 
 
 REFRESH_EMOJI = discord.PartialEmoji(name="refresh", id=694395354841350254, animated=False)
@@ -62,15 +68,40 @@ If a board doesn't appear, please make sure you have `+add clan #clantag #dt-boa
 """
 
 GLOBAL_BOARDS_CHANNEL_ID = 663683345108172830
+# how long the legend board reset waits for the syncer to finalise the legend day before doing it itself, in seconds.
+LEGEND_FINALISE_GRACE = 120
+# values of boards.render: 1 draws the board as HTML with WebKit, 2 draws it with Pillow in-process.
+HTML_RENDERER = 1
+PILLOW_RENDERER = 2
+# how many boards keep their Pillow tiles between updates; a 50 row board's are around 12MB.
+MAX_TILED_BOARDS = 64
+# the metrics endpoint is served on localhost at this port when running standalone; in the bot process it's the bot's.
+METRICS_PORT = 9102
+
+BOARD_RENDER_SECONDS = metrics.registry.histogram(
+    'board_render_seconds', 'Time taken to render a board image.', ('type', )
+)
+BOARD_UPDATE_SECONDS = metrics.registry.histogram(
+    'board_update_seconds', 'Time taken to query and render a board, up to sending it.', ('type', )
+)
+BOARD_RENDER_CACHE = metrics.registry.counter(
+    'board_render_cache_total', 'Board updates skipped because nothing visible changed (hit), or rendered (miss).',
+    ('type', 'result')
+)
+BOARD_ROW_TILES = metrics.registry.counter(
+    'board_row_tiles_total', 'Pillow board rows re-rasterised (drawn) or pasted from the last update (reused).',
+    ('result', )
+)
 
 log = logging.getLogger(__name__)
 loop = asyncio.get_event_loop()
 
 
 class HTMLImages:
-    def __init__(self, players, title=None, image=None, sort_by=None, footer=None, offset=None, board_type='donation', fonts=None, session=None):
+    def __init__(self, players, title=None, image=None, sort_by=None, footer=None, offset=None, board_type='donation', fonts=None, session=None, renderer=None):
         self.players = players
         self.session = session
+        self.renderer = renderer
 
         self.emoji_paths = {}
 
@@ -308,7 +339,7 @@ header {
                 for i, p in enumerate(self.players, start=self.offset)
             ]
 
-    async def make(self):
+    async def build_html(self):
         s = time.perf_counter()
         await self.parse_players()
         self.add_style()
@@ -325,20 +356,36 @@ header {
             self.add_footer()
         self.end_html()
         log.debug((time.perf_counter() - s)*1000)
+        return self.html
 
+    async def prepare(self):
+        await self.build_html()
+
+    def render_key(self, message_id):
+        """A digest of the board as it'll be seen in ``message_id``; call after :meth:`build_html`.
+
+        The HTML has every visible cell already formatted (eg. last online to the minute or hour), so two boards with
+        the same key look the same, however the rows behind them changed.
+        """
+        digest = hashlib.blake2b(str(message_id).encode(), digest_size=16)
+        digest.update(self.html.encode('utf-8'))
+        return digest.hexdigest()
+
+    async def render(self):
         s = time.perf_counter()
-        proc = await asyncio.create_subprocess_shell(
-            "wkhtmltoimage - -", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
-            stdin=asyncio.subprocess.PIPE,
-        )
-        log.debug((time.perf_counter() - s)*1000)
-        s = time.perf_counter()
-        stdout, stderr = await proc.communicate(input=self.html.encode('utf-8'))
+        if self.renderer:
+            image = await self.renderer.render(self.html.encode('utf-8'))
+        else:
+            image = await cold_render(self.html.encode('utf-8'))
         log.debug((time.perf_counter() - s)*1000)
-        b = io.BytesIO(stdout)
+        b = io.BytesIO(image)
         b.seek(0)
         return b
 
+    async def make(self):
+        await self.build_html()
+        return await self.render()
+
 
 class SyncBoards:
     def __init__(self, bot, start_loop=False, pool=None, session=None):
@@ -350,12 +397,21 @@ class SyncBoards:
 
         self.last_updated_channels = {}
         self.season_meta = {}
+        # (channel_id, type): render key of the board last sent to that channel's message.
+        self.render_keys = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # (channel_id, type): BoardTiles from the board's last Pillow render, least recently used first.
+        self.board_tiles = {}
 
         self.webhooks = None
         self.session = aiohttp.ClientSession()
         self.throttler = coc.BasicThrottler(1)
+        self.renderer = RendererPool()
+        self.ranks = BoardRanks(self.pool)
 
         bot.loop.create_task(self.on_init())
+        bot.loop.create_task(self.renderer.start())
         bot.loop.create_task(self.set_season_id())
 
         self.start_loops = start_loop
@@ -406,11 +462,22 @@ class SyncBoards:
             current_tasks.append(self.bot.loop.create_task(self.run_board(config)))
 
         await asyncio.gather(*current_tasks)
+        if fetch:
+            total = self.cache_hits + self.cache_misses
+            log.info(
+                'board render cache: %s hits, %s misses (%.1f%% hit rate)',
+                self.cache_hits, self.cache_misses, self.cache_hits / (total or 1) * 100
+            )
 
     async def run_board(self, config):
         try:
             async with self.throttler:
-                await self.update_board(config)
+                # boards are flagged when their players change, so re-rank them first.
+                await self.update_board(config, rebuild_ranks=True)
+        except RendererBusy:
+            # leave it for the next loop rather than dropping the update.
+            log.warning('renderers are busy, deferring board for channel %s', config.channel_id)
+            await self.pool.execute("UPDATE boards SET need_to_update = TRUE WHERE channel_id = $1 AND type = $2", config.channel_id, config.type)
         except:
             log.exception("board error.... CHANNEL ID: %s", config.channel_id)
 
@@ -447,7 +514,18 @@ class SyncBoards:
 
         return config_per_page
 
-    async def update_board(self, config, update_global=False, divert_to=None):
+    def get_board_tiles(self, config):
+        key = (config.channel_id, config.type)
+        try:
+            tiles = self.board_tiles.pop(key)
+        except KeyError:
+            tiles = BoardTiles()
+            if len(self.board_tiles) >= MAX_TILED_BOARDS:
+                self.board_tiles.pop(next(iter(self.board_tiles)))
+        self.board_tiles[key] = tiles
+        return tiles
+
+    async def update_board(self, config, update_global=False, divert_to=None, rebuild_ranks=False):
         if config.channel_id == GLOBAL_BOARDS_CHANNEL_ID and not update_global:
             return
         if not config.message_id and not divert_to:
@@ -466,85 +544,19 @@ class SyncBoards:
         for i in range(1, config.page):
             offset += self.get_next_per_page(i, config.per_page)
 
+        legend_day = self.legend_day if config.type == 'legend' else None
+        page = (config.channel_id, season_id, config.type, config.sort_by)
+        per_page = self.get_next_per_page(config.page, config.per_page)
         if config.channel_id == GLOBAL_BOARDS_CHANNEL_ID:
-            query = f"""SELECT DISTINCT player_name,
-                                        players.clan_tag,
-                                        clans.emoji,
-                                        donations,
-                                        received,
-                                        trophies,
-                                        now() - last_updated AS "last_online",
-                                        CASE WHEN received = 0 THEN cast(donations as decimal)
-                                             ELSE cast(donations as decimal) / received
-                                        END ratio,
-                                        trophies - start_trophies AS "gain"
-                       FROM players
-                       INNER JOIN clans
-                       ON clans.clan_tag = players.clan_tag
-                       WHERE season_id = $1
-                       ORDER BY {'donations' if config.sort_by == 'donation' else config.sort_by} DESC
-                       NULLS LAST
-                       LIMIT $2
-                       OFFSET $3
-                    """
-            fetch = await self.pool.fetch(
-                query,
-                season_id,
-                self.get_next_per_page(config.page, config.per_page),
-                offset
-            )
-        elif config.type == "legend":
-            query = f"""SELECT DISTINCT players.player_name, players.clan_tag, clans.emoji, starting, gain, loss, finishing, best_trophies, legend_days.attacks, legend_days.defenses
-                        FROM legend_days 
-                        INNER JOIN players 
-                        ON players.player_tag = legend_days.player_tag
-                        INNER JOIN clans
-                        ON clans.clan_tag = players.clan_tag
-                        WHERE day = $1
-                        AND season_id = $2
-                        AND clans.channel_id = $3
-                        ORDER BY {config.sort_by} DESC
-                        NULLS LAST
-                        LIMIT $4
-                        OFFSET $5
-                    """
-            fetch = await self.pool.fetch(
-                query,
-                self.legend_day,
-                season_id,
-                config.channel_id,
-                self.get_next_per_page(config.page, config.per_page),
-                offset
-            )
-        else:
-            query = f"""SELECT DISTINCT player_name,
-                                        players.clan_tag,
-                                        clans.emoji,
-                                        donations,
-                                        received,
-                                        trophies,
-                                        now() - last_updated AS "last_online",
-                                        CASE WHEN received = 0 THEN cast(donations as decimal)
-                                             ELSE cast(donations as decimal) / received
-                                        END ratio,
-                                        trophies - start_trophies AS "gain"
-                       FROM players
-                       INNER JOIN clans
-                       ON clans.clan_tag = players.clan_tag
-                       WHERE clans.channel_id = $1
-                       AND season_id = $2
-                       ORDER BY {'donations' if config.sort_by == 'donation' else config.sort_by} DESC
-                       NULLS LAST
-                       LIMIT $3
-                       OFFSET $4
-                    """
-            fetch = await self.pool.fetch(
-                query,
-                config.channel_id,
-                season_id,
-                self.get_next_per_page(config.page, config.per_page),
-                offset
-            )
+            # nothing flags the global board when its players change, so it's re-ranked whenever it's shown.
+            rebuild_ranks = True
+        if rebuild_ranks:
+            await self.ranks.rebuild(*page, legend_day=legend_day)
+        fetch = await self.ranks.page(*page, offset + 1, per_page, legend_day=legend_day)
+        if not fetch and not rebuild_ranks:
+            # not ranked yet: a sort, season or legend day nobody's looked at since the board's players last changed.
+            await self.ranks.rebuild(*page, legend_day=legend_day)
+            fetch = await self.ranks.page(*page, offset + 1, per_page, legend_day=legend_day)
 
         if not fetch:
             return  # nothing to do/add
@@ -552,18 +564,50 @@ class SyncBoards:
         season_start, season_finish = await self.get_season_meta(season_id)
 
         s1 = time.perf_counter()
-        table = HTMLImages(
-            players=fetch,
-            title=config.title,
-            image=config.icon_url,
-            sort_by=config.sort_by,
-            footer=f"Season: {season_start} - {season_finish}.",
-            offset=offset,
-            board_type=config.type,
-            session=self.session,
-        )
-        render = await table.make()
+        if config.render == PILLOW_RENDERER:
+            table = BoardImage(
+                players=fetch,
+                title=config.title or titles.get(config.type, titles['donation']),
+                image=config.icon_url or backgrounds.get(config.type, backgrounds['donation']),
+                sort_by=config.sort_by,
+                footer=f"Season: {season_start} - {season_finish}.",
+                offset=fetch[0]['rank'],
+                board_type=config.type,
+                session=self.session,
+            )
+        else:
+            table = HTMLImages(
+                players=fetch,
+                title=config.title,
+                image=config.icon_url,
+                sort_by=config.sort_by,
+                footer=f"Season: {season_start} - {season_finish}.",
+                offset=fetch[0]['rank'],
+                board_type=config.type,
+                session=self.session,
+                renderer=self.renderer,
+            )
+        await table.prepare()
+        if not divert_to:
+            render_key = table.render_key(config.message_id)
+            if self.render_keys.get((config.channel_id, config.type)) == render_key:
+                self.cache_hits += 1
+                BOARD_RENDER_CACHE.inc(type=config.type, result='hit')
+                log.debug('board for channel %s is unchanged, skipping it', config.channel_id)
+                return
+            self.cache_misses += 1
+            BOARD_RENDER_CACHE.inc(type=config.type, result='miss')
+
+        if config.render == PILLOW_RENDERER:
+            # archived boards are a one-off 200 rows; keeping their tiles would only evict the live board's.
+            render = await table.render(tiles=None if divert_to else self.get_board_tiles(config))
+            BOARD_ROW_TILES.inc(table.rows_drawn, result='drawn')
+            BOARD_ROW_TILES.inc(table.rows_reused, result='reused')
+        else:
+            render = await table.render()
         s2 = time.perf_counter() - s1
+        BOARD_RENDER_SECONDS.observe(s2, type=config.type)
+        BOARD_UPDATE_SECONDS.observe(time.perf_counter() - start, type=config.type)
 
         perf_log = f"Perf: {(time.perf_counter() - start) * 1000}ms\n" \
                    f"Build Image Perf: {s2 * 1000}ms\n" \
@@ -594,6 +638,7 @@ class SyncBoards:
 
         try:
             await self.bot.http.edit_message(config.channel_id, config.message_id, content=None, embed=embed.to_dict())
+            self.render_keys[(config.channel_id, config.type)] = render_key
         except discord.NotFound:
             await self.set_new_message(config)
         except discord.HTTPException:
@@ -610,19 +655,27 @@ class SyncBoards:
     async def legend_board_reset(self):
         log.info('running legend trophies')
         now = datetime.utcnow()
-        if now.hour >= 5:
-            tomorrow = (now + timedelta(days=1)).replace(hour=5, minute=0, second=0, microsecond=0)
-        else:
-            tomorrow = now.replace(hour=5, minute=0, second=0, microsecond=0)
+        day, tomorrow = legend_day_bounds(now)
 
         try:
-            self.legend_day = tomorrow - timedelta(days=1)
+            self.legend_day = day
             seconds = (tomorrow - now).total_seconds()
             log.info("Legend board resetter sleeping for %s seconds", seconds)
             await asyncio.sleep(seconds)
             if not self.start_loops:
                 return
 
+            # the syncer writes its final snapshot and finalises the day as it rolls over;
+            # give it a moment so the archived boards have the finishing trophies, and only finalise here if it's gone.
+            deadline = time.monotonic() + LEGEND_FINALISE_GRACE
+            while not await is_finalised(self.pool, day) and time.monotonic() < deadline:
+                await asyncio.sleep(5)
+            try:
+                if await finalise_legend_day(self.pool, day, self.season_id):
+                    log.info('finalised legend day %s without the syncer', day)
+            except:
+                log.exception('resetting legend players trophies')
+
             fetch = await self.pool.fetch("SELECT * FROM boards WHERE toggle=True AND type='legend' AND divert_to_channel_id is not null")
             log.info("Legend board archiving for %s boards", len(fetch))
             for row in fetch:
@@ -633,24 +686,13 @@ class SyncBoards:
                     config.per_page = 200
                     config.sort_by = 'finishing'
 
-                    await self.update_board(config, divert_to=row['divert_to_channel_id'] or config.channel_id)
+                    await self.update_board(
+                        config, divert_to=row['divert_to_channel_id'] or config.channel_id, rebuild_ranks=True
+                    )
 
                 except (discord.Forbidden, discord.NotFound, discord.HTTPException):
                     continue
 
-            query = """INSERT INTO legend_days (player_tag, day, starting, gain, loss, finishing) 
-                       SELECT player_tag, $1, trophies, 0, 0, trophies
-                       FROM players
-                       WHERE season_id = $2
-                       AND league_id = 29000022
-                       ON CONFLICT (player_tag, day)
-                       DO NOTHING;
-                    """
-            try:
-                await self.pool.execute(query, tomorrow, self.season_id)
-            except:
-                log.exception('resetting legend players trophies')
-
         except:
             log.exception('resetting legend boards')
 
@@ -660,6 +702,7 @@ if __name__ == "__main__":
     stateless_bot.session = aiohttp.ClientSession()
     stateless_bot.pool = loop.run_until_complete(setup_db())
     setup_logging(stateless_bot)
+    loop.run_until_complete(metrics.start_metrics(METRICS_PORT, pool=stateless_bot.pool))
     loop.run_until_complete(stateless_bot.login(creds.bot_token))
     SyncBoards(stateless_bot, start_loop=True)
     loop.run_forever()
@@ -4,8 +4,8 @@ import logging
 import time
 import itertools
 import math
-import copy
 import io
+import sys
 
 import aiohttp
 import coc
@@ -14,21 +14,73 @@ import sentry_sdk
 
 from discord.ext import commands, tasks
 from collections import Counter
-from matplotlib import pyplot as plt
 
 import creds
 
 from botlog import setup_logging
-from bot import setup_db
+from cogs.utils.db import setup_db
 from cogs.utils.donationtrophylogs import SlimDonationEvent2, SlimTrophyEvent, get_basic_log, get_detailed_log, format_trophy_log_message, get_events_fmt
-from cogs.utils.db_objects import LogConfig
+from cogs.utils.board_writes import copy_board_update, json_board_update
+from cogs.utils.bounded_cache import BoundedCache
+from cogs.utils.charts import chart_worker, latency_chart
+from cogs.utils.event_buffer import EventBuffer
+from cogs.utils.legend_days import LEGEND_LEAGUE_ID, LegendDays, legend_day_bounds
+from cogs.utils.log_routing import LogRoutingTable
+from cogs.utils import metrics
+from cogs.utils.member_snapshots import MemberSnapshots, clan_update, data_of, NAME, EXP_LEVEL, VERSUS_TROPHIES, DONATIONS, RECEIVED, TROPHIES
+from cogs.utils.notifications import NotificationListener
+from cogs.utils.subscriptions import ClanSubscriptions
 from cogs.utils.formatters import LineWrapper
+from cogs.utils.interval_logs import IntervalLogScheduler
+from cogs.utils.pipeline import FlushPipeline
+from cogs.utils.poll_schedule import ClanPollSchedule
+from cogs.utils.season_rollover import SeasonRollover
+from cogs.utils.send_scheduler import SendScheduler
+from cogs.utils.sharding import ClanSharding
 
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 sentry_sdk.init(creds.SENTRY_KEY)
 
+# above this many changed players, stream them through a binary COPY instead of one big jsonb parameter.
+# see benchmarks/board_insert.py for where the crossover sits.
+BOARD_COPY_THRESHOLD = 1000
+# the longest a member join may wait for the next flush before being inserted on its own, in seconds.
+JOIN_MAX_LATENCY = 30
+# how many log messages may be in flight to discord at once, across all channels.
+SEND_CONCURRENCY = 20
+# run as one of several shards with `python syncer.py --shard <name>`; each shard polls its own share of clans.
+# names should be stable across restarts, since interval log checkpoints are recovered by shard name.
+SHARD_NAME = sys.argv[sys.argv.index('--shard') + 1] if '--shard' in sys.argv else None
+# how often shards check for others joining or leaving, in seconds.
+SHARD_REBALANCE_INTERVAL = 30
+# clan requests per second the adaptive poll schedule may spend; the rest of the key budget is left for player fetches.
+CLAN_POLL_BUDGET = 60
+# limits for coc.py's clan and player object caches. members are kept in MemberSnapshots rather than on the clans,
+# so a cached clan is only a few KB.
+CLAN_CACHE_SIZE = 50_000
+CLAN_CACHE_BYTES = 256 * 1024 * 1024
+PLAYER_CACHE_SIZE = 10_000
+PLAYER_CACHE_BYTES = 64 * 1024 * 1024
+# the metrics endpoint is served on localhost at this port; give each shard its own with `--metrics-port <port>`.
+METRICS_PORT = int(sys.argv[sys.argv.index('--metrics-port') + 1]) if '--metrics-port' in sys.argv else 9101
+
+FLUSH_SECONDS = metrics.registry.histogram('syncer_flush_seconds', 'Time taken to run the whole flush pipeline.')
+FLUSH_STAGE_SECONDS = metrics.registry.histogram(
+    'syncer_flush_stage_seconds', 'Time taken to run each flush stage.', ('stage', )
+)
+FLUSH_STAGE_WAIT_SECONDS = metrics.registry.histogram(
+    'syncer_flush_stage_wait_seconds', 'Time each flush stage waited for a database slot.', ('stage', )
+)
+FLUSH_STAGE_FAILURES = metrics.registry.counter(
+    'syncer_flush_stage_failures_total', 'Flush stages that raised.', ('stage', )
+)
+EVENTS = metrics.registry.counter('syncer_events_total', 'Donation and trophy events seen.', ('type', ))
+EVENTS_PER_SECOND = metrics.registry.gauge(
+    'syncer_events_per_second', 'Donation and trophy events per second over the last clan loop.'
+)
+
 
 class CustomClanMember(coc.ClanMember):
     def _from_data(self, data: dict) -> None:
@@ -43,12 +95,18 @@ class CustomClanMember(coc.ClanMember):
 
 class CustomClan(coc.Clan):
     def _from_data(self, data: dict) -> None:
-        client = self._client
-        self._members = {m['tag']: CustomClanMember(data=m, client=client) for m in data.get("memberList", [])}
+        # members are diffed straight from the raw data by Syncer.on_clan_update, which only builds
+        # CustomClanMembers for the ones that changed.
+        self._member_data = data.get("memberList", [])
+        self._members = {}
 
 
-coc_client = coc.login(creds.email, creds.password, client=coc.EventsClient, key_names="test2", throttle_limit=30, key_count=3, scopes=creds.scopes, cache_max_size=None)
+coc_client = coc.login(creds.email, creds.password, client=coc.EventsClient, key_names=f"test2-{SHARD_NAME}" if SHARD_NAME else "test2", throttle_limit=30, key_count=3, scopes=creds.scopes, cache_max_size=None)
 coc_client.clan_cls = CustomClan
+# cache_max_size=None above turns off coc.py's HTTP response cache (the per-clan locks already wait out max-age);
+# the objects it keeps for diffing are what grow, so those get bounded caches instead.
+coc_client._clans = BoundedCache(CLAN_CACHE_SIZE, CLAN_CACHE_BYTES)
+coc_client._players = BoundedCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_BYTES)
 bot = commands.Bot(command_prefix="+")
 bot.session = aiohttp.ClientSession()
 pool = asyncio.get_event_loop().run_until_complete(setup_db())
@@ -62,27 +120,63 @@ class Syncer:
         self.season_id = None
         loop.create_task(self.get_season_id())
 
-        self.board_batch_lock = asyncio.Lock(loop=loop)
-        self.board_batch_data = {}
-
-        self.donationlog_batch_lock = asyncio.Lock(loop=loop)
-        self.donationlog_batch_data = []
-
-        self.trophylog_batch_lock = asyncio.Lock(loop=loop)
-        self.trophylog_batch_data = []
+        # all event handlers record into `events`; each flush swaps it out and works from `drained_events`.
+        self.events = EventBuffer()
+        self.drained_events = EventBuffer()
+        self.flush_lock = asyncio.Lock(loop=loop)
 
-        self.last_updated_batch_lock = asyncio.Lock(loop=loop)
         self.last_updated_tags = set()
         self.last_updated_counter = Counter()
 
-        self.legend_data_lock = asyncio.Lock(loop=loop)
-        self.legend_data = {}
         self.legend_counter = Counter()
-        self.legend_day = None
+        self.legend = LegendDays(pool)
+        self.rollover = SeasonRollover(pool)
 
-        self.boards_counter = Counter()
+        self.pending_joins = {}
+        self.pending_leaves = {}
+        self._join_flush_handle = None
+
+        self.sender = SendScheduler(self.safe_send, max_concurrency=SEND_CONCURRENCY)
 
-        self._log_tasks = {}
+        self.listener = NotificationListener(creds.postgres)
+        self.log_routes = LogRoutingTable(pool, self.listener)
+        self.shard = ClanSharding(creds.postgres, SHARD_NAME) if SHARD_NAME else None
+        self.poll_schedule = ClanPollSchedule(pool, coc_client, CLAN_POLL_BUDGET)
+        self.subscriptions = ClanSubscriptions(
+            pool, self.listener, coc_client, shard=self.shard, poll_schedule=self.poll_schedule
+        )
+        if self.shard:
+            self.shard.on_change = self.subscriptions.publish
+
+        self.boards_counter = Counter()
+        self.member_snapshots = MemberSnapshots()
+        self.poll_schedule.on_remove = self.forget_clans
+
+        self.interval_logs = IntervalLogScheduler(pool, self.log_routes, self.send_interval_log, shard_name=SHARD_NAME)
+
+        self.flush_pipeline = pipeline = FlushPipeline(max_concurrency=pool._maxsize)
+        # the log stages only wait on the coc API and the send queue, so they don't take a database slot.
+        pipeline.add_stage('donationlog', self.send_donationlog_events, uses_db=False)
+        pipeline.add_stage('trophylog', self.send_trophylog_events, uses_db=False)
+        pipeline.add_stage('board_insert', self.bulk_board_insert)
+        # both of these write to the same rows in players, so let the bulk upsert land first.
+        pipeline.add_stage('flag_boards', self.flag_boards, depends_on=('board_insert', ))
+        pipeline.add_stage('last_online', self.update_last_online, depends_on=('board_insert', ))
+        pipeline.add_stage('legend_data', self.legend.snapshot)
+        pipeline.add_stage('member_joins', self.flush_member_joins)
+        # a join flushed after a leave would put the player back in the clan they've just left.
+        pipeline.add_stage('member_leaves', self.flush_member_leaves, depends_on=('member_joins', ))
+        self._last_flush = time.monotonic()
+
+        gauge = metrics.registry.gauge
+        gauge('syncer_send_queue_depth', 'Log messages queued to send.', func=lambda: self.sender.pending)
+        gauge('syncer_event_buffer_players', 'Players with events recorded since the last flush.',
+              func=lambda: len(self.events))
+        gauge('syncer_pending_member_changes', 'Member joins and leaves waiting to be written.', ('kind', ),
+              func=lambda: ((('join', ), len(self.pending_joins)), (('leave', ), len(self.pending_leaves))))
+        gauge('syncer_polled_clans', 'Clans polled in the current clan loop.', func=lambda: len(self.poll_schedule.polling))
+        gauge('syncer_cache_entries', 'Entries in the coc.py object caches.', ('cache', ),
+              func=lambda: ((('clans', ), len(coc_client._clans)), (('players', ), len(coc_client._players))))
 
     async def get_season_id(self):
         fetch = await pool.fetchrow("SELECT id FROM seasons WHERE start < now() ORDER BY start DESC;")
@@ -91,26 +185,36 @@ class Syncer:
     def start(self):
         self.loop = loop = asyncio.get_event_loop()
         loop.create_task(self.fetch_webhooks())
+        self.set_legend_trophies.add_exception_type(Exception)
         self.set_legend_trophies.start()
+        self.sender.start()
+
+        loop.run_until_complete(metrics.start_metrics(METRICS_PORT, pool=pool, coc_client=coc_client))
+        loop.run_until_complete(self.log_routes.start())
+        if self.shard:
+            loop.run_until_complete(self.shard.rebalance())
+            self.rebalance_shards.add_exception_type(Exception)
+            self.rebalance_shards.start()
+        loop.run_until_complete(self.subscriptions.start())
+        loop.create_task(self.resume_rollovers())
+        self.poll_schedule.next_loop()
+        for task in (self.reconcile_log_routes, self.reconcile_subscriptions, self.refresh_activity_profiles,
+                     self.report_cache_stats):
+            task.add_exception_type(Exception)
+            task.start()
 
         print("STARTING")
 
         listeners = (
             self.season_start,
-            self.on_clan_member_donation,
-            self.on_clan_member_received,
-            self.on_clan_member_trophies_change,
-            self.on_member_update,
-            self.on_clan_member_join,
-            self.on_clan_member_leave,
+            self.on_clan_update,
             self.maintenance_start,
             self.maintenance_completed,
             self.dispatch_callbacks,
         )
         coc_client.add_events(*listeners)
 
-        self.sync_temp_event_tasks.add_exception_type(Exception, BaseException)
-        self.sync_temp_event_tasks.start()
+        self.interval_logs.start()
 
         coc_client.run_forever()
 
@@ -122,62 +226,38 @@ class Syncer:
     # @coc_client.event
     @coc.ClientEvents.new_season_start()
     async def season_start(self):
+        if self.shard and not self.shard.is_leader:
+            # the leader creates the season and copies players over; just wait for the new season to appear.
+            season_id = self.season_id
+            while self.season_id == season_id:
+                await asyncio.sleep(10)
+                await self.get_season_id()
+            await self.rollover.follow(self.season_id, is_leader=lambda: self.shard.is_leader)
+            return
+
         await self.safe_send(594286547449282587, "New season has started!")
 
-        fetch = await pool.fetchrow(
-            "INSERT INTO seasons (start, finish) VALUES ($1, $2) RETURNING id",
-            coc.utils.get_season_start(),
-            coc.utils.get_season_end()
-        )
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                fetch = await conn.fetchrow(
+                    "INSERT INTO seasons (start, finish) VALUES ($1, $2) RETURNING id",
+                    coc.utils.get_season_start(),
+                    coc.utils.get_season_end()
+                )
+                await self.rollover.start(conn, fetch['id'], fetch['id'] - 1)
 
         self.season_id = fetch['id']
-
-        query = """INSERT INTO players (
-                            player_tag,
-                            donations,
-                            received,
-                            user_id,
-                            season_id,
-                            player_name,
-                            start_trophies,
-                            trophies,
-                            clan_tag,
-                            league_id,
-                            legend_trophies
-                            )
-                    SELECT player_tag,
-                           0,
-                           0,
-                           user_id,
-                           season_id + 1,
-                           player_name,
-                           LEAST(trophies, 5000),
-                           LEAST(trophies, 5000),
-                           league_id,
-                           CASE WHEN league_id = 29000022 AND trophies > 5000 THEN legend_trophies + trophies - 5000 ELSE legend_trophies END
-                    FROM players
-                    WHERE season_id = $1
-                """
-        await pool.execute(query, self.season_id - 1)
+        # events keep being written to the new season while this runs; see bulk_board_insert.
+        await self.rollover.run(self.season_id, self.season_id - 1)
 
         await self.safe_send(594286547449282587, "Syncer has added players :ok_hand:")
 
-    async def add_temp_events(self, log_type, channel_id, fmt):
-        query = """INSERT INTO tempevents (channel_id, fmt, type) VALUES ($1, $2, $3)"""
-        await pool.execute(query, channel_id, fmt, log_type)
-        log.debug(f'Added a message for channel id {channel_id} to tempevents db')
-
-    async def add_detailed_temp_events(self, channel_id, clan_tag, events):
-        query = "INSERT INTO detailedtempevents (channel_id, clan_tag, exact, combo, unknown) VALUES ($1, $2, $3, $4, $5)"
-        await pool.execute(
-            query,
-            channel_id,
-            clan_tag,
-            "\n".join(events["exact"]),
-            "\n".join(events["combo"]),
-            "\n".join(events["unknown"])
-        )
-        log.debug(f'Added detailed temp events for channel id {channel_id} clan tag {clan_tag} to detailedtempevents db\n{events}')
+    async def resume_rollovers(self):
+        for row in await self.rollover.pending():
+            if self.shard and not self.shard.is_leader:
+                await self.rollover.follow(row['season_id'], is_leader=lambda: self.shard.is_leader)
+            else:
+                await self.rollover.run(row['season_id'], row['from_season_id'])
 
     async def safe_send(self, channel_id, content=None, embed=None):
         if content and len(content) > 2000:
@@ -189,6 +269,10 @@ class Syncer:
         except (discord.Forbidden, discord.NotFound):
             await pool.execute("UPDATE logs SET toggle = FALSE WHERE channel_id = $1", channel_id)
             return
+        except discord.HTTPException as exc:
+            if exc.status == 429:
+                raise  # let the send scheduler back off this channel
+            log.exception(f"{channel_id} failed to send {content} {embed}")
         except:
             log.exception(f"{channel_id} failed to send {content} {embed}")
 
@@ -196,69 +280,46 @@ class Syncer:
     async def set_legend_trophies(self):
         log.info('running legend trophies')
         now = datetime.datetime.utcnow()
-        if now.hour >= 5:
-            tomorrow = (now + datetime.timedelta(days=1)).replace(hour=5, minute=0, second=0, microsecond=0)
-        else:
-            tomorrow = now.replace(hour=5, minute=0, second=0, microsecond=0)
+        today, tomorrow = legend_day_bounds(now)
+        if self.legend.day != today:
+            await self.legend.start_day(today)
 
-        self.legend_day = (tomorrow - datetime.timedelta(days=1)).isoformat()
         await asyncio.sleep((tomorrow - now).total_seconds())
+        await self.legend.finish_day(self.season_id)
 
     # @coc_client.event
     @coc.ClientEvents.clan_loop_finish()
     async def dispatch_callbacks(self, *args, **kwargs):
-        try:
-            s = time.perf_counter()
-            await self.send_donationlog_events()
-        except:
-            log.exception('sending donationlog events')
-        else:
-            log.info('ran donationlog events, at perf: %sms', (time.perf_counter() - s)*1000)
-
-        try:
-            s = time.perf_counter()
-            await self.send_trophylog_events()
-        except:
-            log.exception('sending trophylog events')
-        else:
-            log.info('ran trophylog events, at perf: %sms', (time.perf_counter() - s)*1000)
-
-        try:
-            async with self.board_batch_lock:
-                s = time.perf_counter()
-                await self.bulk_board_insert()
-        except:
-            log.exception('bulk insert into db')
-        else:
-            log.info('ran insert board data, at perf: %sms', (time.perf_counter() - s)*1000)
-
-        try:
-            async with self.last_updated_batch_lock:
-                s = time.perf_counter()
-                await self.update_last_online()
-        except:
-            log.exception('last online into db')
-        else:
-            log.info('ran insert last online, at perf: %sms', (time.perf_counter() - s)*1000)
-
-        try:
-            async with self.legend_data_lock:
-                s = time.perf_counter()
-                await self.insert_legend_data()
-        except:
-            log.exception('insert legend data into db')
-        else:
-            log.info('ran insert legend data, at perf: %sms', (time.perf_counter() - s)*1000)
-
-        try:
-            s = time.perf_counter()
-            fetch = await pool.fetch("SELECT DISTINCT(clan_tag) FROM clans")
-            log.info(f"Setting {len(fetch)} tags to update")
-            coc_client._clan_updates = [n[0] for n in fetch]
-        except:
-            log.exception("setting clan tags failed")
-        else:
-            log.info('ran set clan tags, at perf: %sms', (time.perf_counter() - s)*1000)
+        # only the swap needs to be atomic; the lock just stops a slow flush overlapping the next loop's.
+        async with self.flush_lock:
+            self.drained_events = self.events.swap()
+            # pick the next loop's clans before flushing, so they're ready when coc.py wakes up.
+            self.poll_schedule.record(self.drained_events.clan_event_counts())
+            self.poll_schedule.next_loop()
+            timings = await self.flush_pipeline.run()
+
+        self.record_flush_metrics(timings)
+        bot.google_logger.log_struct(dict(type='flush_pipeline', **self.flush_pipeline.to_struct(timings)))
+
+    @staticmethod
+    def record_stage_metrics(timings):
+        for timing in timings:
+            FLUSH_STAGE_SECONDS.observe(timing.elapsed / 1000, stage=timing.name)
+            FLUSH_STAGE_WAIT_SECONDS.observe(timing.waited / 1000, stage=timing.name)
+            if not timing.success:
+                FLUSH_STAGE_FAILURES.inc(stage=timing.name)
+
+    def record_flush_metrics(self, timings):
+        self.record_stage_metrics(timings)
+        FLUSH_SECONDS.observe(self.flush_pipeline.to_struct(timings)['total'] / 1000)
+
+        donations, trophies = len(self.drained_events.don_slot), len(self.drained_events.trophy_slot)
+        EVENTS.inc(donations, type='donation')
+        EVENTS.inc(trophies, type='trophy')
+
+        now = time.monotonic()
+        EVENTS_PER_SECOND.set((donations + trophies) / max(now - self._last_flush, 1))
+        self._last_flush = now
 
     async def update_last_online(self):
         query = """UPDATE players 
@@ -279,44 +340,33 @@ class Syncer:
                    ON CONFLICT (player_tag, clan_tag, hour_time)
                    DO UPDATE SET counter = activity_query.counter + excluded.counter
                    """
-        # async with self.last_updated_batch_lock:
-        await pool.execute(query, list(self.last_updated_tags), self.season_id)
-        nice = [{"player_tag": player_tag, "clan_tag": clan_tag, "counter": counter} for
-                ((player_tag, clan_tag), counter) in self.last_updated_counter.most_common()]
-        await pool.execute(query2, nice)
-        self.last_updated_tags.clear()
-        self.last_updated_counter.clear()
+        tags, self.last_updated_tags = self.last_updated_tags, set()
+        counter, self.last_updated_counter = self.last_updated_counter, Counter()
+        try:
+            await pool.execute(query, list(tags), self.season_id)
+            nice = [{"player_tag": player_tag, "clan_tag": clan_tag, "counter": counter} for
+                    ((player_tag, clan_tag), counter) in counter.most_common()]
+            await pool.execute(query2, nice)
+        except:
+            self.last_updated_tags |= tags
+            self.last_updated_counter.update(counter)
+            raise
 
     async def send_trophylog_events(self):
-        query = """SELECT logs.channel_id, 
-                          clans.clan_tag,
-                          logs.guild_id, 
-                          "interval", 
-                          toggle,
-                          type,
-                          detailed 
-                   FROM logs 
-                   INNER JOIN clans 
-                   ON logs.channel_id = clans.channel_id 
-                   WHERE clan_tag = ANY($1::TEXT[]) 
-                   AND logs.toggle = TRUE
-                   AND logs.type = 'trophy'
-                """
-        data = copy.copy(self.trophylog_batch_data)
-        self.trophylog_batch_data.clear()
-        clan_tags = list(set(n['clan_tag'] for n in data))
-        fetch = await pool.fetch(query, clan_tags)
+        data = list(self.drained_events.trophy_events())
+        if not data:
+            return
 
-        clan_tag_to_channel_data = {r['clan_tag']: LogConfig(bot=None, record=r) for r in fetch}
         events = [
             SlimTrophyEvent(
-                n['trophy_change'],
-                n['league_id'],
-                n['player_name'],
-                n['clan_tag'],
-                n['clan_name'],
-                clan_tag_to_channel_data.get(n['clan_tag'])
-            ) for n in data if clan_tag_to_channel_data.get(n['clan_tag'])
+                trophy_change,
+                league_id,
+                player_name,
+                clan_tag,
+                clan_name,
+                log_config
+            ) for (player_tag, player_name, clan_tag, clan_name, trophy_change, league_id, _) in data
+            for log_config in self.log_routes.get(clan_tag, 'trophy')
         ]
         events.sort(key=lambda n: n.log_config.channel_id)
 
@@ -331,52 +381,29 @@ class Syncer:
 
             for x in group_batch:
                 if config.seconds > 0:
-                    await self.add_temp_events('trophy', config.channel_id, '\n'.join(x))
+                    self.interval_logs.buffer.add(config.channel_id, 'trophy', '\n'.join(x))
                 else:
                     log.debug(f'Dispatching a log to channel '
                               f'(ID {config.channel_id} type={config.type})')
 
-                    await self.safe_send(config.channel_id, '\n'.join(x))
+                    self.sender.send(config.channel_id, '\n'.join(x))
 
     async def send_donationlog_events(self):
-        query = """SELECT logs.channel_id, 
-                          clans.clan_tag,
-                          logs.guild_id, 
-                          "interval", 
-                          toggle,
-                          type,
-                          detailed 
-                   FROM logs 
-                   INNER JOIN clans 
-                   ON logs.channel_id = clans.channel_id 
-                   WHERE clan_tag = ANY($1::TEXT[]) 
-                   AND logs.toggle = TRUE
-                   AND logs.type = 'donation'
-                """
-        clan_tags = list(set(n['clan_tag'] for n in self.donationlog_batch_data))
-        log.debug(f"clan tags: {clan_tags}")
-        fetch = await pool.fetch(query, clan_tags)
-
-        clan_tag_to_channel_data = {}
-        for row in fetch:
-            try:
-                clan_tag_to_channel_data[row['clan_tag']].append(LogConfig(bot=None, record=row))
-            except KeyError:
-                clan_tag_to_channel_data[row['clan_tag']] = [LogConfig(bot=None, record=row)]
+        data = list(self.drained_events.donation_events())
+        if not data:
+            return
 
         events = []
-        data = copy.copy(self.donationlog_batch_data)
-        self.donationlog_batch_data.clear()
-        for event in data:
-            for log_config in clan_tag_to_channel_data.get(event['clan_tag'], []):
+        for (player_tag, player_name, clan_tag, clan_name, donations, received, _) in data:
+            for log_config in self.log_routes.get(clan_tag, 'donation'):
                 events.append(
                     SlimDonationEvent2(
-                        event['donations'],
-                        event['received'],
-                        event['player_name'],
-                        event['player_tag'],
-                        event['clan_tag'],
-                        event['clan_name'],
+                        donations,
+                        received,
+                        player_name,
+                        player_tag,
+                        clan_tag,
+                        clan_name,
                         log_config
                     )
                 )
@@ -395,25 +422,25 @@ class Syncer:
                     # [(clan_tag, {"exact": [str], "combo": [str], "unknown": [str]})] form.
 
                     for clan_tag, items in responses:
-                        await self.add_detailed_temp_events(channel_id, clan_tag, items)
+                        self.interval_logs.buffer.add_detailed(channel_id, clan_tag, items)
                     continue
 
                 embeds = await get_detailed_log(coc_client, events)
                 for x in embeds:
                     log.debug(f'Dispatching a log to channel (ID {channel_id}), {x}')
 
-                    await self.safe_send(channel_id, embed=x)
+                    self.sender.send(channel_id, embed=x)
 
             else:
                 messages = await get_basic_log(events)
                 if config.seconds > 0 and channel_id:
                     for n in messages:
-                        await self.add_temp_events('donation', channel_id, "\n".join(n))
+                        self.interval_logs.buffer.add(channel_id, 'donation', "\n".join(n))
                     continue
 
                 for x in messages:
                     log.debug(f'Dispatching a detailed log to channel (ID {config.channel_id}), {x}')
-                    await self.safe_send(channel_id, '\n'.join(x))
+                    self.sender.send(channel_id, '\n'.join(x))
 
     # @tasks.loop(seconds=60.0)
     # async def board_insert_loop(self):
@@ -421,53 +448,7 @@ class Syncer:
     #     async with self.board_batch_lock:
     #         await self.bulk_board_insert()
 
-    async def insert_legend_data(self):
-        query = """INSERT INTO legend_days (player_tag, day, starting, gain, loss, finishing, attacks, defenses) 
-                   SELECT x.player_tag, x.today, x.starting, x.gain, x.loss, x.finishing, x.attacks, x.defenses
-                   FROM jsonb_to_recordset($1::jsonb)
-                   AS x(
-                       player_tag TEXT,
-                       today timestamp,
-                       starting integer,
-                       gain integer,
-                       loss integer,
-                       finishing integer,
-                       attacks integer,
-                       defenses integer                 
-                   )   
-                   ON CONFLICT (player_tag, day)
-                   DO UPDATE SET gain = legend_days.gain + excluded.gain, loss = legend_days.loss + excluded.loss, finishing = excluded.finishing, attacks = legend_days.attacks + excluded.attacks, defenses = legend_days.defenses + excluded.defenses
-                """
-        await pool.execute(query, list(self.legend_data.values()))
-        self.legend_data.clear()
-
     async def bulk_board_insert(self):
-        query = """UPDATE players SET donations = public.get_don_rec_max(x.old_dons, x.new_dons, COALESCE(players.donations, 0)), 
-                                      received  = public.get_don_rec_max(x.old_rec, x.new_rec, COALESCE(players.received, 0)), 
-                                      trophies  = x.trophies,
-                                      league_id = x.league_id,
-                                      clan_tag  = x.clan_tag,
-                                      player_name = x.player_name,
-                                      best_trophies = public.get_best_trophies(x.trophies, players.best_trophies)
-                        FROM(
-                            SELECT x.player_tag, x.old_dons, x.new_dons, x.old_rec, x.new_rec, x.trophies, x.league_id, x.clan_tag, x.player_name
-                                FROM jsonb_to_recordset($1::jsonb)
-                            AS x(player_tag TEXT, 
-                                 old_dons INTEGER, 
-                                 new_dons INTEGER,
-                                 old_rec INTEGER, 
-                                 new_rec INTEGER,
-                                 trophies INTEGER,
-                                 league_id INTEGER,
-                                 clan_tag TEXT,
-                                 player_name TEXT
-                                 )
-                            )
-                    AS x
-                    WHERE players.player_tag = x.player_tag
-                    AND players.season_id=$2
-                """
-
         # query2 = """UPDATE eventplayers SET donations = public.get_don_rec_max(x.old_dons, x.new_dons, eventplayers.donations),
         #                                     received  = public.get_don_rec_max(x.old_rec, x.new_rec, eventplayers.received),
         #                                     trophies  = x.trophies
@@ -487,17 +468,6 @@ class Syncer:
         #             WHERE eventplayers.player_tag = x.player_tag
         #             AND eventplayers.live = true
         #         """
-        query3 = """UPDATE boards 
-                    SET need_to_update = TRUE 
-                    FROM(
-                        SELECT channel_id 
-                        FROM clans 
-                        WHERE clan_tag = ANY($1::TEXT[])
-                    ) 
-                    AS x 
-                    WHERE boards.channel_id = x.channel_id
-                    AND boards.type = ANY($2::TEXT[])
-                """
         trans_query = """UPDATE players 
                          SET donations = public.get_don_rec_max($1, $2, COALESCE(players.donations, 0)), 
                              received  = public.get_don_rec_max($3, $4, COALESCE(players.received, 0)), 
@@ -507,48 +477,101 @@ class Syncer:
                          WHERE player_tag = $8
                          AND season_id = $9
                       """
+        records = self.drained_events.board_records()
+        if not records:
+            log.debug('no new board stuff')
+            return
+
+        # season_id = self.season_id
+        # log.info('before pool')
+        # async with pool.acquire() as conn:
+        #     log.info('connection acquire is %s', conn)
+        #     async with conn.transaction():
+        #         log.info('we"re in the transaction')
+        #
+        #         for tag, player_dict in self.board_batch_data.items():
+        #             log.info('running for %s, %s', tag, player_dict)
+        #             start = time.perf_counter()
+        #             r = await conn.execute(trans_query, *player_dict.values(), tag, season_id)
+        #             log.info('players update db request returned %s in %s ms', r, (time.perf_counter() - start)*1000)
+        #         print('done out of transaction')
         try:
-            if self.board_batch_data:
-                # season_id = self.season_id
-                # log.info('before pool')
-                # async with pool.acquire() as conn:
-                #     log.info('connection acquire is %s', conn)
-                #     async with conn.transaction():
-                #         log.info('we"re in the transaction')
-                #
-                #         for tag, player_dict in self.board_batch_data.items():
-                #             log.info('running for %s, %s', tag, player_dict)
-                #             start = time.perf_counter()
-                #             r = await conn.execute(trans_query, *player_dict.values(), tag, season_id)
-                #             log.info('players update db request returned %s in %s ms', r, (time.perf_counter() - start)*1000)
-                #         print('done out of transaction')
-                t = time.perf_counter()
-                response = await pool.execute(query, list(self.board_batch_data.values()), self.season_id)
-                log.info(f'Registered donations/received to the database. Resp: {response} Timing: {(time.perf_counter() - t)*1000}ms.')
-
-                # response = await pool.execute(query2, list(self.board_batch_data.values()))
-                # log.info(f'Registered donations/received to the events database. Status Code {response}.')
-                async with self.last_updated_batch_lock:
-                    tags = set(tag for (tag, counter) in self.boards_counter.items() if counter > 10)
-                    response = await pool.execute(query3, list(tags), ['donation', 'trophy'])
-                    for k in tags:
-                        self.boards_counter.pop(k, None)
-
-                async with self.legend_data_lock:
-                    tags = set(tag for (tag, counter) in self.legend_counter.items() if counter > 3)
-                    response2 = await pool.execute(query3, list(tags), ['legend'])
-                    for k in tags:
-                        self.legend_counter.pop(k, None)
-
-                log.info(f"updating boards for {response} channels")
-                self.board_batch_data.clear()
+            # while the season's being rolled over, make sure these players have rows to update.
+            await self.rollover.copy_players(self.season_id, (r[0] for r in records))
+            if len(records) >= BOARD_COPY_THRESHOLD:
+                async with pool.acquire() as conn:
+                    response = await copy_board_update(conn, records, self.season_id)
             else:
-                log.info('no new board stuff')
+                response = await json_board_update(pool, records, self.season_id)
         except:
-            log.exception('failed')
+            self.events.restore(self.drained_events)
+            raise
+        log.debug(f'Registered donations/received to the database. Resp: {response}')
+
+        # response = await pool.execute(query2, list(self.board_batch_data.values()))
+        # log.info(f'Registered donations/received to the events database. Status Code {response}.')
+
+    async def flag_boards(self):
+        query = """UPDATE boards 
+                    SET need_to_update = TRUE 
+                    FROM(
+                        SELECT channel_id 
+                        FROM clans 
+                        WHERE clan_tag = ANY($1::TEXT[])
+                    ) 
+                    AS x 
+                    WHERE boards.channel_id = x.channel_id
+                    AND boards.type = ANY($2::TEXT[])
+                """
+        tags = set(tag for (tag, counter) in self.boards_counter.items() if counter > 10)
+        for k in tags:
+            self.boards_counter.pop(k, None)
+
+        if tags:
+            await pool.execute(query, list(tags), ['donation', 'trophy'])
+
+        tags = set(tag for (tag, counter) in self.legend_counter.items() if counter > 3)
+        for k in tags:
+            self.legend_counter.pop(k, None)
+
+        if tags:
+            await pool.execute(query, list(tags), ['legend'])
+
+    @clan_update()
+    async def on_clan_update(self, cached_clan, clan):
+        diff = self.member_snapshots.diff(clan.tag, clan._member_data)
+        clan._member_data = None  # don't keep the raw data around in coc.py's clan cache
+        if diff is None:
+            return
+
+        changed = [
+            (old, new, CustomClanMember(data=data_of(tag, old), client=coc_client, clan=cached_clan),
+             CustomClanMember(data=data, client=coc_client, clan=clan))
+            for tag, old, new, data in diff.changed
+        ]
+
+        # same order, and the same number of calls, as the member_x events these replace.
+        for old, new, old_player, player in changed:
+            if old[DONATIONS] != new[DONATIONS]:
+                await self.on_clan_member_donation(old_player, player)
+        for old, new, old_player, player in changed:
+            if old[RECEIVED] != new[RECEIVED]:
+                await self.on_clan_member_received(old_player, player)
+        for old, new, old_player, player in changed:
+            if old[TROPHIES] != new[TROPHIES]:
+                await self.on_clan_member_trophies_change(old_player, player)
+        for old, new, old_player, player in changed:
+            for field in (NAME, DONATIONS, VERSUS_TROPHIES, EXP_LEVEL, DONATIONS, RECEIVED):
+                if old[field] != new[field]:
+                    await self.on_member_update(old_player, player)
+
+        for data in diff.joined:
+            await self.on_clan_member_join(CustomClanMember(data=data, client=coc_client, clan=clan), clan)
+        for tag, old in diff.left:
+            await self.on_clan_member_leave(
+                CustomClanMember(data=data_of(tag, old), client=coc_client, clan=cached_clan), clan
+            )
 
-    # @coc_client.event
-    @coc.ClanEvents.member_donations()
     async def on_clan_member_donation(self, old_player: CustomClanMember, player: CustomClanMember):
         log.debug(f'Received on_clan_member_donation event for player {player} of clan {player.clan}')
         if old_player.donations > player.donations:
@@ -556,38 +579,9 @@ class Syncer:
         else:
             donations = player.donations - old_player.donations
 
-        async with self.donationlog_batch_lock:
-            self.donationlog_batch_data.append({
-                'player_tag': player.tag,
-                'player_name': player.name,
-                'clan_tag': player.clan and player.clan.tag,
-                'clan_name': player.clan and player.clan.name,
-                'donations': donations,
-                'received': 0,
-                'time': datetime.datetime.utcnow().isoformat(),
-                'season_id': self.season_id,
-            })
-
-        async with self.board_batch_lock:
-            try:
-                self.board_batch_data[player.tag]['old_dons'] = old_player.donations
-                self.board_batch_data[player.tag]['new_dons'] = player.donations
-            except KeyError:
-                self.board_batch_data[player.tag] = {
-                    'old_dons': old_player.donations,
-                    'new_dons': player.donations,
-                    'old_rec': player.received,
-                    'new_rec': player.received,
-                    'trophies': player.trophies,
-                    'league_id': player.league_id,
-                    'clan_tag': player.clan and player.clan.tag,
-                    'player_name': player.name,
-                    'player_tag': player.tag,
-                }
+        self.events.add_donation(old_player, player, donations)
         # await update(player.tag, player.clan and player.clan.tag)
 
-    # @coc_client.event
-    @coc.ClanEvents.member_received()
     async def on_clan_member_received(self, old_player, player):
         old_received = old_player.received
         new_received = player.received
@@ -598,98 +592,23 @@ class Syncer:
         else:
             received = new_received - old_received
 
-        async with self.donationlog_batch_lock:
-            self.donationlog_batch_data.append({
-                'player_tag': player.tag,
-                'player_name': player.name,
-                'clan_tag': player.clan and player.clan.tag,
-                'clan_name': player.clan and player.clan.name,
-                'donations': 0,
-                'received': received,
-                'time': datetime.datetime.utcnow().isoformat(),
-                'season_id': self.season_id,
-            })
-
-        async with self.board_batch_lock:
-            try:
-                self.board_batch_data[player.tag]['old_rec'] = old_received
-                self.board_batch_data[player.tag]['new_rec'] = new_received
-            except KeyError:
-                self.board_batch_data[player.tag] = {
-                    'old_dons': player.donations,
-                    'new_dons': player.donations,
-                    'old_rec': old_received,
-                    'new_rec': new_received,
-                    'trophies': player.trophies,
-                    'league_id': player.league_id,
-                    'clan_tag': player.clan and player.clan.tag,
-                    'player_name': player.name,
-                    'player_tag': player.tag,
-                }
+        self.events.add_received(old_player, player, received)
 
         # await update(player.tag, player.clan and player.clan.tag)
 
-    # @coc_client.event
-    @coc.ClanEvents.member_trophies()
     async def on_clan_member_trophies_change(self, old_player, player):
         old_trophies = old_player.trophies
         new_trophies = player.trophies
         log.debug(f'Received on_clan_member_trophy_change event for player {player} of clan {player.clan}')
-        change = player.trophies - old_player.trophies
-
-        async with self.trophylog_batch_lock:
-            self.trophylog_batch_data.append({
-                'player_tag': player.tag,
-                'player_name': player.name,
-                'clan_tag': player.clan and player.clan.tag,
-                'trophy_change': change,
-                'league_id': player.league_id,
-                'time': datetime.datetime.utcnow().isoformat(),
-                'season_id': self.season_id,
-                'clan_name': player.clan and player.clan.name
-            })
-
-        async with self.board_batch_lock:
-            try:
-                self.board_batch_data[player.tag]['trophies'] = new_trophies
-            except KeyError:
-                self.board_batch_data[player.tag] = {
-                    'player_tag': player.tag,
-                    'old_dons': player.donations,
-                    'new_dons': player.donations,
-                    'old_rec': player.received,
-                    'new_rec': player.received,
-                    'trophies': new_trophies,
-                    'league_id': player.league_id,
-                    'clan_tag': player.clan and player.clan.tag,
-                    'player_name': player.name
-                }
-
-        if player.league_id == 29000022:
-            async with self.legend_data_lock:
-                try:
-                    if change > 0:
-                        self.legend_data[player.tag]['gain'] += change
-                        self.legend_data[player.tag]['attacks'] += 1
-                    else:
-                        self.legend_data[player.tag]['loss'] += change
-                        self.legend_data[player.tag]['defenses'] += 1
-                except KeyError:
-                    self.legend_data[player.tag] = {
-                        'player_tag': player.tag,
-                        'today': self.legend_day,
-                        'starting': player.trophies,
-                        'gain': change if change > 0 else 0,
-                        'loss': change if change < 0 else 0,
-                        'finishing': player.trophies,
-                        'attacks': 1 if change > 0 else 0,
-                        'defenses': 1 if change < 0 else 0,
-                    }
+        self.events.add_trophies(old_player, player)
 
+        if player.league_id == LEGEND_LEAGUE_ID:
+            self.legend.record(player.tag, old_trophies, new_trophies)
+            if player.clan:
                 self.legend_counter[player.clan.tag] += 1
 
         if new_trophies > old_trophies:
-            await self.update(player.tag, player.clan and player.clan.tag)
+            self.update(player.tag, player.clan and player.clan.tag)
 
     @tasks.loop(hours=1)
     async def event_player_updater(self):
@@ -780,156 +699,118 @@ class Syncer:
     #     except:
     #         log.exception("last updated loop")
 
-    async def update(self, player_tag, clan_tag):
-        async with self.last_updated_batch_lock:
-            self.boards_counter[clan_tag] += 1
+    def update(self, player_tag, clan_tag):
+        self.boards_counter[clan_tag] += 1
 
-            if clan_tag:
-                self.last_updated_counter[(player_tag, clan_tag)] += 1
-            self.last_updated_tags.add(player_tag)
+        if clan_tag:
+            self.last_updated_counter[(player_tag, clan_tag)] += 1
+        self.last_updated_tags.add(player_tag)
 
-    # @coc_client.event
-    @coc.ClanEvents.member_name()
-    @coc.ClanEvents.member_donations()
-    @coc.ClanEvents.member_versus_trophies()
-    @coc.ClanEvents.member_exp_level()
-    @coc.ClanEvents.member_donations()
-    @coc.ClanEvents.member_received()
     async def on_member_update(self, old_player, player):
         log.debug("received update for clan members.")
-        await self.update(player.tag, player.clan and player.clan.tag)
+        self.update(player.tag, player.clan and player.clan.tag)
 
-    # @coc_client.event
-    @coc.ClanEvents.member_join()
     async def on_clan_member_join(self, member, clan):
-        player_query = """INSERT INTO players (
-                                            player_tag, 
-                                            donations, 
-                                            received, 
-                                            trophies, 
-                                            start_trophies, 
-                                            season_id,
-                                            clan_tag,
-                                            player_name,
-                                            best_trophies,
-                                            legend_trophies
-                                            ) 
-                        VALUES ($1,$2,$3,$4,$4,$5, $6,$7,$8,$9) 
-                        ON CONFLICT (player_tag, season_id) 
-                        DO UPDATE SET clan_tag = $6, best_trophies = $8, legend_trophies = $9
-                    """
-
-        member = await coc_client.get_player(member.tag)
-        response = await pool.execute(
-            player_query,
-            member.tag,
-            member.donations,
-            member.received,
-            member.trophies,
-            self.season_id,
-            clan.tag,
-            member.name,
-            member.best_trophies,
-            member.legend_statistics and member.legend_statistics.legend_trophies or 0
-        )
-        log.debug(f"ran player joined for player {member} of clan {clan}")
-        return
-        player = await coc_client.get_player(member.tag)
-        player_query = """INSERT INTO players (
-                                        player_tag, 
-                                        donations, 
-                                        received, 
-                                        trophies, 
-                                        start_trophies, 
-                                        season_id,
-                                        start_friend_in_need,
-                                        start_sharing_is_caring,
-                                        start_attacks,
-                                        start_defenses,
-                                        start_best_trophies,
-                                        start_update,
-                                        clan_tag,
-                                        player_name
-                                        ) 
-                    VALUES ($1,$2,$3,$4,$4,$5,$6,$7,$8,$9,$10,True, $11, $12) 
-                    ON CONFLICT (player_tag, season_id) 
-                    DO UPDATE SET clan_tag = $11
-                """
+        # whatever clan they left before this, joining sets their clan tag anyway.
+        self.pending_leaves.pop(member.tag, None)
+        self.pending_joins[member.tag] = clan.tag
+        log.debug(f"queued player joined for player {member} of clan {clan}")
+
+        if self._join_flush_handle is None:
+            # normally the clan loop flush picks this up, but don't leave a lone join waiting on a slow loop.
+            self._join_flush_handle = self.loop.call_later(
+                JOIN_MAX_LATENCY, lambda: asyncio.ensure_future(self.flush_member_changes())
+            )
 
-        response = await pool.execute(
-            player_query,
-            player.tag,
-            player.donations,
-            player.received,
-            player.trophies,
-            SEASON_ID,
-            player.get_achievement('Friend in Need').value,
-            player.get_achievement('Sharing is caring').value,
-            player.attack_wins,
-            player.defense_wins,
-            player.best_trophies,
-            clan.tag,
-            player.name
-        )
-        log.debug(f'New member {member} joined clan {clan}. Performed a query to insert them into players. '
-                  f'Status Code: {response}')
-        return
-
-        query = """SELECT events.id 
-                   FROM events 
-                   INNER JOIN clans 
-                   ON clans.guild_id = events.guild_id 
-                   WHERE clans.clan_tag = $1
-                   AND events.start <= now()
-                   AND events.finish >= now()
+    async def flush_member_changes(self):
+        """Flush the pending joins, then leaves, through the pipeline without waiting for the clan loop."""
+        # the lock keeps this from interleaving with a clan loop flush of the same players.
+        async with self.flush_lock:
+            timings = await self.flush_pipeline.run(only=('member_joins', 'member_leaves'))
+        self.record_stage_metrics(timings)
+
+    async def flush_member_joins(self):
+        query = """INSERT INTO players (
+                                    player_tag,
+                                    donations,
+                                    received,
+                                    trophies,
+                                    start_trophies,
+                                    season_id,
+                                    clan_tag,
+                                    player_name,
+                                    best_trophies,
+                                    legend_trophies
+                                    )
+                   SELECT x.player_tag, x.donations, x.received, x.trophies, x.trophies, $2, x.clan_tag, x.player_name, x.best_trophies, x.legend_trophies
+                   FROM jsonb_to_recordset($1::jsonb)
+                   AS x(
+                       player_tag TEXT,
+                       donations INTEGER,
+                       received INTEGER,
+                       trophies INTEGER,
+                       clan_tag TEXT,
+                       player_name TEXT,
+                       best_trophies INTEGER,
+                       legend_trophies INTEGER
+                   )
+                   ON CONFLICT (player_tag, season_id)
+                   DO UPDATE SET clan_tag = excluded.clan_tag, best_trophies = excluded.best_trophies, legend_trophies = excluded.legend_trophies
                 """
-        fetch = await pool.fetch(query, clan.tag)
-        if not fetch:
+        if self._join_flush_handle is not None:
+            self._join_flush_handle.cancel()
+            self._join_flush_handle = None
+
+        joins, self.pending_joins = self.pending_joins, {}
+        if not joins:
             return
 
-        event_query = """INSERT INTO eventplayers (
-                                            player_tag,
-                                            trophies,
-                                            event_id,
-                                            start_friend_in_need,
-                                            start_sharing_is_caring,
-                                            start_attacks,
-                                            start_defenses,
-                                            start_trophies,
-                                            start_best_trophies,
-                                            start_update,
-                                            live
-                                            )
-                            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, True, True)
-                            ON CONFLICT (player_tag, event_id)
-                            DO UPDATE 
-                            SET live=True
-                            WHERE eventplayers.player_tag = $1
-                            AND eventplayers.event_id = $2
-                        """
-
-        for n in fetch:
-            response = await pool.execute(
-                event_query,
-                player.tag,
-                player.trophies,
-                n['id'],
-                player.get_achievement('Friend in Need').value,
-                player.get_achievement('Sharing is caring').value,
-                player.attack_wins,
-                player.defense_wins,
-                player.trophies,
-                player.best_trophies
-              )
-
-            log.debug(f'New member {member} joined clan {clan}. '
-                      f'Performed a query to insert them into eventplayers. Status Code: {response}')
+        try:
+            to_insert = []
+            async for player in coc_client.get_players(joins.keys()):
+                to_insert.append({
+                    'player_tag': player.tag,
+                    'donations': player.donations,
+                    'received': player.received,
+                    'trophies': player.trophies,
+                    'clan_tag': joins[player.tag],
+                    'player_name': player.name,
+                    'best_trophies': player.best_trophies,
+                    'legend_trophies': player.legend_statistics and player.legend_statistics.legend_trophies or 0,
+                })
+
+            await pool.execute(query, to_insert, self.season_id)
+        except:
+            # anything that's joined or left since takes precedence over what we failed to insert
+            joins = {k: v for k, v in joins.items() if k not in self.pending_leaves}
+            self.pending_joins = {**joins, **self.pending_joins}
+            raise
+
+        log.debug(f"ran player joined for {len(to_insert)} players")
 
-    # @coc_client.event
-    @coc.ClanEvents.member_leave()
     async def on_clan_member_leave(self, member, clan):
-        query = "UPDATE players SET clan_tag = null where player_tag = $1 AND season_id = $2"
-        await pool.execute(query, member.tag, self.season_id)
+        joined = self.pending_joins.get(member.tag)
+        if joined == clan.tag:
+            # joined and left within the same loop, so there's nothing to insert.
+            del self.pending_joins[member.tag]
+        elif joined:
+            return  # they've moved to another of our clans and the pending join will set their clan tag.
+
+        self.pending_leaves[member.tag] = clan.tag
+
+    async def flush_member_leaves(self):
+        query = "UPDATE players SET clan_tag = null WHERE player_tag = ANY($1::TEXT[]) AND season_id = $2"
+
+        leaves, self.pending_leaves = self.pending_leaves, {}
+        if not leaves:
+            return
+
+        try:
+            await pool.execute(query, list(leaves.keys()), self.season_id)
+        except:
+            leaves = {k: v for k, v in leaves.items() if k not in self.pending_joins}
+            self.pending_leaves = {**leaves, **self.pending_leaves}
+            raise
 
     # @tasks.loop(seconds=60.0)
     # async def update_clan_tags(self):
@@ -958,158 +839,108 @@ class Syncer:
     @tasks.loop(seconds=120.0)
     async def send_stats(self):
         try:
-            stats = coc_client.http.stats.items()
-            if len(stats) > 2:
-                columns = 2
-                rows = math.ceil(len(stats) / 2)
-            else:
-                columns = 1
-                rows = len(stats)
-
-            if len(stats) == 1:
-                fig, axs = plt.subplots(rows, columns)
-                axs = [axs]
-            else:
-                fig, (*axs, ) = plt.subplots(rows, columns)
-
-            for i, (key, values) in enumerate(stats):
-                axs[i].bar(range(len(values)), list(values), color="blue")
-                axs[i].set_ylabel(key)
-            fig.suptitle(f"Latency for last minute to {datetime.datetime.utcnow().strftime('%H:%M %d/%m')}")
-            b = io.BytesIO()
-            plt.savefig(b, format='png')
-            b.seek(0)
-            await next(bot.error_webhooks).send(file=discord.File(b, f'cocapi.png'))
-            plt.close()
+            stats = {key: list(values) for key, values in coc_client.http.stats.items()}
+            if not stats:
+                return
+            title = f"Latency for last minute to {datetime.datetime.utcnow().strftime('%H:%M %d/%m')}"
+            png = await chart_worker.render(latency_chart, stats, title)
+            await next(bot.error_webhooks).send(file=discord.File(io.BytesIO(png), f'cocapi.png'))
         except Exception:
             log.exception("sending stats")
 
-    @tasks.loop(hours=1.0)
-    async def sync_temp_event_tasks(self):
-        # await bot.wait_until_ready()
-        query = """SELECT channel_id, type 
-                   FROM logs 
-                   WHERE toggle = True 
-                   AND "interval" > make_interval()
-                """
-        fetch = await pool.fetch(query)
-        for n in fetch:
-            channel_id, type_ = n[0], n[1]
-            key = (channel_id, type_)
-            log.debug(f'Syncing task for Channel ID {key}')
-            task = self._log_tasks.get(key)
-            if not task:
-                log.debug(f'Task has not been created. Creating it. Channel ID: {key}')
-                self._log_tasks[key] = bot.loop.create_task(self.create_temp_event_task(channel_id, type_))
-                continue
-            elif task.done():
-                log.info(task.get_stack())
-                log.info(f'Task has already been completed, recreating it. Channel ID: {key}')
-                self._log_tasks[key] = bot.loop.create_task(self.create_temp_event_task(channel_id, type_))
-                continue
-            else:
-                log.debug(f'Task has already been sucessfully registered for Channel ID {channel_id}')
-
-        to_cancel = [n for n in self._log_tasks.keys() if n not in set((n[0], n[1]) for n in fetch)]
-        for n in to_cancel:
-            log.debug(f'Channel events have been removed from DB. Destroying task. Channel ID: {n}')
-            task = self._log_tasks.pop(n)
-            task.cancel()
+    @tasks.loop(minutes=10.0)
+    async def reconcile_log_routes(self):
+        await self.log_routes.reconcile()
 
-        log.info(f'Successfully synced {len(fetch)} channel tasks.')
+    @tasks.loop(hours=1.0)
+    async def reconcile_subscriptions(self):
+        await self.subscriptions.reconcile()
+
+    def forget_clans(self, clan_tags):
+        for clan_tag in clan_tags:
+            coc_client._clans.pop(clan_tag, None)
+            coc_client._locks.pop(f"clan:{clan_tag}", None)
+            self.member_snapshots.forget(clan_tag)
+        log.info('dropped cached data for %s clans no longer polled', len(clan_tags))
+
+    @tasks.loop(minutes=10.0)
+    async def report_cache_stats(self):
+        bot.google_logger.log_struct(dict(
+            type='coc_cache',
+            clans=coc_client._clans.stats(),
+            players=coc_client._players.stats(),
+            member_snapshots=len(self.member_snapshots),
+        ))
+
+    @tasks.loop(hours=6.0)
+    async def refresh_activity_profiles(self):
+        # activity_query is only synced once a day, so there's no point reading it more often than this.
+        await self.poll_schedule.load_profile()
+
+    @tasks.loop(seconds=SHARD_REBALANCE_INTERVAL)
+    async def rebalance_shards(self):
+        await self.shard.rebalance()
+
+    async def send_interval_log(self, config, items):
+        if config.type == "donation" and config.detailed:
+            embeds = []
+
+            for clan_tag, events in itertools.groupby(sorted(items, key=lambda x: x[0]), key=lambda x: x[0]):
+                events = list(events)
+
+                events_fmt = {
+                    "exact": [],
+                    "combo": [],
+                    "unknown": []
+                }
+                for _, exact, combo, unknown in events:
+                    events_fmt["exact"].extend(exact.split('\n'))
+                    events_fmt["combo"].extend(combo.split('\n'))
+                    events_fmt["unknown"].extend(unknown.split('\n'))
 
-    async def fetch_config(self, channel_id, type):
-        fetch = await pool.fetchrow("SELECT * FROM logs WHERE channel_id = $1 AND type = $2", channel_id, type)
-        return fetch and LogConfig(record=fetch, bot=None)
+                p = LineWrapper()
+                p.add_lines(get_events_fmt(events_fmt))
 
-    async def create_temp_event_task(self, channel_id, type_):
-        try:
-            while True:
-                config = await self.fetch_config(channel_id, type_)
-                if not config:
-                    log.critical(f'Requested a task creation for channel id {channel_id} {type_} but config was not found.')
-                    return
-
-                await asyncio.sleep(config.seconds)
-                config = await self.fetch_config(channel_id, type_)
-
-                if type_ == "donation" and config.detailed:
-                    query = "DELETE FROM detailedtempevents WHERE channel_id = $1 RETURNING clan_tag, exact, combo, unknown"
-                    fetch = await pool.fetch(query, channel_id)
-
-                    if not fetch:
-                        continue
-
-                    embeds = []
-
-                    for clan_tag, events in itertools.groupby(sorted(fetch, key=lambda x: x['clan_tag']),
-                                                              key=lambda x: x['clan_tag']):
-                        events = list(events)
-
-                        events_fmt = {
-                            "exact": [],
-                            "combo": [],
-                            "unknown": []
-                        }
-                        for n in events:
-                            events_fmt["exact"].extend(n['exact'].split('\n'))
-                            events_fmt["combo"].extend(n['combo'].split('\n'))
-                            events_fmt["unknown"].extend(n['unknown'].split('\n'))
-
-                        p = LineWrapper()
-                        p.add_lines(get_events_fmt(events_fmt))
-
-                        try:
-                            clan = await coc_client.get_clan(clan_tag)
-                        except coc.NotFound:
-                            log.exception(f'{clan_tag} not found')
-                            continue
-
-                        hex_ = bytes.hex(str.encode(clan.tag))[:20]
-
-                        for page in p.pages:
-                            e = discord.Embed(
-                                colour=int(int(''.join(filter(lambda x: x.isdigit(), hex_))) ** 0.3),
-                                description=page
-                            )
-                            e.set_author(name=f"{clan.name} ({clan.tag})", icon_url=clan.badge.url)
-                            e.set_footer(text="Reported").timestamp = datetime.datetime.utcnow()
-                            embeds.append(e)
-
-                    for n in embeds:
-                        bot.message_log.log_struct(
-                            dict(
-                                guild_id=config.guild_id,
-                                channel_id=channel_id,
-                                type='{}log'.format(type_),
-                            )
-                        )
-                        asyncio.ensure_future(self.safe_send(config.channel_id, embed=n))
+                try:
+                    clan = await coc_client.get_clan(clan_tag)
+                except coc.NotFound:
+                    log.exception(f'{clan_tag} not found')
+                    continue
 
-                else:
-                    query = "DELETE FROM tempevents WHERE channel_id = $1 AND type = $2 RETURNING fmt"
-                    fetch = await pool.fetch(query, channel_id, type_)
-                    p = LineWrapper()
-
-                    for n in fetch:
-                        p.add_lines(n[0].split("\n"))
-                    for page in p.pages:
-                        bot.message_log.log_struct(
-                            dict(
-                                guild_id=config.guild_id,
-                                channel_id=channel_id,
-                                type='{}log'.format(type_),
-                            )
-                        )
-                        asyncio.ensure_future(self.safe_send(config.channel_id, page))
+                hex_ = bytes.hex(str.encode(clan.tag))[:20]
 
-        except asyncio.CancelledError:
-            raise
-        except:
-            log.exception(f'Exception encountered while running task for {channel_id} {type_}')
-            self._log_tasks[(channel_id, type_)].cancel()
-            self._log_tasks[(channel_id, type_)] = bot.loop.create_task(self.create_temp_event_task(channel_id, type_))
+                for page in p.pages:
+                    e = discord.Embed(
+                        colour=int(int(''.join(filter(lambda x: x.isdigit(), hex_))) ** 0.3),
+                        description=page
+                    )
+                    e.set_author(name=f"{clan.name} ({clan.tag})", icon_url=clan.badge.url)
+                    e.set_footer(text="Reported").timestamp = datetime.datetime.utcnow()
+                    embeds.append(e)
+
+            for n in embeds:
+                bot.message_log.log_struct(
+                    dict(
+                        guild_id=config.guild_id,
+                        channel_id=config.channel_id,
+                        type='{}log'.format(config.type),
+                    )
+                )
+                self.sender.send(config.channel_id, embed=n)
 
+        else:
+            p = LineWrapper()
+            for n in items:
+                p.add_lines(n.split("\n"))
+            for page in p.pages:
+                bot.message_log.log_struct(
+                    dict(
+                        guild_id=config.guild_id,
+                        channel_id=config.channel_id,
+                        type='{}log'.format(config.type),
+                    )
+                )
+                self.sender.send(config.channel_id, page)
 
 if __name__ == "__main__":
     asyncio.get_event_loop().run_until_complete(bot.login(creds.bot_token))
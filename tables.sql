@@ -247,7 +247,8 @@ create table tempevents (
     id serial primary key,
     channel_id bigint,
     fmt text,
-    type text
+    type text,
+    shard text
 );
 create index channel_id_idx on tempevents (channel_id);
 
@@ -257,7 +258,8 @@ create table detailedtempevents (
     clan_tag text,
     exact text,
     combo text,
-    unknown text
+    unknown text,
+    shard text
 );
 
 CREATE TABLE seasons (
@@ -449,4 +451,78 @@ END;
 $function$
 ;
 
-CREATE OR REPLACE FUNCTION "public".get_donationlog_channels()
+CREATE OR REPLACE FUNCTION public.notify_log_routes()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+begin
+    -- the syncer keeps an in-memory clan -> log channel routing table, and re-reads a channel's routes when told.
+    if TG_OP <> 'INSERT' then
+        perform pg_notify('log_routes', OLD.channel_id::text);
+    end if;
+    if TG_OP <> 'DELETE' then
+        perform pg_notify('log_routes', NEW.channel_id::text);
+    end if;
+    return null;
+end;
+$function$
+;
+
+CREATE TRIGGER logs_notify_log_routes
+AFTER INSERT OR UPDATE OR DELETE ON logs
+FOR EACH ROW EXECUTE PROCEDURE public.notify_log_routes();
+
+CREATE TRIGGER clans_notify_log_routes
+AFTER INSERT OR DELETE OR UPDATE OF clan_tag, channel_id ON clans
+FOR EACH ROW EXECUTE PROCEDURE public.notify_log_routes();
+
+CREATE OR REPLACE FUNCTION public.notify_clan_subscriptions()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+begin
+    -- tells the syncer which clans to start or stop polling, see cogs/utils/subscriptions.py
+    if TG_OP <> 'INSERT' then
+        perform pg_notify('clan_subscriptions', json_build_object('op', 'remove', 'clan_tag', OLD.clan_tag)::text);
+    end if;
+    if TG_OP <> 'DELETE' then
+        perform pg_notify('clan_subscriptions', json_build_object('op', 'add', 'clan_tag', NEW.clan_tag)::text);
+    end if;
+    return null;
+end;
+$function$
+;
+
+CREATE TRIGGER clans_notify_clan_subscriptions
+AFTER INSERT OR DELETE OR UPDATE OF clan_tag ON clans
+FOR EACH ROW EXECUTE PROCEDURE public.notify_clan_subscriptions();
+
+-- one row per legend day once it's been closed and the next day's rows created, see cogs/utils/legend_days.py
+CREATE TABLE public.legend_day_finalisations (
+	"day" timestamp NOT NULL,
+	finalised_at timestamp NULL,
+	CONSTRAINT legend_day_finalisations_pkey PRIMARY KEY (day)
+);
+
+-- progress of copying players into a new season, see cogs/utils/season_rollover.py
+CREATE TABLE public.season_rollovers (
+	season_id integer NOT NULL,
+	from_season_id integer NOT NULL,
+	last_player_tag text NOT NULL DEFAULT '',
+	copied integer NOT NULL DEFAULT 0,
+	started_at timestamp NULL,
+	finished_at timestamp NULL,
+	CONSTRAINT season_rollovers_pkey PRIMARY KEY (season_id)
+);
+
+-- which player is at each rank of a board, rebuilt when the board's players change, see cogs/utils/board_ranks.py
+CREATE TABLE public.board_ranks (
+	channel_id bigint NOT NULL,
+	season_id integer NOT NULL,
+	board_type text NOT NULL,
+	sort_by text NOT NULL,
+	legend_day timestamp NOT NULL DEFAULT '-infinity',
+	"rank" integer NOT NULL,
+	player_tag text NOT NULL,
+	CONSTRAINT board_ranks_pkey PRIMARY KEY (channel_id, season_id, board_type, sort_by, legend_day, rank)
+);
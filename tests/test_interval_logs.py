@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+
+from datetime import timedelta
+from types import SimpleNamespace
+
+from cogs.utils.interval_logs import IntervalLogScheduler
+
+
+def make_config(channel_id, log_type, detailed=False):
+    return SimpleNamespace(channel_id=channel_id, type=log_type, detailed=detailed, seconds=timedelta(minutes=5).total_seconds())
+
+
+class FakeRoutes:
+    def __init__(self, configs):
+        self.version = 1
+        self.configs = configs
+
+    def interval_configs(self):
+        return dict(self.configs)
+
+    def change(self, configs):
+        self.version += 1
+        self.configs = configs
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+
+    def transaction(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, *args):
+        self.executed.append((query, args))
+
+    async def copy_records_to_table(self, table, records, columns):
+        pass
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+
+    def acquire(self):
+        return self.conn
+
+
+class RemovedLogTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = FakePool()
+        self.routes = FakeRoutes({
+            (1, 'trophy'): make_config(1, 'trophy'),
+            (2, 'donation'): make_config(2, 'donation', detailed=True),
+            (3, 'donation'): make_config(3, 'donation'),
+        })
+        self.scheduler = IntervalLogScheduler(self.pool, self.routes, dispatch=None)
+        self.buffer = self.scheduler.buffer
+
+        self.buffer.add(1, 'trophy', 'checkpointed')
+        self.buffer.add_detailed(2, '#CLAN', {'exact': ['checkpointed'], 'combo': [], 'unknown': []})
+        self.buffer.add(3, 'donation', 'kept')
+        self.scheduler._sync(0)
+        asyncio.run(self.buffer.checkpoint())
+        self.pool.conn.executed.clear()
+
+    def test_removed_logs_lose_their_lines_and_checkpoint_rows(self):
+        self.buffer.add(1, 'trophy', 'pending')
+        self.routes.change({(3, 'donation'): make_config(3, 'donation')})
+        self.scheduler._sync(1)
+
+        self.assertEqual(set(self.buffer.plain), {(3, 'donation')})
+        self.assertEqual(self.buffer.detailed, {})
+
+        asyncio.run(self.buffer.checkpoint())
+        deletes = [args for query, args in self.pool.conn.executed]
+        self.assertIn(((1, ), ('trophy', ), None), deletes)
+        self.assertIn(([2], None), deletes)
+
+    def test_detailed_toggle_drops_the_other_buffer(self):
+        self.routes.change({
+            (1, 'trophy'): make_config(1, 'trophy'),
+            (2, 'donation'): make_config(2, 'donation', detailed=False),
+            (3, 'donation'): make_config(3, 'donation'),
+        })
+        self.scheduler._sync(1)
+
+        self.assertEqual(set(self.buffer.plain), {(1, 'trophy'), (3, 'donation')})
+        self.assertEqual(self.buffer.detailed, {})
+        self.assertEqual(self.buffer._detailed_sent, {2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import hashlib
+import unittest
+
+from datetime import timedelta
+
+from cogs.utils.log_routing import LogRoutingTable, checksum_line
+
+
+def route(channel_id, clan_tag, interval, log_type, detailed, guild_id=456):
+    return {
+        'channel_id': channel_id,
+        'clan_tag': clan_tag,
+        'guild_id': guild_id,
+        'interval': interval,
+        'toggle': True,
+        'type': log_type,
+        'detailed': detailed,
+    }
+
+
+class ChecksumTests(unittest.TestCase):
+    # what CHECKSUM_QUERY's concat_ws gives for the same rows in postgres.
+    def test_line_matches_sql(self):
+        self.assertEqual(
+            checksum_line(route(123, '#ABC', timedelta(minutes=5, microseconds=500), 'donation', True)),
+            '123|#ABC|456|300|donation|1'
+        )
+        self.assertEqual(
+            checksum_line(route(123, '#ABC', None, 'trophy', None, guild_id=None)),
+            '123|#ABC|0|0|trophy|0'
+        )
+
+    def test_table_digest_matches_sql(self):
+        table = LogRoutingTable(pool=None, listener=None)
+        table._channel_rows = {
+            123: [route(123, '#ABC', timedelta(minutes=5), 'donation', True)],
+            99: [route(99, '#XYZ', timedelta(0), 'trophy', False)],
+        }
+        expected = hashlib.md5(b'123|#ABC|456|300|donation|1\n99|#XYZ|456|0|trophy|0').hexdigest()
+        self.assertEqual(table.checksum(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
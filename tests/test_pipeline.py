@@ -0,0 +1,30 @@
+import asyncio
+import unittest
+
+from cogs.utils.pipeline import FlushPipeline
+
+
+class PartialRunTests(unittest.TestCase):
+    def test_only_runs_the_named_stages_in_order(self):
+        ran = []
+
+        def stage(name, delay=0):
+            async def func():
+                await asyncio.sleep(delay)
+                ran.append(name)
+            return func
+
+        pipeline = FlushPipeline()
+        pipeline.add_stage('board_insert', stage('board_insert'))
+        pipeline.add_stage('member_joins', stage('member_joins', delay=0.01), depends_on=('board_insert', ))
+        pipeline.add_stage('member_leaves', stage('member_leaves'), depends_on=('member_joins', ))
+
+        timings = asyncio.run(pipeline.run(only=('member_joins', 'member_leaves')))
+
+        self.assertEqual(ran, ['member_joins', 'member_leaves'])
+        self.assertEqual([t.name for t in timings], ['member_joins', 'member_leaves'])
+        self.assertEqual(pipeline.last_timings, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import asyncio
+import unittest
+
+from unittest import mock
+
+from cogs.utils import season_rollover
+from cogs.utils.season_rollover import SeasonRollover
+
+
+class FakePool:
+    async def fetchrow(self, query, season_id):
+        return {'from_season_id': season_id - 1, 'finished_at': None}
+
+
+class FollowTests(unittest.TestCase):
+    def test_takes_over_when_it_becomes_leader(self):
+        rollover = SeasonRollover(FakePool())
+        checks = []
+
+        def is_leader():
+            checks.append(rollover.active.get(20))
+            return len(checks) > 2
+
+        async def follow():
+            with mock.patch.object(season_rollover, 'FOLLOW_INTERVAL', 0), \
+                    mock.patch.object(rollover, 'run', mock.AsyncMock()) as run:
+                await asyncio.wait_for(rollover.follow(20, is_leader=is_leader), 1)
+            return run
+
+        run = asyncio.run(follow())
+        run.assert_awaited_once_with(20, 19)
+        self.assertEqual(checks, [None, 19, 19])
+
+
+if __name__ == '__main__':
+    unittest.main()
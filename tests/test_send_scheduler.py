@@ -0,0 +1,46 @@
+import asyncio
+import time
+import unittest
+
+from cogs.utils.send_scheduler import SendScheduler
+
+
+class BucketPruningTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.sent = []
+
+        async def send(channel_id, content, embed=None):
+            self.sent.append((channel_id, content))
+
+        self.scheduler = SendScheduler(send, max_concurrency=1)
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.loop.run_until_complete(asyncio.gather(*self.scheduler._workers, return_exceptions=True))
+        self.loop.close()
+
+    def drain(self):
+        async def run():
+            self.scheduler.start()
+            while self.scheduler.pending or len(self.sent) < 2:
+                await asyncio.sleep(0)
+        self.loop.run_until_complete(asyncio.wait_for(run(), 1))
+
+    def test_idle_buckets_are_dropped_once_reset(self):
+        self.scheduler.send(1, 'a')
+        self.scheduler.send(2, 'b')
+        self.drain()
+        self.assertEqual(set(self.scheduler.buckets), {1, 2})
+
+        # still inside the rate limit window: dropping them would hand out a fresh 5 messages early.
+        self.assertEqual(self.scheduler.prune_buckets(time.monotonic()), 0)
+
+        self.scheduler.queues[2] = ['queued']
+        self.assertEqual(self.scheduler.prune_buckets(time.monotonic() + 10), 1)
+        self.assertEqual(set(self.scheduler.buckets), {2})
+
+
+if __name__ == '__main__':
+    unittest.main()